@@ -0,0 +1,145 @@
+import numpy as np
+
+'''Set of functions for replacing runs of short segments that follow a circular arc
+with single arc moves (G2/G3 in G-code).
+
+A circle is fitted to every window of a few consecutive points at once, using the
+algebraic least-squares (Kasa) fit, whose sums over any window come from cumulative
+sums of the points. Runs of windows that fit within tolerance and turn the same way
+are candidate arcs. Each run is then fitted as a whole, with the center moved onto
+the bisector of its end points so both ends lie on the circle, and is split in two
+until the points and the chords between them are within tolerance of the arc.
+'''
+def fitArcs(points, tol=0.01, min_points=4, max_radius=1000.):
+    ''' Returns the arcs found along a path, as a list of tuples of the index of the
+    first and last point of the arc, the center (x, y), and True if the arc runs
+    counter-clockwise. Consecutive arcs may share an end point.
+
+    Inputs
+    ---
+    points : [n x 2] (or [n x 3]) array
+        The points of the path. Only the x and y coordinates are used.
+    tol : float, default: 0.01
+        The largest distance allowed between the arc and the points, or the
+        segments between them
+    min_points : int, default: 4
+        The fewest points replaced by an arc, including its ends
+    max_radius : float, default: 1000
+        The largest radius of an arc. Flatter runs are left as lines.
+    '''
+    pnts = np.asarray(points, dtype=float)[:, 0:2]
+    num_pnts = len(pnts)
+    if num_pnts < min_points: return list()
+    pnts = pnts - pnts.mean(axis=0)
+    sums = np.zeros((num_pnts + 1, 9))
+    sums[1:] = np.cumsum(pointMoments(pnts), axis=0)
+
+    # Windows of min_points points that lie on a circle and turn the same way
+    starts = np.arange(num_pnts - min_points + 1)
+    center, radius, ok = fitCircles(sums[starts + min_points] - sums[starts], min_points)
+    window = pnts[starts[:, None] + np.arange(min_points)]
+    good = ok & (radius <= max_radius)
+    good &= arcDeviation(window, center, radius) <= tol
+    turns = np.sign(cross2D(np.diff(window[:, :-1], axis=1), np.diff(window[:, 1:], axis=1)))
+    direction = np.where((turns == turns[:, 0:1]).all(axis=1), turns[:, 0], 0)
+    good &= direction != 0
+
+    arcs = list()
+    last = 0
+    for first_window, last_window in findRuns(good, direction):
+        i = max(first_window, last)
+        j = last_window + min_points - 1
+        for arc in splitRun(pnts, sums, i, j, tol, min_points, max_radius):
+            arcs.append(arc)
+            last = arc[1]
+    mean = np.asarray(points, dtype=float)[:, 0:2].mean(axis=0)
+    return [(i, j, tuple(c + mean), ccw) for i, j, c, ccw in arcs]
+
+def findRuns(good, direction):
+    ''' Returns the (first, last) indices of each run of good windows that turn the
+    same way.'''
+    key = np.where(good, direction, 0)
+    change = np.flatnonzero(np.diff(key) != 0) + 1
+    bounds = np.concatenate([[0], change, [len(key)]])
+    return [(a, b - 1) for a, b in zip(bounds[:-1].tolist(), bounds[1:].tolist()) if key[a] != 0]
+
+def splitRun(pnts, sums, i, j, tol, min_points, max_radius):
+    ''' Returns the arcs covering the points from i to j, as a list of tuples of
+    the first and last point index, the center and the direction. The run is split
+    in two (sharing the middle point) until each part fits within tol.'''
+    if j - i + 1 < min_points: return list()
+    arc = fitArc(pnts, sums, i, j, tol, max_radius)
+    if arc != None: return [arc]
+    mid = (i + j) // 2
+    return (splitRun(pnts, sums, i, mid, tol, min_points, max_radius) +
+            splitRun(pnts, sums, mid, j, tol, min_points, max_radius))
+
+def fitArc(pnts, sums, i, j, tol, max_radius):
+    ''' Returns the arc through the points from i to j as a tuple of (i, j, center,
+    counter-clockwise), or None if no arc of less than half a turn passes within tol
+    of the points. The fitted center is moved onto the bisector of the end points.'''
+    center, radius, ok = fitCircles((sums[j + 1] - sums[i])[None, :], j - i + 1)
+    if not ok[0] or radius[0] > max_radius: return None
+    start, end = pnts[i], pnts[j]
+    mid = (start + end) / 2
+    normal = np.array([start[1] - end[1], end[0] - start[0]])
+    if not normal.any(): return None
+    normal /= np.linalg.norm(normal)
+    center = mid + np.dot(center[0] - mid, normal) * normal
+    radius = np.linalg.norm(start - center)
+    run = pnts[i:j + 1]
+    if arcDeviation(run[None, :, :], center[None, :], np.array([radius]))[0] > tol: return None
+    ccw = cross2D(end - start, center - start) > 0
+    # The arc takes the shorter way around, so all the points must lie on that side
+    side = cross2D(end - start, run[1:-1] - start)
+    if ((side > 0) == ccw).any(): return None
+    if np.dot(center - mid, normal * (1 if ccw else -1)) <= 0: return None
+    return (i, j, center, bool(ccw))
+
+def arcLength(start, end, center):
+    ''' Returns the lengths of the arcs of less than half a turn from the [n x 2]
+    start points to the end points about the centers.'''
+    radius = np.linalg.norm(start - center, axis=1)
+    chord = np.linalg.norm(end - start, axis=1)
+    return 2 * radius * np.arcsin(np.clip(chord / (2 * radius), 0, 1))
+
+# Service Functions
+def pointMoments(pnts):
+    ''' Returns the terms of the least-squares circle fit for each point: x, y, x^2,
+    xy, y^2, 1, and z*x, z*y, z where z = x^2 + y^2.'''
+    x, y = pnts[:, 0], pnts[:, 1]
+    z = x**2 + y**2
+    return np.column_stack([x, y, x*x, x*y, y*y, np.ones(len(x)), z*x, z*y, z])
+
+def fitCircles(sums, num_pnts):
+    ''' Solves the least-squares circle fit for each row of summed moments (see
+    pointMoments). Returns the centers as an [m x 2] array, the radii, and a mask
+    that is False where the points are collinear.'''
+    sx, sy, sxx, sxy, syy, n, szx, szy, sz = sums.T
+    A = np.stack([np.stack([sxx, sxy, sx], axis=1),
+                  np.stack([sxy, syy, sy], axis=1),
+                  np.stack([sx, sy, n], axis=1)], axis=1)
+    b = -np.stack([szx, szy, sz], axis=1)
+    det = np.linalg.det(A)
+    scale = np.abs(A).max(axis=(1, 2))**3
+    ok = np.abs(det) > 1e-12 * np.where(scale == 0, 1, scale)
+    A[~ok] = np.eye(3)
+    D, E, F = np.linalg.solve(A, b[:, :, None])[:, :, 0].T
+    center = np.column_stack([-D / 2, -E / 2])
+    r2 = (center**2).sum(axis=1) - F
+    ok &= r2 > 0
+    return center, np.sqrt(np.where(ok, r2, 0)), ok
+
+def arcDeviation(window, center, radius):
+    ''' Returns the largest distance between the circle of each [k x 2] window and
+    its points or the chords between them, for an [m x k x 2] batch of windows.'''
+    dist = np.linalg.norm(window - center[:, None, :], axis=2)
+    off = np.abs(dist - radius[:, None]).max(axis=1)
+    half = np.linalg.norm(np.diff(window, axis=1), axis=2).max(axis=1) / 2
+    sagitta = radius - np.sqrt(np.maximum(radius**2 - half**2, 0))
+    return off + sagitta
+
+def cross2D(a, b):
+    ''' Returns the z component of the cross product of 2D vectors (the last axis of
+    a and b), broadcasting over the other axes.'''
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
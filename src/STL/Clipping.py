@@ -1,161 +1,96 @@
 import numpy as np
 
-from src.STL.ReadSTL import STL, STL_Facet
+from src.STL.ReadSTL import STL
 
-def clipping(stl: STL, windowSize : tuple):
+'''Set of functions for clipping an STL to a box shaped build volume.
+
+All triangles are classified against the box in a single vectorized pass. Triangles
+entirely inside are kept without copying (the result is a view over the original
+mesh) and triangles entirely outside are dropped, so only the triangles that
+straddle the box are clipped. These are clipped together, one plane of the box at
+a time (Sutherland-Hodgman), and the resulting convex polygons are split back into
+triangles with a fan from their first vertex.
+'''
+def clipping(stl: STL, windowSize : tuple, tol=1e-8):
     """
     Clips the triangles in STL to the given window
     Input: STL: an STL object from STL.ReadSTL that will be clipped
            windowSize: tuple containing the max (x, y, z) dimmensions of the window
-    Output: newSTL: new STL object of the clipped original object
+           tol: distance a vertex may lie outside the window and still be inside
+    Output: newSTL: new STL object of the clipped original object, as a view that
+            shares the faces kept from the original
     """
-    
-    debugIter = 0
-    ogSTL = stl
-    newSTL = stl
-
-    def addFace(face: STL_Facet):
-        #subfunction to add a new face to the existing STL or make a new one if one hasn't been made yet
-        if (newSTL is ogSTL):
-            return STL.emptyCopy(newSTL, facet = face)
-        else:
-            newSTL.faces.append(face)
-            return newSTL
-
-    def CS(p1):
-        #Store Cohen-Sutherland values in 4th index
-        if (p1[0] < 0): p1[3] += 1
-        elif (p1[0] > windowSize[0]): p1[3] += 2
-        if (p1[1] < 0): p1[3] += 4
-        elif (p1[1] > windowSize[1]): p1[3] += 8
-        if (p1[2] < 0): p1[3] += 16
-        elif (p1[2] > windowSize[2]): p1[3] += 32
-        return p1
-
-
-    def pushPoints(p0, p1, iter):
-        #recursive function that pushes p0 in the direction of p1 until it is within the viewing window
-        """
-        Inputs:
-        p0 = numpy vector of a point that needs to be pushing inbounds
-        p1 = numpy vector of a point that defines the direction of push
-        iter = iterator that represents which dimmension we're focusing on (x, y, z)
-        
-        Outputs:
-        a numpy vector
-        """
-        if (p0[3] == 0):
-            return p0
-        iter = iter % 3
-        newp = p0[0:3]
-        dir = p1[0:3]
-        m = dir - newp
-        n = np.array([[1, 0, 0],[0, 1, 0],[0, 0, 1]])[iter]
-
-        if (newp[iter] < 0):
-            p01 = np.zeros(3)
-        elif (newp[iter] > windowSize[iter]):
-            p01 = np.array(windowSize)
-        else:
-            if (m[iter] < 0):
-                p01 = np.zeros(3)
-            else:
-                p01 = np.array(windowSize)
-
-        if (m.dot(n) != 0):
-            d = ((p01 - newp).dot(n))/m.dot(n)
-            if (0 < d <= 1):
-                newp = newp + m * d
-        newp = CS(np.hstack([newp, 0]))
-        return newp
-
-
-    def uniqueRowOrdered(arr):
-        #takes input numpy array and outputs new numpy array without duplicates, removing the second duplicate
-        newArr = []
-        arr = arr.tolist()
-        for row in arr:
-            if row not in newArr:
-                newArr.append(row)
-        return np.array(newArr)
+    mesh = stl.getMesh()
+    low = np.zeros(3)
+    high = np.array(windowSize, dtype=float)
+    inside, straddling = classifyTriangles(mesh.vertices, low, high, tol)
+    if inside.all(): return stl.derive()
+    clipped, parents = clipTriangles(mesh.vertices[straddling], low, high, tol)
+    return stl.derive(np.flatnonzero(inside), clipped, mesh.normals[straddling][parents])
 
-        
-    for face in ogSTL.getFacets():
-        debugIter += 1
-        verts = face.copyVertices()
-        p1 = verts[0]
-        p2 = verts[1]
-        p3 = verts[2]
-        if (len(p1) < 4):
-            p1.append(0)
-            p2.append(0)
-            p3.append(0)
+def classifyTriangles(vertices, low, high, tol=1e-8):
+    ''' Returns two boolean masks over the [n x 3 x 3] triangles: the triangles
+    entirely inside the box from low to high, and the triangles that straddle its
+    boundary. The remaining triangles are entirely outside the box.'''
+    if len(vertices) == 0: return np.zeros(0, dtype=bool), np.zeros(0, dtype=bool)
+    t_min = vertices.min(axis=1)
+    t_max = vertices.max(axis=1)
+    inside = ((t_min >= low - tol) & (t_max <= high + tol)).all(axis=1)
+    outside = ((t_max < low - tol) | (t_min > high + tol)).any(axis=1)
+    return inside, ~inside & ~outside
 
-        
-        #check if the face is entirely inside or outside the viewing window
+def clipTriangles(vertices, low, high, tol=1e-8):
+    ''' Clips the [n x 3 x 3] triangles to the box from low to high. Returns the
+    triangles of the clipped polygons as an [m x 3 x 3] array and the index of the
+    original triangle that each came from. The vertex order (and so the direction
+    of the normal) of each triangle is kept.'''
+    pnts = np.asarray(vertices, dtype=float)
+    counts = np.full(len(pnts), 3)
+    for axis in range(3):
+        for sign, bound in ((1, low[axis]), (-1, high[axis])):
+            distances = sign * (pnts[:, :, axis] - bound)
+            pnts, counts = clipPolygons(pnts, counts, distances, tol)
+    return fanTriangulate(pnts, counts)
 
-        if ((0 <= round(min([p1[0],p2[0],p3[0]])), 8) and (round(max([p1[0],p2[0],p3[0]]), 8) <= windowSize[0]) and \
-            (0 <= round(min([p1[1],p2[1],p3[1]])), 8) and (round(max([p1[1],p2[1],p3[1]]), 8) <= windowSize[1]) and \
-            (0 <= round(min([p1[2],p2[2],p3[2]])), 8) and (round(max([p1[2],p2[2],p3[2]]), 8) <= windowSize[2])):
-            newSTL = addFace(face)
-            continue
-        elif(round(max([p1[0],p2[0],p3[0]]), 8) < 0 or round(min([p1[0],p2[0],p3[0]]), 8) > windowSize[0] or \
-                round(max([p1[1],p2[1],p3[1]]), 8) < 0 or round(min([p1[1],p2[1],p3[1]]), 8) > windowSize[1] or \
-                round(max([p1[2],p2[2],p3[2]]), 8) < 0 or round(min([p1[2],p2[2],p3[2]]), 8) > windowSize[2]):
-                continue
-        else:
-            p1 = CS(p1)
-            p2 = CS(p2)
-            p3 = CS(p3)
-            if (p1[3] == p2[3] == p3[3] == 0):
-                newSTL = addFace(face)
-            else:
-                
-                #push points one at a time in one direction at a time and create new faces to add to the stl
-                length = 3
-                vertArray = np.array(verts)
-                i = j = 0 #i is for indexing the vertices, j is to prevent infinite while loop
-                while ( i//length < 3 and j < 100 and any(vertArray[:,3] !=0)):
-                    length = len(vertArray)
-                    iter = i % length
-                    if (vertArray[iter,3] != 0):
-                        if (iter == 0):
-                            newPoints = np.vstack([pushPoints(vertArray[0,:], vertArray[-1,:], i//length), pushPoints(vertArray[0,:], vertArray[1,:], i//length)])
-                            vertArray = np.vstack([vertArray[1:length], newPoints])
-                            i = i - 1
-                        elif((i % length) == (length - 1)):
-                            newPoints = np.vstack([pushPoints(vertArray[iter,:], vertArray[iter - 1,:], i//length), pushPoints(vertArray[iter,:], vertArray[0,:], i//length)])
-                            vertArray = np.vstack([vertArray[0:length - 1], newPoints])
-                        else:
-                            newPoints = np.vstack([pushPoints(vertArray[iter,:], vertArray[iter - 1,:], i//length), pushPoints(vertArray[iter,:], vertArray[iter + 1,:], i//length)])
-                            vertArray = np.vstack([vertArray[0:iter], newPoints, vertArray[iter + 1:length]])
-                            
-                        vertArray = uniqueRowOrdered(vertArray)
-                    
-                    i = (i + 1)
-                    
-                    j += 1
-                
-                
-                #skip non-triangles
-                vertArray = vertArray[vertArray[:,3] == 0, 0:3]
-                if (len(vertArray) < 3):
-                    continue
-                
-                #calculate normal (which should be the same for each new triangle in the polygon)
-                verts = vertArray.tolist()
-                Q = np.array(verts[0])
-                R = np.array(verts[1])
-                S = np.array(verts[2])
-                QR = R - Q
-                QS = S - Q
-                normal = np.cross(QR, QS)
-                normal = np.around(normal / (np.sqrt(normal.dot(normal))), decimals = 6) #normalizes vector
-                normal = normal.tolist()
+def clipPolygons(pnts, counts, distances, tol=1e-8):
+    ''' Clips a batch of convex polygons against a plane. The polygons are an
+    [n x k x 3] array padded past the number of vertices in counts, and distances
+    is an [n x k] array of the signed distance of each vertex from the plane
+    (positive inside). Returns the clipped polygons as an [n x (k+1) x 3] array
+    and their new number of vertices.'''
+    n, k = distances.shape
+    slot = np.arange(k)[None, :]
+    valid = slot < counts[:, None]
+    nxt = np.where(slot + 1 < counts[:, None], slot + 1, 0)
+    d_cur = distances
+    d_nxt = np.take_along_axis(distances, nxt, axis=1)
+    p_nxt = np.take_along_axis(pnts, nxt[:, :, None], axis=1)
+    cur_in = d_cur >= -tol
+    nxt_in = d_nxt >= -tol
+    crosses = valid & (cur_in != nxt_in)
+    t = np.divide(d_cur, d_cur - d_nxt, out=np.zeros_like(d_cur), where=crosses)
+    cross_pnts = pnts + t[:, :, None] * (p_nxt - pnts)
 
-                #create the new faces and add them to the new STL that gets outputed
-                for i in range(1, len(verts)%3 + 2):
-                    face = STL_Facet(normal, [verts[0], verts[i], verts[i+1]])
-                    newSTL = addFace(face)
+    # Each edge emits its start point (if inside) followed by its crossing point
+    candidates = np.stack([pnts, cross_pnts], axis=2).reshape(n, 2 * k, 3)
+    keep = np.stack([valid & cur_in, crosses], axis=2).reshape(n, 2 * k)
+    order = np.argsort(~keep, axis=1, kind='stable')[:, :k+1]
+    out = np.take_along_axis(candidates, order[:, :, None], axis=1)
+    return out, keep.sum(axis=1)
 
-    return newSTL
+def fanTriangulate(pnts, counts):
+    ''' Splits each convex polygon of the [n x k x 3] batch into a fan of triangles
+    from its first vertex. Returns the triangles with non-zero area as an
+    [m x 3 x 3] array, and the index of the polygon that each came from.'''
+    triangles = list()
+    parents = list()
+    for i in range(1, pnts.shape[1] - 1):
+        rows = np.flatnonzero(counts > i + 1)
+        triangles.append(pnts[rows][:, [0, i, i + 1]])
+        parents.append(rows)
+    if len(triangles) == 0: return np.zeros((0, 3, 3)), np.zeros(0, dtype=int)
+    triangles = np.concatenate(triangles)
+    parents = np.concatenate(parents)
+    area = np.linalg.norm(np.cross(triangles[:, 1] - triangles[:, 0],
+                                   triangles[:, 2] - triangles[:, 0]), axis=1)
+    return triangles[area > 0], parents[area > 0]
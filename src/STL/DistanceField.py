@@ -0,0 +1,328 @@
+import numpy as np
+
+from src.STL.ReadSTL import STL
+from src.STL.SliceSTL import Slicer, Slice
+from src.STL.Infill import getRegionEdges, scanlineSegments
+
+'''Set of functions for offsetting and hollowing an STL through a signed distance
+field (SDF) sampled on a regular grid.
+
+The distance to the mesh is calculated exactly in a narrow band around each facet,
+and spread to the rest of the grid with a vectorized jump flood, so the cost grows
+with the number of grid points rather than with the number of facets. The sign
+(negative inside) comes from slicing the STL at each grid layer and filling the
+slice contours along the grid rows. The offset surface is extracted at the requested
+distance with marching tetrahedra.
+'''
+class DistanceField:
+    def __init__(self, stl: STL, resolution=None, padding=0., block_size=1000000):
+        ''' A signed distance field sampled on a regular grid of points covering the
+        STL. Distances are negative inside the material and are only accurate up to
+        the limit (padding plus two grid spacings), beyond which they are clipped.
+
+        Inputs
+        ---
+        stl : STL
+            The STL object to sample
+        resolution : float, optional
+            The spacing of the grid, in the units of the stl coordinates. Defaults
+            to 1/100 of the longest side of the bounding box.
+        padding : float, default: 0.
+            The distance the grid extends past the bounding box of the STL. This
+            should be at least the largest offset that will be extracted.
+        block_size : int, default: 1000000
+            The largest number of point-facet pairs held in memory at once.
+        '''
+        vertices = stl.getVertexArray()
+        low = vertices.reshape(-1, 3).min(axis=0)
+        high = vertices.reshape(-1, 3).max(axis=0)
+        if resolution == None: resolution = max(high - low) / 100
+        self.spacing = float(resolution)
+        self.limit = abs(padding) + 2 * self.spacing
+        num_pad = int(np.ceil(self.limit / self.spacing))
+        # Grid points are shifted half a spacing off the bounding box so that the
+        # sampled layers do not fall on the flat top and bottom of the part.
+        self.origin = low - (num_pad - 0.5) * self.spacing
+        self.shape = tuple(int(n) for n in np.ceil((high - self.origin) / self.spacing) + num_pad)
+        self.distances = calculateDistances(vertices, self.origin, self.spacing, self.shape,
+                                            self.limit, block_size)
+        self.inside = findInsidePoints(stl, self.origin, self.spacing, self.shape)
+        self.values = np.where(self.inside, -self.distances, self.distances)
+
+    def getAxes(self):
+        ''' Returns the coordinates of the grid points along the x, y, and z axes.'''
+        return [self.origin[i] + self.spacing * np.arange(self.shape[i]) for i in range(3)]
+
+    def getSurface(self, level=0., block_size=1000000):
+        ''' Returns the facets of the surface where the field equals level, as an
+        [n x 3 x 3] array of vertices and an [n x 3] array of unit normals pointing
+        towards higher values of the field.'''
+        return extractSurface(self.values, self.origin, self.spacing, level, block_size)
+
+def getSDFOffsetSTL(stl: STL, offset, resolution=None, block_size=1000000):
+    ''' Returns a similar STL whose surface lies at the offset distance from the
+    inputted STL, extracted from a signed distance field. Negative offset values
+    result in inwards (reduced) offsets. Sharp convex edges are rounded when
+    offsetting outwards.
+
+    Inputs
+    ---
+    stl : STL
+        The STL object to offset
+    offset : float
+        The offset distance, in the units of the stl coordinates
+    resolution : float, optional
+        The spacing of the distance grid. Features smaller than the spacing are
+        lost. Defaults to 1/100 of the longest side of the bounding box.
+    block_size : int, default: 1000000
+        The largest number of point-facet pairs held in memory at once.
+    '''
+    field = DistanceField(stl, resolution, offset, block_size)
+    out = stl.emptyCopy()
+    out.loadFromArray(*field.getSurface(offset, block_size))
+    return out
+
+def getHollowSTL(stl: STL, thickness, resolution=None, block_size=1000000):
+    ''' Returns a similar STL with a closed inner cavity, so that the part is a shell
+    of the given wall thickness. The outer surface is the original surface, and the
+    inner surface is the inwards offset extracted from a signed distance field, with
+    its facets reversed to face into the cavity.
+
+    Inputs
+    ---
+    stl : STL
+        The STL object to hollow
+    thickness : float
+        The thickness of the shell, in the units of the stl coordinates
+    resolution : float, optional
+        The spacing of the distance grid. Defaults to 1/100 of the longest side of
+        the bounding box.
+    block_size : int, default: 1000000
+        The largest number of point-facet pairs held in memory at once.
+    '''
+    field = DistanceField(stl, resolution, thickness, block_size)
+    vertices, normals = field.getSurface(-abs(thickness), block_size)
+    return stl.derive(None, vertices[:, ::-1], -normals)
+
+def calculateDistances(facets, origin, spacing, shape, limit, block_size=1000000):
+    ''' Returns the unsigned distance from each point of the grid to the facets,
+    clipped at limit, as an array with the shape of the grid.
+
+    Inputs
+    ---
+    facets : [n x 3 x 3] np.array
+        The vertices of each facet
+    origin : [1 x 3] np.array
+        The coordinates of the first grid point
+    spacing : float
+        The distance between grid points
+    shape : tuple of 3 ints
+        The number of grid points along the x, y, and z axes
+    limit : float
+        The largest distance that needs to be accurate
+    block_size : int, default: 1000000
+        The largest number of point-facet pairs held in memory at once.
+    '''
+    closest = np.full(tuple(shape) + (3,), np.nan)
+    dist2 = np.full(shape, np.inf)
+    seedNarrowBand(facets, origin, spacing, shape, closest, dist2, block_size)
+    reach = int(np.ceil(limit / spacing)) + 1
+    step = 1 << max(0, int(reach).bit_length() - 1)
+    steps = list()
+    while step >= 1:
+        steps.append(step)
+        step //= 2
+    for step in steps + [1]:
+        jumpFlood(closest, dist2, origin, spacing, step)
+    return np.minimum(np.sqrt(dist2), limit)
+
+def seedNarrowBand(facets, origin, spacing, shape, closest, dist2, block_size=1000000):
+    ''' Sets the closest point on the facets and its squared distance for every grid
+    point within one spacing of the bounding box of a facet. The arrays closest and
+    dist2 are modified in place. Facets are processed in blocks so that each block
+    holds about block_size point-facet pairs.'''
+    shape = np.array(shape)
+    low = np.floor((facets.min(axis=1) - origin) / spacing).astype(int) - 1
+    high = np.ceil((facets.max(axis=1) - origin) / spacing).astype(int) + 1
+    low = np.clip(low, 0, shape - 1)
+    high = np.clip(high, 0, shape - 1)
+    sizes = high - low + 1
+    counts = sizes.prod(axis=1)
+    flat_closest = closest.reshape(-1, 3)
+    flat_dist2 = dist2.reshape(-1)
+    total = np.cumsum(counts)
+    start = 0
+    while start < len(facets):
+        base = total[start] - counts[start]
+        end = max(start + 1, int(np.searchsorted(total, base + block_size, 'right')))
+        ids = np.repeat(np.arange(start, end), counts[start:end])
+        local = np.arange(len(ids)) - np.repeat(total[start:end] - counts[start:end] - base,
+                                                counts[start:end])
+        size = sizes[ids]
+        index = low[ids] + np.column_stack([local % size[:, 0],
+                                            (local // size[:, 0]) % size[:, 1],
+                                            local // (size[:, 0] * size[:, 1])])
+        points = origin + spacing * index
+        tri = facets[ids]
+        near = closestPointsOnTriangles(points, tri[:, 0], tri[:, 1], tri[:, 2])
+        d2 = ((points - near)**2).sum(axis=1)
+        cell = np.ravel_multi_index(index.T, tuple(shape))
+        order = np.lexsort((d2, cell))
+        first = order[np.r_[True, cell[order][1:] != cell[order][:-1]]]
+        better = d2[first] < flat_dist2[cell[first]]
+        first = first[better]
+        flat_dist2[cell[first]] = d2[first]
+        flat_closest[cell[first]] = near[first]
+        start = end
+
+def jumpFlood(closest, dist2, origin, spacing, step):
+    ''' Runs one pass of the jump flood, in which each grid point takes the closest
+    point of a neighbour step points away (along any of the 26 directions) if it is
+    nearer than its own. The arrays closest and dist2 are modified in place.'''
+    shape = dist2.shape
+    axes = [origin[i] + spacing * np.arange(shape[i]) for i in range(3)]
+    for shift in np.ndindex(3, 3, 3):
+        shift = [(s - 1) * step for s in shift]
+        if shift == [0, 0, 0]: continue
+        dest = tuple(slice(max(0, -s), shape[i] - max(0, s)) for i, s in enumerate(shift))
+        src = tuple(slice(max(0, s), shape[i] - max(0, -s)) for i, s in enumerate(shift))
+        if any(d.stop <= d.start for d in dest): continue
+        candidate = closest[src]
+        d2 = (axes[0][dest[0], None, None] - candidate[..., 0])**2 + \
+             (axes[1][None, dest[1], None] - candidate[..., 1])**2 + \
+             (axes[2][None, None, dest[2]] - candidate[..., 2])**2
+        better = d2 < dist2[dest]
+        np.copyto(dist2[dest], d2, where=better)
+        np.copyto(closest[dest], candidate, where=better[..., None])
+
+def closestPointsOnTriangles(points, a, b, c):
+    ''' Returns the closest point on each triangle (a, b, c) to each of the points,
+    where all inputs are [n x 3] arrays, following the Voronoi region tests in
+    Ericson, Real-Time Collision Detection (2005).'''
+    ab = b - a
+    ac = c - a
+    bc = c - b
+    dot = lambda u, v: (u * v).sum(axis=1)
+    d1, d2 = dot(ab, points - a), dot(ac, points - a)
+    d3, d4 = dot(ab, points - b), dot(ac, points - b)
+    d5, d6 = dot(ab, points - c), dot(ac, points - c)
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+    ratio = lambda num, den: (num / np.where(den == 0, 1, den))[:, None]
+    # Regions are tested from the last to the first so that the earliest match wins
+    total = va + vb + vc
+    out = a + ab * ratio(vb, total) + ac * ratio(vc, total)
+    regions = [((va <= 0) & (d4 >= d3) & (d5 >= d6), b + bc * ratio(d4 - d3, (d4 - d3) + (d5 - d6))),
+               ((vb <= 0) & (d2 >= 0) & (d6 <= 0), a + ac * ratio(d2, d2 - d6)),
+               ((d6 >= 0) & (d5 <= d6), c),
+               ((vc <= 0) & (d1 >= 0) & (d3 <= 0), a + ab * ratio(d1, d1 - d3)),
+               ((d3 >= 0) & (d4 <= d3), b),
+               ((d1 <= 0) & (d2 <= 0), a)]
+    for mask, pnts in regions:
+        out[mask] = pnts[mask]
+    return out
+
+def findInsidePoints(stl: STL, origin, spacing, shape):
+    ''' Returns a boolean array with the shape of the grid that is True for each grid
+    point inside the material. Each layer of grid points is tested against the
+    contours of the STL sliced at that height, filled along the rows of the grid.'''
+    inside = np.zeros(shape, dtype=bool)
+    axes = [origin[i] + spacing * np.arange(shape[i]) for i in range(3)]
+    z = stl.getVertexArray()[:, :, 2]
+    z_low, z_high = z.min(), z.max()
+    if z_high <= z_low: return inside
+    slicer = Slicer(stl, spacing, min_z=z_low, max_z=z_high)
+    for layer in np.flatnonzero((axes[2] > z_low) & (axes[2] < z_high)):
+        # Facet group i holds the facets that span the interval above slice plane i
+        group = int(np.floor((axes[2][layer] - z_low) / spacing))
+        hulls = slicer.makeHulls(slicer.getSliceEdges(group, axes[2][layer]))
+        if len(hulls) == 0: continue
+        inside[:, :, layer] = fillGridRows(Slice(hulls, layer), axes[0], axes[1])
+    return inside
+
+def fillGridRows(slice: Slice, x, y):
+    ''' Returns a boolean [len(x) x len(y)] array that is True for each grid point
+    inside the material of the slice, found from the scanline segments along each
+    row of the grid (y = constant).'''
+    out = np.zeros((len(x), len(y)), dtype=bool)
+    segments = scanlineSegments(getRegionEdges(slice.hulls), y, True)
+    if len(segments) == 0: return out
+    rows = np.searchsorted(y, segments[:, 0, 1])
+    first = np.searchsorted(x, segments[:, 0, 0], 'left')
+    last = np.searchsorted(x, segments[:, 1, 0], 'right')
+    change = np.zeros((len(x) + 1, len(y)), dtype=int)
+    np.add.at(change, (first, rows), 1)
+    np.add.at(change, (last, rows), -1)
+    return np.cumsum(change, axis=0)[:-1] > 0
+
+# Each cube of the grid is split into six tetrahedra around its main diagonal. The
+# corners are numbered x + 2y + 4z.
+CUBE_TETRAHEDRA = [(0, 7, 1, 3), (0, 7, 3, 2), (0, 7, 2, 6), (0, 7, 6, 4), (0, 7, 4, 5), (0, 7, 5, 1)]
+
+def extractSurface(values, origin, spacing, level=0., block_size=1000000):
+    ''' Returns the triangles of the surface where the sampled field equals level,
+    using marching tetrahedra, as an [n x 3 x 3] array of vertices and an [n x 3]
+    array of unit normals. Triangles face towards higher values of the field. Only
+    the cubes of the grid that the surface passes through are triangulated, in blocks
+    of block_size cubes.'''
+    corners = np.array([np.unravel_index(i, (2, 2, 2), order='F') for i in range(8)])
+    cubes = findCrossingCubes(values < level, corners)
+    vertices = list()
+    for start in range(0, len(cubes), block_size):
+        index = cubes[start:start+block_size]
+        for tet in CUBE_TETRAHEDRA:
+            pnt_index = index[:, None, :] + corners[list(tet)][None, :, :]
+            val = values[pnt_index[..., 0], pnt_index[..., 1], pnt_index[..., 2]] - level
+            vertices.extend(triangulateTetrahedra(origin + spacing * pnt_index, val))
+    if len(vertices) == 0: return np.zeros((0, 3, 3)), np.zeros((0, 3))
+    vertices = np.concatenate(vertices)
+    normals = np.cross(vertices[:, 1] - vertices[:, 0], vertices[:, 2] - vertices[:, 0])
+    length = np.linalg.norm(normals, axis=1)
+    keep = length > 0
+    return vertices[keep], normals[keep] / length[keep][:, None]
+
+def findCrossingCubes(below, corners):
+    ''' Returns the index of the first corner of each cube of the grid that has
+    corners both below and above the surface, as an [n x 3] array.'''
+    nx, ny, nz = below.shape
+    views = [below[i:nx-1+i, j:ny-1+j, k:nz-1+k] for i, j, k in corners]
+    any_below = np.logical_or.reduce(views)
+    all_below = np.logical_and.reduce(views)
+    return np.argwhere(any_below & ~all_below)
+
+def triangulateTetrahedra(pnts, val):
+    ''' Returns a list of [n x 3 x 3] arrays of the triangles where the field crosses
+    zero in each tetrahedron. The corner points are an [m x 4 x 3] array and the
+    values at the corners an [m x 4] array. Each triangle faces from the negative
+    corners to the positive corners.'''
+    below = val < 0
+    out = list()
+    def crossing(mask, i, j):
+        a, b = val[mask, i], val[mask, j]
+        t = (a / (a - b))[:, None]
+        return pnts[mask, i] + t * (pnts[mask, j] - pnts[mask, i])
+    for i in range(4):
+        others = [j for j in range(4) if j != i]
+        single = (below[:, others] != below[:, i:i+1]).all(axis=1)
+        tri = np.stack([crossing(single, i, j) for j in others], axis=1)
+        direction = tri.mean(axis=1) - pnts[single, i]
+        direction[~below[single, i]] *= -1
+        out.append(orientTriangles(tri, direction))
+    for i, j, k, l in [(0, 1, 2, 3), (0, 2, 1, 3), (0, 3, 1, 2)]:
+        pair = (below[:, i] == below[:, j]) & (below[:, k] == below[:, l]) & \
+               (below[:, i] != below[:, k])
+        a, b, c, d = [crossing(pair, *e) for e in [(i, k), (i, l), (j, l), (j, k)]]
+        direction = pnts[pair][:, [k, l]].mean(axis=1) - pnts[pair][:, [i, j]].mean(axis=1)
+        direction[below[pair, k]] *= -1
+        out.append(orientTriangles(np.stack([a, b, c], axis=1), direction))
+        out.append(orientTriangles(np.stack([a, c, d], axis=1), direction))
+    return out
+
+def orientTriangles(tri, direction):
+    ''' Returns the [n x 3 x 3] triangles with their vertex order reversed where the
+    normal (following the RH Rule) points against the [n x 3] direction.'''
+    normals = np.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+    flip = (normals * direction).sum(axis=1) < 0
+    tri[flip] = tri[flip][:, ::-1]
+    return tri
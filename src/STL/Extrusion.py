@@ -1,22 +1,37 @@
 from math import floor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
 
 from src.STL.ReadSTL import STL
-from src.STL.SliceSTL import Slicer, Hull, Slice
-from src.STL.Offset import getOffsetSTL
+from src.STL.SliceSTL import Slicer, Slice
+from src.STL.Simplify import simplifySlices, simplifyPoints
+from src.STL.Infill import fillSlice, fillSlices, fillSliceZigzag
+from src.STL.PolygonOffset import offsetSlice
+from src.STL.GCode import GCodeWriter
+from src.STL.Pipeline import runPipeline
+from src.STL.Toolpath import Toolpath, ToolpathFile, writeToolpath
+from src.STL.ReadGCode import readGCode
+from src.STL.PathOrder import orderPaths, travelLength
+from src.STL.Lightning import planLightning
+from src.STL.Vase import SpiralBuilder
+from src.STL.PrintTime import PrinterProfile, pathsTime
 import src.STL.Methods as mthd
 
 '''
-Status: This class creates a grid infill properly, and makes paths for the outer
-hulls correctly. It requires the offset module functionality to be finished before 
-it can create the border walls effectively. At that point it will use the offset 
-functionality to create the solid-infill border walls. -JM, 5 May 2022
+Status: This class creates the border walls and the infill of each slice. The walls
+are offset inwards from the hulls with the PolygonOffset module, and the infill fills
+the region inside the innermost wall.
 '''
 
 class Path:
-    def __init__(self, points):
+    def __init__(self, points, kind='wall', layers=1):
         ''' An ordered set of coordiantes describing the path of an extruder head
-        to lay down filament. '''
+        to lay down filament. The kind is one of "wall", "infill" or "travel". 
+        layers is the number of layers the path fills, which is more than 1 for
+        infill printed once for a group of layers.'''
         self.points = points
+        self.kind = kind
+        self.layers = layers
 
     def calcPathLength(self):
         ''' Returns the full length of the path, in the units of the original
@@ -42,13 +57,57 @@ class Path:
         return 'X' + str(point[0]) + '\tY' + str(point[1]) + '\tZ' + str(point[2])
 
     def toString(self):
-        ''' Returns an output of the path in two lines.'''
-        line1 = self.toLine(self.points[0], True)
-        line2 = self.toLine(self.points[1], False)
-        return [line1, line2]
+        ''' Returns an output of the path with one line for each point. See the
+        GCode module for printer output.'''
+        return [self.toLine(point, i > 0) for i, point in enumerate(self.points)]
 
-class Extrusion:
-    def __init__(self, stl: STL, wall_thickness=1.5, layer_height=0.25, infill_density=0.2):
+PRINTING_SPEED = 25.4 #mm/s
+TRAVEL_SPEED = 150. #mm/s
+
+class PrintTotals:
+    def __init__(self, printing_speed=PRINTING_SPEED, travel_speed=TRAVEL_SPEED):
+        ''' The running totals of a print, counted one layer at a time. Extrusion
+        keeps its totals this way, and so does a parameter sweep (see Sweep).
+
+        Contents for Calling
+        ---
+        length_of_print : float
+            The length of filament extruded, with each path counted once for every
+            layer it fills (see Path), which sets the mass
+        travel_length : float
+            The length of the travel moves
+        time_to_print : float
+            The time to print at the printing and travel speeds, in seconds
+        '''
+        self.printing_speed = printing_speed
+        self.travel_speed = travel_speed
+        self.length_of_print = 0
+        self.travel_length = 0
+        self.time_to_print = 0
+        self.last_position = None
+
+    def countLayer(self, paths: list, length, time, travel=0):
+        ''' Adds the length, time and travel of a layer to the totals of the print,
+        including the travel from the end of the last layer counted.'''
+        between = 0
+        if len(paths) > 0:
+            if self.last_position != None:
+                between = travelLength(paths, self.last_position) - travelLength(paths)
+            self.last_position = paths[-1].points[-1][0:2]
+        self.length_of_print += length
+        self.travel_length += travel + between
+        self.time_to_print += time + between / self.travel_speed
+
+    def printMass(self, density=0.00125, filament_circumference=1.75):
+        ''' Returns the estimated mass of the print in grams. Units are g/mm^3 and mm.
+        The default values are for PLA filament (.00125 g/mm^3). ABS is .00104 g/mm^3.'''
+        return self.length_of_print * filament_circumference * 3.1415926 * density
+
+class Extrusion(PrintTotals):
+    def __init__(self, stl: STL, wall_thickness=1.5, layer_height=0.25, infill_density=0.2,
+                 simplify_tol=0.01, workers=1, executor='process', resolution=None, output=None,
+                 order_paths=True, two_opt_time=0., connect_infill=False, infill_layers=1,
+                 infill_pattern='grid', vase=False):
         ''' An object that takes an STL and calculates the necessary paths an
         FFF extruder must traverse to recreate the object. Note that all units are in mm.
         
@@ -66,164 +125,457 @@ class Extrusion:
             The density of the infill. 0.15 through 0.20 is typical. 1 correlates to a
             solid infill, while 0 removes infill. Infill percentages are based on a 1mm
             by 1mm square area.
+        simplify_tol : float, default: 0.01
+            The largest deviation allowed when removing collinear and sub-resolution 
+            points from the sliced hulls. Set to 0 to keep every point.
+        workers : int, default: 1
+            The number of workers used to generate the paths. Each layer is an
+            independent task, and the results are identical to a serial run.
+        executor : str ("process" or "thread"), default: "process"
+            The type of pool used when workers is greater than 1.
+        resolution : float, optional
+            The size of the integer grid used for exact slicing and infill crossings,
+            such as 1e-6 (nanometres). Defaults to the resolution of the STL. If None,
+            floating point tolerances are used.
+        output : str, optional
+            A G-code file to stream the paths to. If given, the layers are sliced, 
+            built and written one at a time (see streamPaths) and are not kept in the
+            member "slices", so the memory used stays flat in the height of the part.
+        order_paths : bool, default: True
+            If True, the paths of each layer are reordered (see the PathOrder module)
+            to shorten the travel moves between them.
+        two_opt_time : float, default: 0
+            The number of seconds spent on 2-opt refinement of the order of each 
+            layer, after the nearest neighbour ordering.
+        connect_infill : bool, default: False
+            If True, the infill segments on adjacent scanlines are linked along the
+            boundary of the infill into zig-zag paths (see Infill.zigzagSegments),
+            which cuts the number of paths and travel moves.
+        infill_layers : int, default: 1
+            The number of layers in each group whose infill is printed at once, as
+            a single extrusion as thick as the group on its top layer. The infill
+            covers the part of the group's layers that is inside all of their walls.
+            Zig-zag linking (connect_infill) only applies to single layers.
+        infill_pattern : str ("grid" or "lightning"), default: "grid"
+            With "lightning", the grid infill is only kept below the top surfaces,
+            which are held up by trees of lines grown down to the walls (see the
+            Lightning module). This plans every layer from the top down, so it
+            cannot be used with output, and connect_infill and infill_layers do not
+            apply.
+        vase : bool, default: False
+            If True, the part is printed in spiral vase mode: the outer contour of
+            each slice is joined into one continuous path rising steadily in z (see
+            the Vase module), with no infill and no inner walls.
         '''
         self.stl = stl
-        self.innerSTL = stl
+        self.name = stl.name
         self.wall_thickness = wall_thickness
         self.layer_height = layer_height
         self.density = abs(infill_density) if abs(infill_density) <= 1 else 1
-        self.numWalls = int(wall_thickness / layer_height)
-        self.numWalls = 1 #FIXME: This prevents offsetting until that functionality is established
-        self.printing_speed = 25.4 #mm/s
-        self.length_of_print = 0
-        self.time_to_print = 0
+        self.numWalls = max(1, int(round(wall_thickness / layer_height, 6)))
+        self.simplify_tol = simplify_tol
+        self.workers = workers
+        self.executor = executor
+        self.resolution = resolution if resolution != None else stl.resolution
+        self.order_paths = order_paths
+        self.two_opt_time = two_opt_time
+        self.connect_infill = connect_infill
+        self.infill_layers = max(1, int(infill_layers))
+        self.infill_pattern = infill_pattern
+        self.vase = vase
+        if infill_pattern not in ('grid', 'lightning'):
+            raise ValueError('Unknown infill pattern: ' + str(infill_pattern))
+        PrintTotals.__init__(self)
         self.setupSlices()
         self.findInfillCoord()
-        self.makeBorderWalls()
-        self.makeInfill()
+        if output != None: 
+            self.streamPaths(output)
+            return
+        self.sliceModel()
+        self.makePaths()
 
     def setupSlices(self):
-        ''' Calculates the number of slices, and creates several class members.'''
-        temp = Slicer(self.stl, self.layer_height)
-        self.numSlices = temp.numSlices
+        ''' Calculates the number of slices, and creates several class members. The
+        Slicer is kept as the member "slicedSTL".'''
+        self.slicedSTL = Slicer(self.stl, self.layer_height, resolution=self.resolution)
+        self.numSlices = self.slicedSTL.numSlices
         self.slices = [[] for i in range(self.numSlices)]
-        self.z_index = [i * self.layer_height for i in range(self.numSlices)]
-        if temp.additionalSliceOnTop: self.z_index[-1] = temp.max_z
+        self.z_index = np.array(self.slicedSTL.getZDatums())
+        if self.resolution != None:
+            self.z_index = np.rint(self.z_index / self.resolution) * self.resolution
 
     def findInfillCoord(self):
         ''' Finds the coordinates of the beginning of each infill path. The infill path
         follows a grid (horizontal and vertical). The coordinate pairs go from left to 
         right, bottom to top, so that coordinates will start in Quadrant III.'''
         self.limits = Slicer.findMaxAndMinLimits(self.stl)
-        self.horz_coord = list()
-        self.vert_coord = list()
-        x = self.limits[0]
-        y = self.limits[2]
         spacing = calcInfillData(self.layer_height, self.density)
-        while y <= self.limits[3]:
-            self.horz_coord.append((self.limits[0], y))
-            y += spacing
-        while x <= self.limits[1]:
-            self.vert_coord.append((x, self.limits[2]))
-            x += spacing
+        self.horz_coord, self.vert_coord = calcInfillCoord(self.limits, spacing)
+        self.horz_lines = np.array([c[1] for c in self.horz_coord])
+        self.vert_lines = np.array([c[0] for c in self.vert_coord])
 
     def getSliceIndex(self, z, tol=1e-5):
         ''' Returns the index of slice that contains the z datum. Returns None if 
-        the inputted z is not contained in any slice.'''
-        if z < self.layer_height - tol: return 0
-        if z > self.z_index[-1] + tol: return None
-        for i in range(len(self.z_index)):
-            if abs(self.z_index[i] - z) < tol: return i
+        the inputted z is not contained in any slice. The slice planes do not need 
+        to be evenly spaced. With a resolution, z must round to the same grid point
+        as the slice.'''
+        if self.resolution != None:
+            tol = self.resolution / 2
+            z = float(np.rint(z / self.resolution) * self.resolution)
+        i = int(np.searchsorted(self.z_index, z))
+        for j in (i-1, i):
+            if 0 <= j < len(self.z_index) and abs(self.z_index[j] - z) < tol: return j
         return None
 
-    def addSliceHulls(self, slice: Slice):
-        ''' Takes the hulls in a slice and adds them to the extrude paths. Each hull
-        is treated as a boundary wall.'''
-        for i in range(len(slice.hulls)):
-            self.addPath(Path(slice.hulls[i].pnts))
-    
     def addPath(self, path: Path):
         ''' Adds a path to the Extrusion object.'''
         index = self.getSliceIndex(path.points[0][2])
         if index != None:
             self.slices[index].append(path)
             length = path.calcPathLength()
-            self.length_of_print += length
+            self.length_of_print += length * path.layers
             self.time_to_print += length / self.printing_speed
 
-    def printMass(self, density=0.00125, filament_circumference=1.75):
-        ''' Returns the estimated mass of the print in grams. Units are g/mm^3 and mm.
-        The default values are for PLA filament (.00125 g/mm^3). ABS is .00104 g/mm^3.'''
-        return self.length_of_print * filament_circumference * 3.1415926 * density
+    def addLayer(self, index, paths: list, length, time, travel=0):
+        ''' Adds the paths and statistics for a finished layer to the Extrusion 
+        object. The travel from the end of the last layer added is also counted.'''
+        if index == None: return
+        self.slices[index].extend(paths)
+        self.countLayer(paths, length, time, travel)
+
+    def simplifyPaths(self, tol=None):
+        ''' Removes collinear and sub-resolution points from every path before export,
+        and updates the length and time of the print. Sets the member 
+        "path_points_removed", the number of points removed from each slice.'''
+        if tol == None: tol = self.simplify_tol
+        self.path_points_removed = [0] * self.numSlices
+        for i in range(self.numSlices):
+            for path in self.slices[i]:
+                if len(path.points) < 3: continue
+                keep = simplifyPoints(path.points, tol)
+                self.path_points_removed[i] += len(path.points) - int(keep.sum())
+                length = path.calcPathLength()
+                path.points = [path.points[j] for j in np.flatnonzero(keep)]
+                change = length - path.calcPathLength()
+                self.length_of_print -= change * path.layers
+                self.time_to_print -= change / self.printing_speed
+
+    def estimatePrintTime(self, profile: PrinterProfile = None):
+        ''' Returns the time to print the paths in seconds, planned with the
+        acceleration and cornering limits of the printer profile (see PrintTime).
+        The profile defaults to the printing and travel speeds of the Extrusion.
+        Unlike time_to_print, this counts the time lost to acceleration, corners
+        and short segments.'''
+        if profile == None:
+            profile = PrinterProfile(self.printing_speed, self.travel_speed)
+        return pathsTime(self.slices, profile)
+
+    def writeGCode(self, filepath, **kwargs):
+        ''' Streams the paths to a G-code file, one layer at a time, and returns the
+        GCodeWriter used. Keyword arguments are passed to the GCodeWriter, such as
+        filament_diameter or travel_speed.'''
+        writer = GCodeWriter.fromExtrusion(self, **kwargs)
+        writer.write(filepath, self.slices)
+        return writer
+
+    def streamPaths(self, filepath, queue_size=2, **kwargs):
+        ''' Slices the model, builds the paths and writes them to a G-code file one 
+        layer at a time, and returns the GCodeWriter used. The slicing, simplifying,
+        path building and writing each run in their own thread, connected by queues
+        holding at most queue_size layers, so the first layer is written before the
+        later layers are sliced. The length and time of the print are updated, but
+        the paths are not stored. Keyword arguments are passed to the GCodeWriter.'''
+        if self.infill_pattern == 'lightning' and not self.vase:
+            raise ValueError('Lightning infill is planned from the top down and cannot be streamed')
+        builder = self.makeLayerBuilder()
+        spiral = SpiralBuilder()
+        self.points_removed = [0] * self.numSlices
+        def simplify(slice: Slice):
+            simple, removed = simplifySlices([slice], self.simplify_tol)
+            self.points_removed[slice.index] = removed[0]
+            return simple[0]
+        groups = self.getInfillGroups()
+        below = dict() #Slices waiting for the top of their infill group
+        def build(slice: Slice):
+            if self.vase: return slice.index, self.makeSpiralLayer(spiral, slice)
+            group = groups[slice.index]
+            if group != None:
+                below[slice.index] = slice
+                group = [below.pop(i) for i in group if i in below]
+            return slice.index, builder(slice, group)
+        def layers():
+            next_index = 0
+            stream = runPipeline(self.slicedSTL.iterSlices(), [simplify, build], queue_size)
+            for index, (paths, length, time, travel) in stream:
+                for i in range(next_index, index): yield list()
+                next_index = index + 1
+                self.countLayer(paths, length, time, travel)
+                yield paths
+            for i in range(next_index, self.numSlices): yield list()
+        writer = GCodeWriter.fromExtrusion(self, **kwargs)
+        writer.write(filepath, layers())
+        return writer
+
+    def getParameters(self):
+        ''' Returns a dictionary of the slicing parameters and totals of the print.'''
+        return dict(name=self.name, wall_thickness=self.wall_thickness, 
+                    layer_height=self.layer_height, infill_density=self.density,
+                    simplify_tol=self.simplify_tol, resolution=self.resolution,
+                    printing_speed=self.printing_speed, length_of_print=self.length_of_print,
+                    travel_length=self.travel_length, time_to_print=self.time_to_print,
+                    connect_infill=self.connect_infill, infill_layers=self.infill_layers,
+                    infill_pattern=self.infill_pattern, vase=self.vase)
+
+    def saveToolpath(self, filepath):
+        ''' Saves the paths to a binary toolpath file (see the Toolpath module), which
+        can be reopened with fromToolpath without slicing the part again.'''
+        writeToolpath(filepath, self.slices, self.z_index.tolist(), self.getParameters(),
+                      point_z=self.vase)
+
+    @classmethod
+    def fromToolpath(cls, source):
+        ''' Returns an Extrusion with the paths and parameters of a Toolpath object or 
+        a saved toolpath file. The STL and the Slicer are not restored (the members
+        "stl" and "slicedSTL" are None). Parameters missing from the toolpath take the
+        defaults of the constructor.'''
+        data = source if isinstance(source, Toolpath) else ToolpathFile(source)
+        params = data.params
+        out = cls.__new__(cls)
+        out.stl = None
+        out.slicedSTL = None
+        out.name = params.get('name', '')
+        out.wall_thickness = params.get('wall_thickness', 1.5)
+        out.layer_height = params.get('layer_height', 0.25)
+        out.density = params.get('infill_density', 0.2)
+        out.numWalls = max(1, int(round(out.wall_thickness / out.layer_height, 6)))
+        out.simplify_tol = params.get('simplify_tol', 0.01)
+        out.workers = 1
+        out.executor = 'process'
+        out.resolution = params.get('resolution')
+        out.printing_speed = params.get('printing_speed', PRINTING_SPEED)
+        out.length_of_print = params.get('length_of_print', 0)
+        out.time_to_print = params.get('time_to_print', 0)
+        out.travel_length = params.get('travel_length', 0)
+        out.travel_speed = TRAVEL_SPEED
+        out.order_paths = True
+        out.two_opt_time = 0.
+        out.connect_infill = params.get('connect_infill', False)
+        out.infill_layers = params.get('infill_layers', 1)
+        out.infill_pattern = params.get('infill_pattern', 'grid')
+        out.vase = params.get('vase', False)
+        out.last_position = None
+        out.numSlices = data.num_layers
+        out.z_index = np.array(data.layer_z)
+        out.slices = [data.getLayerPaths(i, Path) for i in range(data.num_layers)]
+        for i, group in enumerate(out.getInfillGroups()):
+            for path in out.slices[i]:
+                if path.kind == 'infill' and group != None: path.layers = len(group)
+        return out
+
+    @classmethod
+    def fromGCode(cls, filepath, layers=None):
+        ''' Returns an Extrusion with the paths read from a G-code file (see the
+        ReadGCode module). layers is an optional (first, stop) range of layers to
+        read.'''
+        return cls.fromToolpath(readGCode(filepath, layers))
 
     # Make Paths
-    def makeBorderWalls(self):
-        ''' Finds the paths for each of the border walls and adds it to the Extrusion
-        object. Also sets the innerSTL to the be the innermost border wall for use in
-        infill calculation.'''
-        min_z = None
-        max_z = None
-        for i in range(self.numWalls):
-            temp = Slicer(self.innerSTL, self.layer_height, min_z, max_z)
-            min_z = temp.min_z
-            max_z = temp.max_z
-            temp.sliceSTL()
-            for slice in temp.slices:
-                self.addSliceHulls(slice)
-            if i != self.numWalls-1: 
-                self.innerSTL = getOffsetSTL(temp.stl, -self.layer_height/2)
-            self.slicedSTL = temp
-
-    def makeInfill(self):
-        ''' Caller function to make the infill paths for each slice in the object.'''
-        # Delete below if uncommenting self.makeBorderWalls()
-        # temp = Slicer(self.innerSTL, self.layer_height)
-        # temp.sliceSTL()
-        # self.slicedSTL = temp
-        # Delete above
-        for slice in self.slicedSTL.slices:
-            for hull in slice.hulls:
-                paths = self.fillHull(hull)
-                for path in paths: self.addPath(path)
-
-    def fillHull(self, hull: Hull):
-        ''' Returns a set of infill paths traversing the hull.'''
-        paths = list()
-        for y_c in self.horz_coord:
-            paths.extend(self.getPaths(y_c[1], hull, is_horizontal=True))
-        for x_c in self.vert_coord:
-            paths.extend(self.getPaths(x_c[0], hull, is_horizontal=False))
-        return paths
+    def sliceModel(self):
+        ''' Slices the STL and simplifies the resulting hulls.'''
+        temp = self.slicedSTL
+        temp.sliceSTL()
+        temp.slices, self.points_removed = simplifySlices(temp.slices, self.simplify_tol)
+
+    def makePaths(self):
+        ''' Generates the wall and infill paths for every slice. Each slice is built 
+        as an independent task (in a pool if workers is greater than 1), and the
+        results are added in slice order so the totals do not depend on the order 
+        in which tasks finish. In vase mode the slices are joined into the spiral
+        in order instead.'''
+        slices = self.slicedSTL.slices
+        if self.vase:
+            spiral = SpiralBuilder()
+            for slice in slices:
+                self.addLayer(slice.index, *self.makeSpiralLayer(spiral, slice))
+            return
+        builder = self.makeLayerBuilder()
+        by_index = {slice.index: slice for slice in slices}
+        groups = [None if group == None else [by_index[i] for i in group if i in by_index]
+                  for group in self.getInfillGroups()]
+        groups = [groups[slice.index] for slice in slices]
+        infill = [None] * len(slices)
+        if self.infill_pattern == 'lightning': infill = self.planLightning(builder, slices)
+        if self.workers > 1 and len(slices) > 1:
+            pool = ProcessPoolExecutor if self.executor == 'process' else ThreadPoolExecutor
+            with pool(max_workers=self.workers) as executor:
+                chunksize = max(1, len(slices) // (4 * self.workers))
+                layers = list(executor.map(builder, slices, groups, infill, chunksize=chunksize))
+        else:
+            layers = [builder(*args) for args in zip(slices, groups, infill)]
+        for slice, (paths, length, time, travel) in zip(slices, layers):
+            self.addLayer(slice.index, paths, length, time, travel)
+
+    def makeSpiralLayer(self, spiral: SpiralBuilder, slice: Slice):
+        ''' Returns the spiral vase path for the slice, its length, the time to print
+        it and the travel to it (which is 0), as from a LayerBuilder. The slices
+        must be passed to the SpiralBuilder in order.'''
+        loop = spiral(slice)
+        if loop is None: return list(), 0, 0, 0
+        path = Path([tuple(pnt) for pnt in loop.tolist()], 'wall')
+        length = path.calcPathLength()
+        return [path], length, length / self.printing_speed, 0
+
+    def planLightning(self, builder, slices: list):
+        ''' Returns the lightning infill of each of the slices as a list of [k x 2]
+        arrays (see the Lightning module). The slices must be in order, and slices
+        missing from the list are treated as empty.'''
+        regions = [None] * self.numSlices
+        for slice in slices: regions[slice.index] = builder.getInfillBoundary(slice)
+        plan = planLightning(regions, self.horz_lines, self.vert_lines, self.layer_height,
+                             resolution=self.resolution)
+        return [plan[slice.index] for slice in slices]
+
+    def getInfillGroups(self):
+        ''' Returns, for each slice index, the indices of the slices whose infill is
+        printed on that slice: an empty list for the slices below the top of each
+        group of infill_layers slices, or None when every slice has its own infill.
+        The last group may be smaller.'''
+        n = self.infill_layers
+        if n <= 1: return [None] * self.numSlices
+        groups = [list() for i in range(self.numSlices)]
+        for top in list(range(n - 1, self.numSlices, n)) + [self.numSlices - 1]:
+            groups[top] = list(range(top - top % n, top + 1))
+        return groups
+
+    def makeLayerBuilder(self):
+        ''' Returns a LayerBuilder with the settings of the Extrusion.'''
+        return LayerBuilder(self.horz_lines, self.vert_lines, self.printing_speed,
+                            self.numWalls, self.layer_height, self.resolution, 
+                            self.travel_speed, self.order_paths, self.two_opt_time,
+                            self.connect_infill)
+
+class LayerBuilder:
+    def __init__(self, horz_lines, vert_lines, printing_speed, numWalls=1, line_width=0.25,
+                 resolution=None, travel_speed=TRAVEL_SPEED, order_paths=True, two_opt_time=0.,
+                 connect_infill=False):
+        ''' Builds the paths for a single slice. The builder only holds the settings
+        shared by all layers, so it can be sent to worker processes cheaply.
         
-    def getPaths(self, l_c, hull: Hull, is_horizontal):
-        ''' Gets the set of horizontal paths within the hull.'''
-        paths = list()
-        iscts = list()
-        normals = list()
-        for i in range(len(hull.pnts)-1):
-            isct = self.findLineSegIntersection(hull.pnts[i], hull.pnts[i+1], l_c, is_horizontal)
-            if isct != None:
-                iscts.append(isct)
-                normals.append(hull.normals[i])
-        if len(iscts) > 1:
-            paths.extend(self.makePaths(iscts, normals, is_horizontal))
-        return paths
+        Inputs
+        ---
+        horz_lines, vert_lines : np.array
+            The sorted coordinates of the horizontal (y) and vertical (x) infill 
+            scanlines.
+        printing_speed : float
+            The speed of the extruder head, in mm/s.
+        numWalls : int, default: 1
+            The number of perimeter walls printed around each hull.
+        line_width : float, default: 0.25
+            The width of each extrusion path, which sets the spacing of the walls.
+        resolution : float, optional
+            The size of the integer grid used for exact infill crossings.
+        travel_speed : float, default: 150
+            The speed of the extruder head between paths, in mm/s.
+        order_paths : bool, default: True
+            If True, the paths are reordered to shorten the travel between them.
+        two_opt_time : float, default: 0
+            The number of seconds spent on 2-opt refinement of the order.
+        connect_infill : bool, default: False
+            If True, the infill segments are linked into zig-zag paths.
+        '''
+        self.horz_lines = horz_lines
+        self.vert_lines = vert_lines
+        self.printing_speed = printing_speed
+        self.numWalls = numWalls
+        self.line_width = line_width
+        self.resolution = resolution
+        self.travel_speed = travel_speed
+        self.order_paths = order_paths
+        self.two_opt_time = two_opt_time
+        self.connect_infill = connect_infill
+
+    def __call__(self, slice: Slice, group=None, infill=None):
+        ''' Returns the paths for the slice, followed by their total length, the
+        time to print them (including the travel between them), and the length of
+        the travel between them. group is the list of slices (including this one)
+        whose infill is printed on this slice, an empty list for none, or None for
+        the infill of this slice alone. infill is an optional list of [k x 2] arrays
+        of planned infill (such as lightning infill) used instead.'''
+        paths = self.makeWalls(slice)
+        if infill != None:
+            z = slice.z_datum
+            paths.extend(Path([(x, y, z) for x, y in pnts.tolist()], 'infill') for pnts in infill)
+        elif group == None: paths.extend(self.makeInfill(slice))
+        elif len(group) > 0: paths.extend(self.makeGroupInfill(slice, group))
+        return self.finishLayer(paths)
+
+    def finishLayer(self, paths: list):
+        ''' Orders the paths of a layer and returns them with their total length,
+        the time to print them and the length of the travel between them, as from
+        calling the builder. The length counts each path once for every layer it
+        fills, as the flow of the G-code does, while the time follows the nozzle.'''
+        if self.order_paths: paths, travel = orderPaths(paths, None, self.two_opt_time)
+        else: travel = travelLength(paths)
+        lengths = [path.calcPathLength() for path in paths]
+        length = sum(l * path.layers for l, path in zip(lengths, paths))
+        return paths, length, sum(lengths) / self.printing_speed + travel / self.travel_speed, travel
 
-    def makePaths(self, intersection_points, normals, is_horizontal: bool):
-        ''' Returns a set of horizontal paths running between the intersection_points.'''
-        isct = mthd.orderPoints(intersection_points)
-        normals = mthd.sortByOrderedSet(normals, isct, intersection_points)
+    def makeWalls(self, slice: Slice):
+        ''' Returns the border wall paths of the slice, from the outermost wall in. The
+        outer wall follows the hulls, and each further wall is offset inwards by 
+        one line width.'''
         paths = list()
-        start = None
-        for i in range(len(isct)):
-            dir = mthd.NormalSign(normals[i], is_horizontal)
-            if dir == 0: continue
-            elif dir == -1: start = isct[i]
-            elif dir == 1: 
-                if start != None:
-                    paths.append(Path([start, isct[i]]))
-                start = None
+        for i in range(self.numWalls):
+            wall = slice if i == 0 else offsetSlice(slice, -i * self.line_width)
+            if wall == None: break
+            paths.extend(Path(hull.pnts, 'wall') for hull in wall.hulls)
         return paths
 
-    def findLineSegIntersection(self, pnt1, pnt2, line_c, is_horizontal=True, tol=1e-5):
-        ''' Returns the intersection point (as a tuple) of the line segment defined by
-        pnt1 and pnt2 with the vertical or horizontal line located at the coordinate
-        line_c, with orientation given by is_horizontal. If the lines are colinear, 
-        returns None.'''
-        if len(pnt1) > 3: z = 0
-        else: z = pnt1[2]
-        delx = pnt2[0] - pnt1[0]
-        if abs(delx) <= tol:
-            if is_horizontal and mthd.horizontalIntersectsLineSeg(line_c, [pnt1, pnt2]): 
-                return (pnt1[0], line_c, z)
-            else: return None
-        m = (pnt2[1] - pnt1[1]) / (pnt2[0] - pnt1[0])
-        if is_horizontal:
-            if not mthd.horizontalIntersectsLineSeg(line_c, [pnt1, pnt2]): return None
-            return ((line_c - pnt1[1]) / m + pnt1[0], line_c, z)
-        else:
-            if not mthd.verticalIntersectsLineSeg(line_c, [pnt1, pnt2]): return None
-            return (line_c, m * (line_c - pnt1[0]) + pnt1[1], z)
+    def getInfillBoundary(self, slice: Slice):
+        ''' Returns the region left for infill inside the walls, which ends at the 
+        inner edge of the innermost wall. Returns None if the walls fill the slice.'''
+        return offsetSlice(slice, -(self.numWalls - 0.5) * self.line_width)
+
+    def makeInfill(self, slice: Slice):
+        ''' Returns a set of infill paths traversing the material of the slice inside
+        the walls.'''
+        region = self.getInfillBoundary(slice)
+        if region == None: return list()
+        return self.fillRegion(region, slice.z_datum)
+
+    def fillRegion(self, region: Slice, z):
+        ''' Returns the infill paths of the region left for infill, at height z.'''
+        if self.connect_infill:
+            lines = fillSliceZigzag(region, self.horz_lines, self.vert_lines, self.resolution)
+            return [Path([(x, y, z) for x, y in pnts.tolist()], 'infill') for pnts in lines]
+        segments = fillSlice(region, self.horz_lines, self.vert_lines, self.resolution)
+        return [Path([(a[0], a[1], z), (b[0], b[1], z)], 'infill') for a, b in segments.tolist()]
+
+    def makeGroupInfill(self, slice: Slice, group: list):
+        ''' Returns the infill paths for a group of slices, printed on the slice as
+        one extrusion as thick as the group. The infill covers the part of every 
+        slice of the group that is inside its walls.'''
+        regions = [self.getInfillBoundary(s) for s in group]
+        if any(region == None for region in regions): return list()
+        segments = fillSlices(regions, self.horz_lines, self.vert_lines, self.resolution)
+        z = slice.z_datum
+        return [Path([(a[0], a[1], z), (b[0], b[1], z)], 'infill', len(group)) for a, b in segments.tolist()]
+
+def calcInfillCoord(limits, spacing):
+    ''' Returns the coordinates of the start of each horizontal and vertical infill
+    scanline within the (x min, x max, y min, y max) limits, as two lists of (x, y)
+    tuples.'''
+    horz_coord = list()
+    vert_coord = list()
+    x = limits[0]
+    y = limits[2]
+    while y <= limits[3]:
+        horz_coord.append((limits[0], y))
+        y += spacing
+    while x <= limits[1]:
+        vert_coord.append((x, limits[2]))
+        x += spacing
+    return horz_coord, vert_coord
 
 def calcInfillData(layer_height, density, side=1000):
     ''' Calculates the spacing and number of lines for the infill, based on a unit
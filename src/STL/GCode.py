@@ -0,0 +1,222 @@
+from math import pi
+import numpy as np
+
+from src.STL.ArcFit import fitArcs, arcLength
+
+'''A G-code backend that streams the paths of an Extrusion to a file, one layer at
+a time.
+
+Each layer is gathered into a single array of points, the extrusion (E) values are
+found from the cumulative path length in one pass, and the whole layer is formatted
+with a single string format operation. Only the text of the current layer is held
+in memory, so the memory used does not grow with the size of the print. Runs of 
+points along a circular arc can optionally be written as single G2/G3 moves.
+'''
+class GCodeWriter:
+    def __init__(self, layer_height=0.25, line_width=None, filament_diameter=1.75,
+                 print_speed=25.4, travel_speed=150., decimals=3, e_decimals=5, name='',
+                 arc_tol=None):
+        ''' Converts layers of extruder paths into G-code with absolute extrusion
+        values. Note that all units are in mm, and speeds are in mm/s.
+
+        Inputs
+        ---
+        layer_height : float, default: 0.25
+            The thickness of each layer
+        line_width : float, optional
+            The width of each extrusion path. Defaults to the layer height, as in
+            the Extrusion class.
+        filament_diameter : float, default: 1.75
+            The diameter of the filament fed to the extruder
+        print_speed, travel_speed : float, default: 25.4, 150
+            The speed of the extruder head while extruding and while travelling
+        decimals, e_decimals : int, default: 3, 5
+            The number of decimals written for coordinates and for E values
+        name : str, default: ''
+            The name of the part, written in the header
+        arc_tol : float, optional
+            If given, runs of points within arc_tol of a circular arc are written as
+            G2 (clockwise) and G3 (counter-clockwise) moves. See the ArcFit module.
+
+        Contents for Calling
+        ---
+        e : float
+            The current (cumulative) E value, the length of filament used so far
+        extruded_length, travel_length : float
+            The total length of the extruding and of the travel moves written
+        points_in, moves_out : int
+            The number of path points given and of moves written, whose ratio is
+            the compression from arc fitting
+        '''
+        self.layer_height = layer_height
+        self.line_width = line_width if line_width != None else layer_height
+        self.filament_diameter = filament_diameter
+        self.print_speed = print_speed
+        self.travel_speed = travel_speed
+        self.decimals = decimals
+        self.e_decimals = e_decimals
+        self.name = name
+        self.arc_tol = arc_tol
+        self.e_per_mm = self.line_width * layer_height / (pi * (filament_diameter / 2)**2)
+        self.makeTemplates()
+        self.reset()
+
+    @classmethod
+    def fromExtrusion(cls, extrusion, **kwargs):
+        ''' Returns a writer with the layer height, line width and speed of the
+        Extrusion object. Any keyword arguments override these.'''
+        settings = dict(layer_height=extrusion.layer_height, print_speed=extrusion.printing_speed,
+                        name=extrusion.name)
+        settings.update(kwargs)
+        return cls(**settings)
+
+    def reset(self):
+        ''' Clears the position and totals, to start a new file.'''
+        self.e = 0.
+        self.extruded_length = 0.
+        self.travel_length = 0.
+        self.position = None
+        self.z = None
+        self.kind = None
+        self.points_in = 0
+        self.moves_out = 0
+
+    def makeTemplates(self):
+        ''' Creates the format strings for each kind of move: a travel, then a line, 
+        clockwise arc and counter-clockwise arc, each with and without the print feed
+        rate (which is set on the first move after a travel). Every row of a layer 
+        takes the same five values (X, Y, I, J, E), and a move consumes the values it
+        does not use without printing them ("%.0s"). The templates in "z_templates"
+        also take Z after Y, for layers whose height changes along the paths (as in
+        a spiral), and the last template of each consumes a row without a move.'''
+        xy = 'X%%.%df Y%%.%df' % (self.decimals, self.decimals)
+        ij = ' I%%.%df J%%.%df' % (self.decimals, self.decimals)
+        e = ' E%%.%df' % self.e_decimals
+        f_print = round(self.print_speed * 60)
+        f_travel = round(self.travel_speed * 60)
+        self.templates = ['G0 F%d %s%%.0s%%.0s%%.0s\n' % (f_travel, xy)]
+        for move, centre in (('G1', '%.0s%.0s'), ('G2', ij), ('G3', ij)):
+            self.templates.append('%s F%d %s%s%s\n' % (move, f_print, xy, centre, e))
+            self.templates.append('%s %s%s%s\n' % (move, xy, centre, e))
+        self.templates.append('%.0s' * 5)
+        z = ' Z%%.%df' % self.decimals
+        self.z_templates = [t.replace(xy, xy + z, 1) for t in self.templates[:-1]] + ['%.0s' * 6]
+        self.z_template = 'G0 F%d Z%%.%df\n' % (f_travel, self.decimals)
+
+    # Output
+    def write(self, filepath, layers, buffer_size=1 << 20):
+        ''' Writes the G-code for the layers (an iterable of lists of Path objects)
+        to the file. The layers are consumed one at a time, so a generator of layers
+        is never held in memory as a whole.'''
+        with open(filepath, 'w', buffering=buffer_size) as f:
+            for text in self.generate(layers):
+                f.write(text)
+
+    def generate(self, layers):
+        ''' Yields the G-code as a header, one string for each layer, and a footer.'''
+        self.reset()
+        yield self.header()
+        for i, paths in enumerate(layers):
+            yield self.formatLayer(i, paths)
+        yield self.footer()
+
+    def header(self):
+        ''' Returns the lines that set up the printer.'''
+        lines = [';Extrusion Paths for ' + self.name,
+                 ';Layer height: %g mm, line width: %g mm, filament: %g mm'
+                 % (self.layer_height, self.line_width, self.filament_diameter),
+                 'G21 ;millimetres', 'G90 ;absolute positions', 'M82 ;absolute extrusion',
+                 'G92 E0', '']
+        return '\n'.join(lines)
+
+    def footer(self):
+        ''' Returns the closing lines, with the totals of the print.'''
+        time = self.extruded_length / self.print_speed + self.travel_length / self.travel_speed
+        lines = ['M84 ;motors off', ';Filament used: %.*f mm' % (self.e_decimals, self.e),
+                 ';Moves: %d for %d points' % (self.moves_out, self.points_in),
+                 ';Extruded length: %.3f mm' % self.extruded_length,
+                 ';Travel length: %.3f mm' % self.travel_length,
+                 ';Time of Print: %.1f s' % time, '']
+        return '\n'.join(lines)
+
+    def formatLayer(self, index, paths: list):
+        ''' Returns the G-code for a layer of paths. Each path starts with a travel
+        move to its first point, followed by extruding moves through the rest. A
+        layer that starts where the last one ended carries on without a travel or
+        z move, so consecutive layers can form one continuous path.'''
+        pnts, starts, kinds, flow = layerArrays(paths)
+        if len(pnts) == 0: return ';LAYER:%d\n' % index
+        self.points_in += len(pnts)
+        moves = np.ones(len(pnts), dtype=int) #1 for a line, 2 for G2 and 3 for G3
+        centers = np.zeros((len(pnts), 2))
+        if self.arc_tol != None:
+            keep = self.findArcs(pnts, starts, moves, centers)
+            pnts, starts, moves, centers, flow = pnts[keep], starts[keep], moves[keep], centers[keep], flow[keep]
+        xy = pnts[:, :2]
+        lengths = np.zeros(len(xy))
+        lengths[1:] = np.linalg.norm(np.diff(xy, axis=0), axis=1)
+        arcs = np.flatnonzero(moves > 1)
+        lengths[arcs] = arcLength(xy[arcs - 1], xy[arcs], centers[arcs])
+        centers[arcs] -= xy[arcs - 1]
+        travel = lengths[starts].sum()
+        if self.position != None:
+            travel += np.linalg.norm(xy[0] - np.array(self.position))
+        lengths[starts] = 0
+        e = self.e + np.cumsum(lengths * flow) * self.e_per_mm
+        rows = 2 * moves
+        rows[np.flatnonzero(starts) + 1] -= 1
+        rows[starts] = 0
+        varying = bool(np.ptp(pnts[:, 2]) > 0)
+        continuous = self.position == tuple(xy[0]) and self.z == pnts[0, 2]
+        if continuous: rows[0] = -1
+        templates = [(self.z_templates if varying else self.templates)[k] for k in rows.tolist()]
+        for i, kind in self.findKindChanges(starts, kinds):
+            templates[i] = ';TYPE:%s\n' % kind.upper() + templates[i]
+        body = ''.join(templates)
+        columns = [xy, pnts[:, 2:3], centers, e] if varying else [xy, centers, e]
+        values = np.column_stack(columns).ravel().tolist()
+        self.moves_out += len(xy)
+        self.e = float(e[-1])
+        self.extruded_length += lengths.sum()
+        self.travel_length += travel
+        self.position = tuple(xy[-1])
+        self.z = pnts[-1, 2]
+        z_move = '' if continuous else self.z_template % pnts[0, 2]
+        return ';LAYER:%d\n' % index + z_move + body % tuple(values)
+
+    def findKindChanges(self, starts, kinds):
+        ''' Returns the row and the kind of each path whose kind differs from the
+        path before it, which is marked with a ";TYPE:" comment.'''
+        rows = np.flatnonzero(starts).tolist()
+        out = list()
+        for row, kind in zip(rows, kinds):
+            if kind != self.kind: out.append((row, kind))
+            self.kind = kind
+        return out
+
+    def findArcs(self, pnts, starts, moves, centers):
+        ''' Fits arcs along each path of the layer. Sets the move (2 or 3) and the
+        center at the last point of each arc, and returns a mask over the points that
+        is False for the points inside the arcs.'''
+        keep = np.ones(len(pnts), dtype=bool)
+        bounds = np.append(np.flatnonzero(starts), len(pnts))
+        for a, b in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            for i, j, center, ccw in fitArcs(pnts[a:b], self.arc_tol):
+                keep[a+i+1:a+j] = False
+                moves[a+j] = 3 if ccw else 2
+                centers[a+j] = center
+        return keep
+
+def layerArrays(paths: list):
+    ''' Returns the points of every path with at least two points as one [n x 3]
+    array, a boolean mask that is True at the first point of each path, the kind
+    of each path, and the number of layers extruded at each point (more than 1 for
+    infill printed once for a group of layers).'''
+    paths = [path for path in paths if len(path.points) > 1]
+    if len(paths) == 0: return np.zeros((0, 3)), np.zeros(0, dtype=bool), list(), np.zeros(0)
+    arrays = [np.asarray(path.points, dtype=float) for path in paths]
+    counts = np.array([len(a) for a in arrays])
+    starts = np.zeros(counts.sum(), dtype=bool)
+    starts[np.cumsum(counts) - counts] = True
+    flow = np.repeat([getattr(path, 'layers', 1) for path in paths], counts).astype(float)
+    return np.concatenate(arrays), starts, [getattr(path, 'kind', 'wall') for path in paths], flow
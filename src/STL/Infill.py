@@ -0,0 +1,277 @@
+import numpy as np
+
+from src.STL.SliceSTL import Slice
+import src.STL.Methods as mthd
+
+'''Set of functions for generating scanline infill with NumPy. Every hull edge is
+intersected with every scanline it spans in a single pass, so the cost grows with
+the number of crossings rather than with the number of scanlines times edges.
+'''
+def fillSlice(slice: Slice, horz_lines, vert_lines, resolution=None):
+    ''' Returns the infill segments for each region (outer hull and its holes) of the
+    slice as an [n x 2 x 2] array of x, y start and end points. The horizontal
+    segments come first, ordered by scanline and then by x, followed by the vertical
+    segments. Scanlines must be sorted and are restricted to the bounding box of
+    each region. If a resolution is given, the crossings are found exactly on an 
+    integer grid of that size (see scanlineSegments).'''
+    out = list()
+    for outer, holes in slice.getRegions():
+        edges = getRegionEdges([slice.hulls[i] for i in [outer] + holes])
+        bbox = slice.bboxes[outer]
+        out.append(scanlineSegments(edges, clipLines(horz_lines, bbox[1], bbox[3]), True, resolution))
+        out.append(scanlineSegments(edges, clipLines(vert_lines, bbox[0], bbox[2]), False, resolution))
+    if len(out) == 0: return np.zeros((0, 2, 2))
+    return np.concatenate(out)
+
+def fillSliceZigzag(slice: Slice, horz_lines, vert_lines, resolution=None, max_link=3.):
+    ''' Returns the infill of each region of the slice as a list of [k x 2] arrays of
+    x, y points, in which the segments of adjacent scanlines are linked into zig-zags
+    along the boundary of the region (see zigzagSegments). The horizontal polylines
+    of each region come before its vertical ones.'''
+    out = list()
+    for outer, holes in slice.getRegions():
+        hulls = [slice.hulls[i] for i in [outer] + holes]
+        edges = getRegionEdges(hulls)
+        sizes = [len(hull.pnts) for hull in hulls]
+        bbox = slice.bboxes[outer]
+        out.extend(zigzagSegments(edges, sizes, clipLines(horz_lines, bbox[1], bbox[3]), True, resolution, max_link))
+        out.extend(zigzagSegments(edges, sizes, clipLines(vert_lines, bbox[0], bbox[2]), False, resolution, max_link))
+    return out
+
+def fillSlices(slices: list, horz_lines, vert_lines, resolution=None):
+    ''' Returns the infill segments inside every one of the slices, as an [n x 2 x 2]
+    array of x, y start and end points, so that infill for a group of layers can be
+    printed once. The horizontal segments come first, ordered by scanline and then by
+    x, followed by the vertical segments. See fillSlice for the inputs.'''
+    out = list()
+    for lines, is_horizontal, axis in ((horz_lines, True, 1), (vert_lines, False, 0)):
+        sets = list()
+        for slice in slices:
+            segments = [scanlineSegments(getRegionEdges([slice.hulls[i] for i in [outer] + holes]),
+                                         clipLines(lines, slice.bboxes[outer][axis], slice.bboxes[outer][axis+2]),
+                                         is_horizontal, resolution)
+                        for outer, holes in slice.getRegions()]
+            sets.append(np.concatenate(segments) if len(segments) > 0 else np.zeros((0, 2, 2)))
+        out.append(intersectSegments(sets, is_horizontal))
+    return np.concatenate(out)
+
+def intersectSegments(segment_sets: list, is_horizontal=True):
+    ''' Returns the parts of the scanlines covered by a segment of every set, as an
+    [n x 2 x 2] array ordered by scanline and position. The segments of each set 
+    must run forwards along the scanlines and not overlap each other.
+
+    Notes
+    ---
+    Each segment adds 1 to a count from its start to its end, so the intersection
+    is where the count equals the number of sets. The ends are sorted by scanline
+    and position, with the ends of segments before the starts, so segments that
+    only touch do not give a part of zero length.
+    '''
+    a = 1 if is_horizontal else 0
+    b = 1 - a
+    if len(segment_sets) == 0: return np.zeros((0, 2, 2))
+    segments = np.concatenate(segment_sets)
+    if len(segments) == 0: return segments
+    line = np.repeat(segments[:, 0, a], 2)
+    pos = segments[:, :, b].ravel()
+    step = np.tile([1, -1], len(segments))
+    order = np.lexsort((step, pos, line))
+    line, pos, step = line[order], pos[order], step[order]
+    count = np.cumsum(step)
+    ids = np.flatnonzero((count[:-1] == len(segment_sets)) & (pos[1:] > pos[:-1]))
+    out = np.empty((len(ids), 2, 2), dtype=segments.dtype)
+    out[:, :, a] = line[ids][:, None]
+    out[:, 0, b] = pos[ids]
+    out[:, 1, b] = pos[ids + 1]
+    return out
+
+def getRegionEdges(hulls: list):
+    ''' Returns the edges of the hulls as an [m x 2 x 2] array of x, y start and end
+    points. Each hull is closed if its last point differs from its first.'''
+    edges = list()
+    for hull in hulls:
+        pnts = hull.getArray()
+        edges.append(np.stack([pnts, np.roll(pnts, -1, axis=0)], axis=1))
+    return np.concatenate(edges)
+
+def clipLines(lines, low, high):
+    ''' Returns the sorted scanline coordinates that lie strictly between low and
+    high, so that no scanline runs along the boundary of a region.'''
+    lines = np.asarray(lines, dtype=float)
+    return lines[np.searchsorted(lines, low, 'right'):np.searchsorted(lines, high, 'left')]
+
+def scanlineSegments(edges, lines, is_horizontal=True, resolution=None):
+    ''' Returns the segments inside the closed profiles defined by edges along each
+    of the sorted scanlines, as an [n x 2 x 2] array. Horizontal scanlines are at
+    y = line and vertical scanlines are at x = line. If a resolution is given, the 
+    edges and scanlines are rounded to integer multiples of it and the crossings are
+    computed with integer arithmetic (rounded to the grid), so the result does not
+    depend on floating point rounding.
+
+    Notes
+    ---
+    An edge crosses a scanline if the scanline lies in the half open interval
+    [min, max) of the edge, so a scanline through a shared vertex is counted once
+    and edges parallel to the scanline are ignored. Crossings are sorted by scanline
+    and position, then paired even-odd.
+    '''
+    if resolution != None:
+        edges = np.rint(np.asarray(edges, dtype=float) / resolution).astype(np.int64)
+        lines = np.rint(np.asarray(lines, dtype=float) / resolution).astype(np.int64)
+        return scanlineSegments(edges, lines, is_horizontal) * resolution
+    edges = np.asarray(edges)
+    lines = np.asarray(lines)
+    if edges.dtype.kind != 'i' or lines.dtype.kind != 'i':
+        edges, lines = edges.astype(float), lines.astype(float)
+    if len(edges) == 0 or len(lines) == 0: return np.zeros((0, 2, 2), dtype=edges.dtype)
+    line_ids, along, edge_ids = scanlineCrossings(edges, lines, is_horizontal)
+    starts, ends = pairCrossings(line_ids, along)
+    return makeSegments(lines, line_ids, along, starts, ends, is_horizontal)
+
+def scanlineCrossings(edges, lines, is_horizontal=True):
+    ''' Returns the crossings of the edges with the sorted scanlines (see
+    scanlineSegments) as the index of the scanline, the position along it and the
+    index of the edge of each crossing, sorted by scanline and then position.'''
+    a = 1 if is_horizontal else 0 #Axis across the scanlines
+    b = 1 - a #Axis along the scanlines
+    lo = np.minimum(edges[:, 0, a], edges[:, 1, a])
+    hi = np.maximum(edges[:, 0, a], edges[:, 1, a])
+    first = np.searchsorted(lines, lo, 'left')
+    counts = np.searchsorted(lines, hi, 'left') - first
+    edge_ids = np.repeat(np.arange(len(edges)), counts)
+    line_ids = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(len(edge_ids))
+    p1 = edges[edge_ids, 0]
+    p2 = edges[edge_ids, 1]
+    c = lines[line_ids]
+    if edges.dtype.kind == 'i':
+        along = p1[:, b] + mthd.roundDivide((p2[:, b] - p1[:, b]) * (c - p1[:, a]), p2[:, a] - p1[:, a])
+    else:
+        t = (c - p1[:, a]) / (p2[:, a] - p1[:, a])
+        along = p1[:, b] + t * (p2[:, b] - p1[:, b])
+    order = np.lexsort((along, line_ids))
+    return line_ids[order], along[order], edge_ids[order]
+
+def pairCrossings(line_ids, along):
+    ''' Pairs the sorted crossings of each scanline even-odd. Returns the indices of
+    the first and second crossing of each segment of non-zero length.'''
+    group_start = np.searchsorted(line_ids, line_ids, 'left')
+    rank = np.arange(len(line_ids)) - group_start
+    starts = np.flatnonzero((rank % 2 == 0)[:-1] & (line_ids[1:] == line_ids[:-1]))
+    ends = starts + 1
+    nonzero = along[ends] > along[starts]
+    return starts[nonzero], ends[nonzero]
+
+def makeSegments(lines, line_ids, along, starts, ends, is_horizontal=True):
+    ''' Returns the segments between the paired crossings as an [n x 2 x 2] array.'''
+    a = 1 if is_horizontal else 0
+    b = 1 - a
+    segments = np.empty((len(starts), 2, 2), dtype=along.dtype)
+    segments[:, 0, b] = along[starts]
+    segments[:, 1, b] = along[ends]
+    segments[:, :, a] = lines[line_ids[starts]][:, None]
+    return segments
+
+def zigzagSegments(edges, hull_sizes, lines, is_horizontal=True, resolution=None, max_link=3.):
+    ''' Returns the segments inside the closed profiles along each of the sorted
+    scanlines (see scanlineSegments), linked into zig-zag polylines along the
+    boundary, as a list of [k x 2] arrays. The edges are those of each hull in turn
+    (see getRegionEdges), with hull_sizes edges per hull.
+
+    Notes
+    ---
+    Following the boundary forwards from a crossing leads to the next crossing along
+    it, and the boundary between the two stays between their scanlines. Where these
+    are adjacent scanlines, that stretch of boundary can link the segments ending at
+    the two crossings without crossing any other segment. Links are taken shortest
+    first, skipping those longer than max_link times the scanline spacing, those at a
+    crossing that is already linked, and those that would close a loop, so the result
+    is a set of open polylines. Apart from sorting, the cost is linear in the number
+    of edges and crossings.
+    '''
+    if resolution != None:
+        edges = np.rint(np.asarray(edges, dtype=float) / resolution).astype(np.int64)
+        lines = np.rint(np.asarray(lines, dtype=float) / resolution).astype(np.int64)
+        return [pnts * resolution for pnts in zigzagSegments(edges, hull_sizes, lines, is_horizontal, None, max_link)]
+    edges = np.asarray(edges)
+    lines = np.asarray(lines)
+    if edges.dtype.kind != 'i' or lines.dtype.kind != 'i':
+        edges, lines = edges.astype(float), lines.astype(float)
+    if len(edges) == 0 or len(lines) == 0: return list()
+    a = 1 if is_horizontal else 0
+    line_ids, along, edge_ids = scanlineCrossings(edges, lines, is_horizontal)
+    starts, ends = pairCrossings(line_ids, along)
+    segments = makeSegments(lines, line_ids, along, starts, ends, is_horizontal)
+    if len(segments) < 2: return list(segments)
+    crossings = np.empty((len(line_ids), 2), dtype=along.dtype)
+    crossings[:, a] = lines[line_ids]
+    crossings[:, 1 - a] = along
+    segment_of = np.full(len(line_ids), -1)
+    segment_of[starts] = np.arange(len(starts))
+    segment_of[ends] = np.arange(len(ends))
+
+    # The next crossing along the boundary of the same hull
+    hull_sizes = np.asarray(hull_sizes)
+    hull_first = np.cumsum(hull_sizes) - hull_sizes
+    hull_of_edge = np.repeat(np.arange(len(hull_sizes)), hull_sizes)
+    forward = np.lexsort((np.abs(lines[line_ids] - edges[edge_ids, 0, a]), edge_ids))
+    hull = hull_of_edge[edge_ids[forward]]
+    last = np.flatnonzero(np.r_[hull[1:] != hull[:-1], True])
+    nxt = np.roll(forward, -1)
+    nxt[last] = forward[np.r_[0, last[:-1] + 1]]
+
+    # Links between segments ending on adjacent scanlines
+    x, y = forward, nxt
+    ok = (np.abs(line_ids[x] - line_ids[y]) == 1) & (segment_of[x] >= 0) & (segment_of[y] >= 0)
+    x, y = x[ok], y[ok]
+    if len(x) == 0: return list(segments)
+    ex, ey = edge_ids[x], edge_ids[y]
+    first, size = hull_first[hull_of_edge[ex]], hull_sizes[hull_of_edge[ex]]
+    num_vertices = (ey - ex) % size
+    link_offsets = np.r_[0, np.cumsum(num_vertices + 2)]
+    rank = np.arange(link_offsets[-1]) - np.repeat(link_offsets[:-1], num_vertices + 2)
+    link = np.repeat(np.arange(len(x)), num_vertices + 2)
+    vertex = first[link] + (ex[link] - first[link] + rank) % size[link]
+    link_pnts = edges[vertex, 0].astype(crossings.dtype)
+    link_pnts[link_offsets[:-1]] = crossings[x]
+    link_pnts[link_offsets[1:] - 1] = crossings[y]
+    step = np.linalg.norm(np.diff(link_pnts, axis=0), axis=1)
+    length = np.add.reduceat(np.r_[step, 0], link_offsets[:-1]) - np.r_[step, 0][link_offsets[1:] - 1]
+    spacing = np.abs(lines[line_ids[x]] - lines[line_ids[y]])
+    keep = np.flatnonzero(length <= max_link * spacing)
+    keep = keep[np.argsort(length[keep], kind='stable')]
+
+    # Take the shortest links that neither reuse a crossing nor close a loop
+    root = list(range(len(segments)))
+    def findRoot(i):
+        while root[i] != i:
+            root[i] = root[root[i]]
+            i = root[i]
+        return i
+    linked = dict() #Crossing: (crossing at the other end, points of the link)
+    for k in keep.tolist():
+        i, j = int(x[k]), int(y[k])
+        if i in linked or j in linked: continue
+        ri, rj = findRoot(segment_of[i]), findRoot(segment_of[j])
+        if ri == rj: continue
+        root[ri] = rj
+        pnts = link_pnts[link_offsets[k] + 1:link_offsets[k + 1] - 1]
+        linked[i] = (j, pnts)
+        linked[j] = (i, pnts[::-1])
+
+    # Walk each polyline from a segment end without a link
+    other = np.empty(len(line_ids), dtype=np.int64)
+    other[starts], other[ends] = ends, starts
+    done = np.zeros(len(segments), dtype=bool)
+    out = list()
+    for entry in np.concatenate([starts, ends]).tolist():
+        if entry in linked or done[segment_of[entry]]: continue
+        parts = list()
+        while True:
+            done[segment_of[entry]] = True
+            exit = int(other[entry])
+            parts.append(crossings[[entry, exit]])
+            if exit not in linked: break
+            entry, pnts = linked[exit]
+            parts.append(pnts)
+        out.append(np.concatenate(parts))
+    return out
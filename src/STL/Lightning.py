@@ -0,0 +1,149 @@
+from math import tan, radians
+import numpy as np
+
+from src.STL.SliceSTL import Slice
+from src.STL.Infill import getRegionEdges, fillSlices, intersectSegments
+from src.STL.DistanceField import fillGridRows
+from src.STL.SpatialHash import uniquePoints
+
+'''Set of functions for lightning infill, a sparse infill that only holds up the top
+surfaces of a part instead of filling its whole volume.
+
+The layers are planned from the top down on the nodes of the infill grid (where the
+horizontal and vertical scanlines cross). The grid infill is kept for a few layers
+below each top surface, and the nodes under the bottom of that dense infill become
+the tips of trees that are grown down to the walls. On each layer, every tree node
+is joined by a straight line to its parent: the nearest node that is closer to the
+walls, or the nearest point of the walls if no such node is close enough for the
+line to stay inside the region. Going down, each leaf moves towards its parent by
+the distance a line can overhang the one below it, so the trees shrink into the
+walls and vanish, and branches that meet are merged.
+'''
+def planLightning(regions: list, horz_lines, vert_lines, layer_height, support_angle=40.,
+                  skin_layers=3, resolution=None):
+    ''' Returns the infill of each layer as a list of [k x 2] arrays of x, y points.
+
+    Inputs
+    ---
+    regions : list of Slice objects (or None)
+        The region left for infill on each layer, from the bottom layer up. None is
+        an empty layer.
+    horz_lines, vert_lines : np.array
+        The sorted y and x coordinates of the infill scanlines
+    layer_height : float
+        The thickness of each layer, which is also the distance within which tree
+        nodes are merged.
+    support_angle : float, default: 40
+        The largest angle from vertical (in degrees) at which a line is held up by
+        the line below it, which sets how far the trees shrink on each layer.
+    skin_layers : int, default: 3
+        The number of layers below each top surface that are filled with the grid
+        infill.
+    resolution : float, optional
+        The size of the integer grid used for exact infill crossings.
+    '''
+    x = np.asarray(vert_lines, dtype=float)
+    y = np.asarray(horz_lines, dtype=float)
+    step = layer_height * tan(radians(support_angle))
+    out = [list() for region in regions]
+    above = list() #The inside masks of the layers above, nearest first
+    above_dense = np.zeros((len(x), len(y)), dtype=bool)
+    nodes = np.zeros((0, 2))
+    for i in reversed(range(len(regions))):
+        region = regions[i]
+        if region == None or len(x) == 0 or len(y) == 0:
+            inside = np.zeros((len(x), len(y)), dtype=bool)
+            above_dense = inside
+            nodes = np.zeros((0, 2))
+        else:
+            inside = fillGridRows(region, x, y)
+            covered = np.logical_and.reduce(above) if len(above) == skin_layers else np.zeros_like(inside)
+            dense = inside & ~covered
+            # The nodes under the bottom of dense infill start new trees
+            new = np.argwhere(above_dense & inside & ~dense)
+            nodes = np.concatenate([nodes, np.column_stack([x[new[:, 0]], y[new[:, 1]]])])
+            if len(nodes) > 0: nodes = nodes[region.isInside(nodes)]
+            if len(nodes) > 0: nodes = uniquePoints(nodes, layer_height)[0]
+            lines, nodes = growTrees(nodes, getRegionEdges(region.hulls), step)
+            if resolution != None: lines = [np.rint(pnts / resolution) * resolution for pnts in lines]
+            out[i] = list(denseInfill(region, dense, x, y, resolution)) + lines
+            above_dense = dense
+        if skin_layers > 0: above = [inside] + above[:skin_layers - 1]
+    return out
+
+def denseInfill(region: Slice, dense, x, y, resolution=None):
+    ''' Returns the grid infill segments of the region around the dense grid nodes
+    (a boolean [len(x) x len(y)] array), as an [n x 2 x 2] array. Each dense node
+    covers half of the grid spacing on either side of it.'''
+    out = list()
+    for mask, lines, is_horizontal in ((dense, y, True), (dense.T, x, False)):
+        segments = fillSlices([region], y if is_horizontal else [], [] if is_horizontal else x, resolution)
+        runs = maskIntervals(mask, x if is_horizontal else y, lines, is_horizontal)
+        out.append(intersectSegments([segments, runs], is_horizontal))
+    return np.concatenate(out)
+
+def maskIntervals(mask, along, lines, is_horizontal=True):
+    ''' Returns the intervals along the scanlines covered by the runs of True in the
+    [len(along) x len(lines)] mask, as an [n x 2 x 2] array of segments. Each node of
+    a run covers half of the spacing to its neighbours.'''
+    a = 1 if is_horizontal else 0
+    half = np.diff(along).min() / 2 if len(along) > 1 else np.inf
+    padded = np.zeros((len(along) + 2, len(lines)), dtype=np.int8)
+    padded[1:-1] = mask
+    change = np.diff(padded, axis=0)
+    first_i, first_line = np.nonzero(change.T == 1)[::-1]
+    last_i, last_line = np.nonzero(change.T == -1)[::-1]
+    segments = np.empty((len(first_i), 2, 2))
+    segments[:, :, a] = lines[first_line][:, None]
+    segments[:, 0, 1 - a] = along[first_i] - half
+    segments[:, 1, 1 - a] = along[last_i - 1] + half
+    return segments
+
+def growTrees(nodes, edges, step, block_size=1000000):
+    ''' Returns the lines joining each of the [n x 2] tree nodes to its parent, as
+    a list of [2 x 2] arrays, and the nodes of the next layer down, in which each
+    leaf has moved step towards its parent (or is removed if it reaches it). The
+    parent is the nearest node closer to the walls (the edges of the region) than
+    the node, if it is nearer than the walls, and otherwise the nearest point of the
+    walls. Either way the line lies within the region.'''
+    if len(nodes) == 0: return list(), nodes
+    dist, near = nearestEdgePoints(nodes, edges, block_size)
+    parent = np.full(len(nodes), -1)
+    best = dist.copy()
+    rows = max(1, block_size // len(nodes))
+    for start in range(0, len(nodes), rows):
+        gap = np.linalg.norm(nodes[start:start+rows, None, :] - nodes[None, :, :], axis=2)
+        gap[dist[None, :] >= dist[start:start+rows, None]] = np.inf
+        j = gap.argmin(axis=1)
+        d = gap[np.arange(len(j)), j]
+        closer = d < best[start:start+rows]
+        parent[start:start+rows][closer] = j[closer]
+    target = np.where((parent >= 0)[:, None], nodes[np.maximum(parent, 0)], near)
+    lines = [pnts for pnts in np.stack([nodes, target], axis=1)]
+
+    leaf = np.bincount(parent[parent >= 0], minlength=len(nodes)) == 0
+    offset = target - nodes
+    length = np.linalg.norm(offset, axis=1)
+    moved = nodes + offset * (np.minimum(step, length) / np.where(length > 0, length, 1))[:, None]
+    keep = ~leaf | (length > step)
+    return lines, np.where(leaf[:, None], moved, nodes)[keep]
+
+def nearestEdgePoints(points, edges, block_size=1000000):
+    ''' Returns the distance from each of the [n x 2] points to the nearest of the
+    [m x 2 x 2] edges, and the nearest point on that edge.'''
+    a = edges[:, 0]
+    seg = edges[:, 1] - a
+    seg_len = np.einsum('ij,ij->i', seg, seg)
+    dist = np.empty(len(points))
+    near = np.empty((len(points), 2))
+    rows = max(1, block_size // max(len(a), 1))
+    for start in range(0, len(points), rows):
+        p = points[start:start+rows, None, :]
+        t = np.einsum('ijk,jk->ij', p - a, seg) / np.maximum(seg_len, 1e-300)
+        closest = a + np.clip(t, 0, 1)[:, :, None] * seg
+        d = ((p - closest)**2).sum(axis=2)
+        j = d.argmin(axis=1)
+        k = np.arange(len(j))
+        dist[start:start+rows] = np.sqrt(d[k, j])
+        near[start:start+rows] = closest[k, j]
+    return dist, near
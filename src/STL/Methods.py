@@ -73,7 +73,8 @@ def sumVectors(vectors: list):
     return out
 
 def cleanDuplicates(vectors: list, tol=.01):
-    ''' Removes duplicates in vectors'''
+    ''' Removes duplicates in vectors. This scans every kept vector, so for more than
+    a few vectors use SpatialHash.uniquePoints with the angular metric.'''
     out = list()
     for a in vectors:
         for b in out:
@@ -84,7 +85,8 @@ def cleanDuplicates(vectors: list, tol=.01):
     return out
 
 def safeAppend(pointslist: list, pnt):
-    ''' Appends the pnt to pointslist if the pnt is not previously found in pointslist'''
+    ''' Appends the pnt to pointslist if the pnt is not previously found in pointslist.
+    This scans the whole list, so for more than a few points use SpatialHash.'''
     for point in pointslist:
         if checkSimilarTuples(point, pnt):
             return pointslist
@@ -163,3 +165,43 @@ def calculateNormal(pnt1, pnt2, pnt3):
     if temp == 0: return out.tolist()
     out = out / temp
     return out.tolist()
+
+def signedArea(polygon):
+    ''' Returns the signed area of the closed polygon (an [n x 2] array of x, y
+    coordinates) using the shoelace formula. Counter-clockwise polygons have a
+    positive area.'''
+    pnts = np.asarray(polygon, dtype=float)[:, 0:2]
+    x = pnts[:, 0]
+    y = pnts[:, 1]
+    return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+def windingNumbers(points, polygon, block_size=1000000):
+    ''' Returns an array of the winding number of the closed polygon around each 
+    of the points. The points are an [n x 2] array and the polygon an [m x 2] array
+    of x, y coordinates (a repeated closing point is allowed). A point is contained 
+    by the polygon if its winding number is non-zero. The points are tested in 
+    blocks so that no more than block_size point-edge pairs are held in memory.'''
+    pnts = np.asarray(points, dtype=float)[:, 0:2]
+    poly = np.asarray(polygon, dtype=float)[:, 0:2]
+    a = poly
+    b = np.roll(poly, -1, axis=0)
+    out = np.zeros(len(pnts), dtype=int)
+    step = max(1, block_size // max(1, len(a)))
+    for start in range(0, len(pnts), step):
+        px = pnts[start:start+step, 0:1]
+        py = pnts[start:start+step, 1:2]
+        is_left = (b[:, 0] - a[:, 0]) * (py - a[:, 1]) - (px - a[:, 0]) * (b[:, 1] - a[:, 1])
+        upward = (a[:, 1] <= py) & (b[:, 1] > py) & (is_left > 0)
+        downward = (a[:, 1] > py) & (b[:, 1] <= py) & (is_left < 0)
+        out[start:start+step] = upward.sum(axis=1) - downward.sum(axis=1)
+    return out
+
+def roundDivide(num, den):
+    ''' Returns num / den rounded to the nearest integer (halves away from zero) for
+    integer arrays, using only integer arithmetic so that the result is exact and
+    the same on every platform. den must not be zero.'''
+    num = np.asarray(num, dtype=np.int64)
+    den = np.asarray(den, dtype=np.int64)
+    sign = np.where((num < 0) != (den < 0), -1, 1)
+    num, den = np.abs(num), np.abs(den)
+    return sign * ((2 * num + den) // (2 * den))
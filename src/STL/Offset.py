@@ -1,83 +1,164 @@
-from src.STL.ReadSTL import STL, STL_Facet
-import src.STL.Methods as mthd
+from src.STL.ReadSTL import STL, MeshData
+from src.STL.DistanceField import getSDFOffsetSTL
+from src.STL.SpatialHash import uniquePoints
 import numpy as np
 
 '''Set of functions for generating an offset.
 
-Status: Currently these functions produce singular matrix values that are ill-suited
-for offsetting. Work needs to be done to identify this problem. -JM, 5 May 2022
+Each offset vertex is moved along the vector that lies a unit distance from the
+planes of all the distinct faces around it, following
+https://www.emerald.com/insight/content/doi/10.1108/13552540310477436/full/html
+
+The vertices are first welded into a shared index, so each unique vertex is
+computed once, and the small weight systems of all vertices with the same number of
+distinct normals are solved together. Vertices whose system is singular (more than
+three distinct normals, or normals that are nearly parallel) fall back to the mean
+of their normals.
+
+Setting mode to "sdf" offsets through a signed distance field instead (see the
+DistanceField module), which handles sharp and concave features and large inwards
+offsets at the cost of resampling the surface on a grid.
 '''
-def getOffsetSTL(stl: STL, offset):
+def getOffsetSTL(stl: STL, offset, tol=1e-4, max_scale=3., mode='vertex', resolution=None):
     ''' Returns a similar STL where each point has been offset by the specified value.
-    Negative offset values result in inwards (reduced) offsets.'''
+    Negative offset values result in inwards (reduced) offsets.
+
+    Inputs
+    ---
+    stl : STL
+        The STL object to offset
+    offset : float
+        The offset distance, in the units of the stl coordinates
+    tol : float, default: 1e-4
+        Vertices closer than tol are treated as the same vertex
+    max_scale : float, default: 3.
+        The largest displacement of a vertex, as a multiple of offset. This limits
+        spikes at sharp edges, similar to a miter limit.
+    mode : str ("vertex" or "sdf"), default: "vertex"
+        Whether to move the vertices of the stl, or to extract the offset surface
+        from a signed distance field.
+    resolution : float, optional
+        The spacing of the distance grid in "sdf" mode. Defaults to 1/100 of the
+        longest side of the bounding box.
+    '''
+    if mode == 'sdf': return getSDFOffsetSTL(stl, offset, resolution)
+    mesh = stl.getMesh()
+    points, index = weldVertices(mesh.vertices.reshape(-1, 3), tol)
+    normals = getUnitNormals(mesh.normals, mesh.vertices)
+    vectors = getOffsetVectors(index.reshape(-1, 3), normals, len(points), max_scale)
     out = stl.emptyCopy()
-    for face in stl.faces:
-        out_pnts = list()
-        for pnt in face.vertices:
-            dir = getOffsetDistance(stl, pnt, offset)
-            out_pnts.append(mthd.sumVectors([pnt, dir]))
-            #FIXME: Delete
-            for pnt in out_pnts[-1]:
-                if pnt > 1e9: print(dir)
-            # Delete Above
-        out.faces.append(STL_Facet(face.normal, out_pnts))
+    out.setMesh(MeshData((points + offset * vectors)[index], mesh.normals))
     return out
 
-def getOffsetDistance(stl: STL, point, offset):
-    ''' Finds the direction of offsetting for a specified point by taking the sum of 
-    the normalized normals for all the edges connected to the point.'''
-    vector = getOffsetVector(stl, point)
-    dir = mthd.normalizeVector(vector)
-    dir = [dir[i] * offset for i in range(len(dir))]
-    return dir
+def weldVertices(points, tol=1e-4):
+    ''' Returns the unique points (within tol of each other) as an [m x 3] array and
+    the index of the unique point for each of the inputted points.'''
+    return uniquePoints(points, tol)
+
+def getUnitNormals(normals, vertices):
+    ''' Returns the face normals scaled to unit length. Normals of zero length are
+    recalculated from the vertices of the face.'''
+    normals = np.array(normals, dtype=float).reshape(-1, 3)
+    length = np.linalg.norm(normals, axis=1)
+    missing = length == 0
+    if missing.any():
+        v = vertices[missing]
+        normals[missing] = np.cross(v[:, 1] - v[:, 0], v[:, 2] - v[:, 0])
+        length[missing] = np.linalg.norm(normals[missing], axis=1)
+    return normals / np.maximum(length, 1e-300)[:, None]
 
-def getOffsetVector(stl: STL, point):
-    ''' Returns the vector off the displacement of the point.'''
-    normals = getConnectedNormals(stl, point)
-    normals = mthd.cleanDuplicates(normals, .2)
-    weights = calculateOffsetWeights(normals)
-    if weights[0] == None:
-        return mthd.sumVectors(normals)
-    else: return calculateWeightedVector(weights, normals)
+def getOffsetVectors(faces, normals, num_points, max_scale=3., block_size=1000000):
+    ''' Returns the offset vector of each welded point as an [num_points x 3] array.
+    Each vector is the weighted sum of the distinct normals around the point, where
+    the weights are solved from calculateOffsetWeights. Faces with no area are
+    ignored.
 
-def calculateWeightedVector(weights, normals):
-    ''' Calculates the weighted vector.'''
-    temp = list()
-    for i in range(len(normals)):
-        temp.append([normals[i][j] * weights[i] for j in range(len(normals[i]))])
-    out = averageVectors(temp)
+    Inputs
+    ---
+    faces : [n x 3] np.array
+        The index of the welded point at each corner of each face
+    normals : [n x 3] np.array
+        The unit normal of each face
+    num_points : int
+        The number of welded points
+    max_scale : float, default: 3.
+        The largest length of an offset vector
+    block_size : int, default: 1000000
+        Points are processed in blocks, sorted by the number of faces around them,
+        so that each block holds about block_size normal pairs.
+    '''
+    has_area = np.linalg.norm(normals, axis=1) > 0.5
+    point_ids = faces[has_area].reshape(-1)
+    face_ids = np.repeat(np.flatnonzero(has_area), 3)
+    order = np.argsort(point_ids, kind='stable')
+    face_ids = face_ids[order]
+    counts = np.bincount(point_ids, minlength=num_points)
+    offsets = np.cumsum(counts) - counts
+
+    out = np.zeros((num_points, 3))
+    by_count = np.argsort(counts, kind='stable')
+    start = np.searchsorted(counts[by_count], 1)
+    while start < num_points:
+        sizes = np.arange(1, num_points - start + 1) * counts[by_count[start:]]**2
+        end = start + max(1, int(np.searchsorted(sizes, block_size, 'right')))
+        points = by_count[start:end]
+        width = counts[points].max()
+        slot = np.arange(width)[None, :]
+        valid = slot < counts[points][:, None]
+        index = np.where(valid, offsets[points][:, None] + slot, 0)
+        connected = normals[face_ids[index]] * valid[:, :, None]
+        connected, num_normals = getDistinctNormals(connected, valid)
+        out[points] = solveOffsetVectors(connected, num_normals)
+        start = end
+    scale = np.linalg.norm(out, axis=1)
+    too_long = scale > max_scale
+    out[too_long] *= (max_scale / scale[too_long])[:, None]
     return out
 
-def getConnectedNormals(stl: STL, point):
-    ''' Returns a list of the normals for all faces that contain the specifed point'''
-    out = list()
-    for face in stl.faces:
-        for pnt in face.vertices:
-            if mthd.checkSimilarTuples(pnt, point):
-                out.append(face.normal)
-                continue
-    out = mthd.cleanDuplicates(out)
+def getDistinctNormals(connected, valid, tol=.02):
+    ''' Removes the normals parallel (within tol of 1 - |cos|) to an earlier normal 
+    of the same point. Returns the distinct normals moved to the front of each row
+    of the [m x k x 3] array (padded with zeros), and the number of distinct 
+    normals for each point.'''
+    cos = np.abs(np.einsum('pik,pjk->pij', connected, connected))
+    earlier = np.tril(np.ones(cos.shape[1:], dtype=bool), -1)
+    duplicate = ((1 - cos < tol) & earlier & valid[:, None, :]).any(axis=2)
+    keep = valid & ~duplicate
+    order = np.argsort(~keep, axis=1, kind='stable')
+    connected = np.take_along_axis(connected, order[:, :, None], axis=1)
+    num_normals = keep.sum(axis=1)
+    connected[np.arange(connected.shape[1])[None, :] >= num_normals[:, None]] = 0
+    return connected, num_normals
+
+def solveOffsetVectors(connected, num_normals):
+    ''' Returns the offset vector for each point from its distinct normals. Points
+    with the same number of normals are solved together, and points with a singular
+    system use the mean of their normals.'''
+    out = np.zeros((len(connected), 3))
+    for k in np.unique(num_normals):
+        if k == 0: continue
+        points = np.flatnonzero(num_normals == k)
+        group = connected[points, 0:k]
+        weights = calculateOffsetWeights(group)
+        vectors = np.einsum('pk,pkj->pj', np.nan_to_num(weights), group)
+        singular = np.isnan(weights).any(axis=1)
+        mean = group.sum(axis=1)
+        mean /= np.maximum(np.linalg.norm(mean, axis=1), 1e-300)[:, None]
+        vectors[singular] = mean[singular]
+        out[points] = vectors
     return out
 
-def calculateOffsetWeights(normals: list):
+def calculateOffsetWeights(normals, min_det=1e-6):
     ''' Calculates weighted average for offset norms according to
     https://www.emerald.com/insight/content/doi/10.1108/13552540310477436/full/html
-    '''
-    matrix = list()
-    for i in range(len(normals)):
-        row = list()
-        for j in range(len(normals)):
-            row.append(np.dot(normals[i], normals[j]))
-        matrix.append(row)
-    matrix = np.array(matrix)
-    try: out = np.linalg.solve(matrix, np.ones(len(matrix)))
-    except np.linalg.LinAlgError:
-        return [None]
-    return out
-
-def averageVectors(vectors: list):
-    ''' Returns the average of the vectors.'''
-    l = len(vectors[0])
-    sum = mthd.sumVectors(vectors)
-    out = [sum[i] / l for i in range(l)]
+    for a batch of points with the same number of normals, as an [m x k x 3] array.
+    The weights solve G w = 1, where G is the matrix of dot products between the
+    normals of a point. Returns an [m x k] array, where the rows of singular systems
+    are NaN.'''
+    gram = np.einsum('pik,pjk->pij', normals, normals)
+    out = np.full(normals.shape[0:2], np.nan)
+    solvable = np.abs(np.linalg.det(gram)) > min_det
+    if solvable.any():
+        ones = np.ones((int(solvable.sum()), normals.shape[1], 1))
+        out[solvable] = np.linalg.solve(gram[solvable], ones)[:, :, 0]
     return out
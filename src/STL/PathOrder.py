@@ -0,0 +1,195 @@
+from time import perf_counter
+import numpy as np
+
+'''Set of functions for ordering the paths of a layer to shorten the travel moves
+between them.
+
+Each path is chosen greedily as the nearest unprinted path to the end of the last
+one, found with a grid index of the places a path can be entered: either end of an
+open path (which is then printed backwards if entered at its end), or any point of a
+closed loop (which is then started there). The order can be refined with 2-opt moves,
+which reverse a run of paths, until no move shortens the travel or a time budget
+runs out.
+'''
+class GridIndex:
+    def __init__(self, points, cell=None):
+        ''' A grid of square cells over the [n x 2] points, for finding the nearest
+        point that has not been removed.'''
+        self.points = np.asarray(points, dtype=float).reshape(-1, 2)
+        self.alive = np.ones(len(self.points), dtype=bool)
+        self.num_alive = len(self.points)
+        if cell == None:
+            extent = np.ptp(self.points, axis=0).max() if len(self.points) > 0 else 1
+            cell = max(extent / np.sqrt(max(len(self.points), 1)), 1e-6)
+        self.cell = cell
+        cells = np.floor(self.points / cell).astype(np.int64)
+        self.low = cells.min(axis=0) if len(cells) > 0 else np.zeros(2, dtype=np.int64)
+        self.high = cells.max(axis=0) if len(cells) > 0 else np.zeros(2, dtype=np.int64)
+        self.cells = dict()
+        for i, key in enumerate(map(tuple, cells.tolist())):
+            self.cells.setdefault(key, list()).append(i)
+
+    def remove(self, ids):
+        ''' Marks the points as removed.'''
+        self.num_alive -= int(self.alive[ids].sum())
+        self.alive[ids] = False
+
+    def nearest(self, point):
+        ''' Returns the index of the nearest point that has not been removed (the
+        lowest index of equally near points), or None if all are removed. The
+        cells are searched in rings around the point until no closer point can be
+        found.'''
+        if self.num_alive == 0: return None
+        cx, cy = np.floor(np.asarray(point, dtype=float) / self.cell).astype(np.int64).tolist()
+        best, best_dist = None, np.inf
+        max_ring = int(max(abs(cx - self.low[0]), abs(cx - self.high[0]),
+                           abs(cy - self.low[1]), abs(cy - self.high[1])))
+        for ring in range(max_ring + 1):
+            ids = list()
+            for key in ringCells(cx, cy, ring):
+                ids.extend(self.cells.get(key, ()))
+            if len(ids) > 0:
+                ids = np.array(ids)
+                ids = ids[self.alive[ids]]
+                if len(ids) > 0:
+                    dist = np.linalg.norm(self.points[ids] - point, axis=1)
+                    i = np.lexsort((ids, dist))[0]
+                    if dist[i] < best_dist or (dist[i] == best_dist and ids[i] < best):
+                        best, best_dist = int(ids[i]), dist[i]
+            # Points in the next ring are at least this far away
+            if best_dist <= ring * self.cell: break
+        return best
+
+def ringCells(cx, cy, ring):
+    ''' Returns the cells on the square ring at a distance of ring cells around the
+    cell (cx, cy).'''
+    if ring == 0: return [(cx, cy)]
+    out = [(cx + i, cy - ring) for i in range(-ring, ring + 1)]
+    out.extend((cx + i, cy + ring) for i in range(-ring, ring + 1))
+    out.extend((cx - ring, cy + i) for i in range(-ring + 1, ring))
+    out.extend((cx + ring, cy + i) for i in range(-ring + 1, ring))
+    return out
+
+def isClosed(points):
+    ''' Returns True if the path ends where it starts.'''
+    return len(points) > 2 and tuple(points[0][0:2]) == tuple(points[-1][0:2])
+
+def orderPaths(paths: list, start=None, two_opt_time=0.):
+    ''' Returns the paths reordered (and reversed or restarted where that shortens
+    the travel) and the total travel length between them. Runs of paths of the same
+    kind stay in their original sequence, so walls are still printed before infill.
+
+    Inputs
+    ---
+    paths : list of Path objects
+    start : (x, y), optional
+        The position of the nozzle before the first path. If None, the layer starts
+        with the first path as given.
+    two_opt_time : float, default: 0
+        The number of seconds spent refining each run of paths with 2-opt moves
+    '''
+    out = list()
+    position = start
+    for group in groupByKind(paths):
+        ordered = orderGroup(group, position, two_opt_time)
+        out.extend(ordered)
+        position = ordered[-1].points[-1][0:2]
+    return out, travelLength(out, start)
+
+def groupByKind(paths: list):
+    ''' Splits the paths into runs of consecutive paths of the same kind.'''
+    groups = list()
+    for path in paths:
+        kind = getattr(path, 'kind', None)
+        if len(groups) == 0 or getattr(groups[-1][-1], 'kind', None) != kind: groups.append(list())
+        groups[-1].append(path)
+    return groups
+
+def orderGroup(paths: list, start=None, two_opt_time=0.):
+    ''' Orders the paths greedily by the nearest entry point to the end of the last
+    path, then refines the order with 2-opt moves for up to two_opt_time seconds.'''
+    entries = list()
+    owners = list()
+    offsets = list()
+    for i, path in enumerate(paths):
+        pnts = [p[0:2] for p in path.points]
+        ids = range(len(pnts) - 1) if isClosed(path.points) else (0, len(pnts) - 1)
+        offsets.append(len(entries))
+        entries.extend(pnts[j] for j in ids)
+        owners.extend((i, j) for j in ids)
+    offsets.append(len(entries))
+    index = GridIndex(entries)
+    position = start
+    order = list()
+    for k in range(len(paths)):
+        e = 0 if position == None else index.nearest(position)
+        i, j = owners[e]
+        index.remove(np.arange(offsets[i], offsets[i + 1]))
+        path = enterPath(paths[i], j)
+        order.append(path)
+        position = path.points[-1][0:2]
+    if two_opt_time > 0: order = twoOpt(order, start, two_opt_time)
+    return order
+
+def enterPath(path, j):
+    ''' Returns the path entered at point j: reversed for the last point of an open
+    path, or restarted at point j of a closed loop.'''
+    if j == 0: return path
+    pnts = list(path.points)
+    if isClosed(pnts): pnts = pnts[j:-1] + pnts[:j] + [pnts[j]]
+    else: pnts = pnts[::-1]
+    return copyPath(path, pnts)
+
+def twoOpt(paths: list, start=None, time_limit=1.):
+    ''' Improves the order with 2-opt moves: each move reverses a run of paths
+    (and the direction of each path in it) where that shortens the travel. The
+    best move from each position is applied until no move helps or the time limit
+    (in seconds) is reached.'''
+    end_time = perf_counter() + time_limit
+    paths = list(paths)
+    n = len(paths)
+    if n < 3: return paths
+    improved = True
+    while improved and perf_counter() < end_time:
+        improved = False
+        s = np.array([p.points[0][0:2] for p in paths], dtype=float)
+        e = np.array([p.points[-1][0:2] for p in paths], dtype=float)
+        first = 0 if start == None else -1
+        for i in range(first, n - 1):
+            if perf_counter() > end_time: break
+            # Reversing paths i+1 to j joins the end of path i to the end of path j,
+            # and the start of path i+1 to the start of path j+1
+            tail = e[i] if i >= 0 else np.asarray(start, dtype=float)
+            j = np.arange(i + 1, n)
+            nxt = np.minimum(j + 1, n - 1)
+            has_next = j + 1 < n
+            old = np.linalg.norm(s[i + 1] - tail) + np.where(has_next, np.linalg.norm(s[nxt] - e[j], axis=1), 0)
+            new = np.linalg.norm(e[j] - tail, axis=1) + np.where(has_next, np.linalg.norm(s[nxt] - s[i + 1], axis=1), 0)
+            gain = old - new
+            best = int(np.argmax(gain))
+            if gain[best] <= 1e-9: continue
+            j = int(j[best])
+            paths[i+1:j+1] = [reversePath(p) for p in paths[i+1:j+1][::-1]]
+            s[i+1:j+1], e[i+1:j+1] = e[i+1:j+1][::-1].copy(), s[i+1:j+1][::-1].copy()
+            improved = True
+    return paths
+
+def reversePath(path):
+    ''' Returns the path traversed backwards.'''
+    return copyPath(path, path.points[::-1])
+
+def copyPath(path, points):
+    ''' Returns a path of the same type, kind and number of layers with the points.'''
+    out = type(path)(points, getattr(path, 'kind', 'wall'))
+    if hasattr(path, 'layers'): out.layers = path.layers
+    return out
+
+def travelLength(paths: list, start=None):
+    ''' Returns the total length of the travel moves between the paths, and from the
+    start position to the first path if given.'''
+    if len(paths) == 0: return 0.
+    s = np.array([p.points[0][0:2] for p in paths], dtype=float)
+    e = np.array([p.points[-1][0:2] for p in paths], dtype=float)
+    travel = np.linalg.norm(s[1:] - e[:-1], axis=1).sum()
+    if start != None: travel += np.linalg.norm(s[0] - np.asarray(start, dtype=float))
+    return float(travel)
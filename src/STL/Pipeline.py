@@ -0,0 +1,108 @@
+from queue import Queue, Empty, Full
+from threading import Thread, Event
+
+'''Runs a chain of processing stages over a stream of items, with each stage in its
+own thread and consecutive stages connected by bounded queues.
+
+A stage blocks once the queue to the next stage is full, so only a few items are
+ever held between stages however long the stream is, and the first results reach
+the consumer as soon as the first item has passed through every stage.
+
+Once a stage raises an error, no stage is called again, and the error is raised in
+the consumer. When the consumer stops (after an error, or by closing the generator
+early), a shared stop event is set and the queues are drained, so every thread
+exits and is joined instead of blocking on a full queue.
+'''
+class StageError:
+    def __init__(self, error):
+        ''' Passes an exception raised in a stage down the pipeline, so it is raised
+        again in the consumer.'''
+        self.error = error
+
+DONE = object() #Marks the end of the stream
+WAIT = 0.05 #Seconds between checks of the stop event while blocked on a queue
+
+def runPipeline(source, stages: list, maxsize=2):
+    ''' Yields the result of passing each item of source through the stages in turn.
+
+    Inputs
+    ---
+    source : iterable
+        The items fed into the first stage. It is consumed in its own thread.
+    stages : list of functions
+        Each stage is called with one item and returns the item passed to the next.
+    maxsize : int, default: 2
+        The number of items each queue can hold before the stage feeding it waits.
+    '''
+    stop = Event()
+    queues = [Queue(maxsize) for i in range(len(stages) + 1)]
+    threads = [Thread(target=feedStage, args=(source, queues[0], stop), daemon=True)]
+    for i, stage in enumerate(stages):
+        threads.append(Thread(target=runStage, args=(stage, queues[i], queues[i+1], stop), daemon=True))
+    for thread in threads: thread.start()
+    try:
+        while True:
+            item = getItem(queues[-1], stop)
+            if item is DONE: break
+            if isinstance(item, StageError): raise item.error
+            yield item
+    finally:
+        stop.set()
+        for queue in queues: drainQueue(queue)
+        for thread in threads: thread.join()
+
+def putItem(queue: Queue, item, stop: Event):
+    ''' Puts the item in the queue, waiting while it is full. Returns False without
+    putting the item if the stop event is set first.'''
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=WAIT)
+            return True
+        except Full: continue
+    return False
+
+def getItem(queue: Queue, stop: Event):
+    ''' Returns the next item from the queue, waiting while it is empty. Returns the
+    end marker if the stop event is set first.'''
+    while not stop.is_set():
+        try: return queue.get(timeout=WAIT)
+        except Empty: continue
+    return DONE
+
+def drainQueue(queue: Queue):
+    ''' Removes every item from the queue.'''
+    while True:
+        try: queue.get_nowait()
+        except Empty: return
+
+def feedStage(source, outbox: Queue, stop: Event):
+    ''' Puts the items of source in the queue, followed by the end marker. Stops
+    reading source after an error or once the stop event is set.'''
+    try:
+        for item in source:
+            if not putItem(outbox, item, stop): return
+    except Exception as e:
+        putItem(outbox, StageError(e), stop)
+    putItem(outbox, DONE, stop)
+
+def runStage(stage, inbox: Queue, outbox: Queue, stop: Event):
+    ''' Applies the stage to each item of the inbox until the end marker, which is
+    passed on. Once an error is raised by the stage or passed on from an earlier
+    stage, the stage is not called again and the remaining items are dropped.'''
+    failed = False
+    while True:
+        item = getItem(inbox, stop)
+        if item is DONE:
+            putItem(outbox, DONE, stop)
+            return
+        if failed: continue
+        if isinstance(item, StageError):
+            failed = True
+            if not putItem(outbox, item, stop): return
+            continue
+        try:
+            result = stage(item)
+        except Exception as e:
+            failed = True
+            result = StageError(e)
+        if not putItem(outbox, result, stop): return
@@ -328,12 +328,14 @@ class PlotSTL(object):
     def updateSTL(self):
         ''' Applies the transformations encoded in self.T to the STL vertices, then 
         resets self.T for further transformations.'''
-        for face in self.stl.faces:
+        faces = self.stl.faces
+        for face in faces:
             A = np.array(face.getMatrix())
             npA = self.T.transform(A)
             new_normal = self.T.transformNorm(face.normal)
             face.loadFromMatrix(npA.tolist())
             face.normal = new_normal
+        self.stl.faces = faces #Replaces the faces of a view over a shared mesh
         self.curr_centroid = self.T.curr_centroid
         if len(self.T.curr_orientation) > 0:
             self.curr_orientation = self.T.curr_orientation[0]
@@ -387,6 +389,14 @@ class PlotSTL(object):
         self.extrusion = Extrusion(self.stl, wall_thickness, layer_height, infill_density)
         self.extruded = True
 
+    def loadExtrusion(self, filepath, layers=None):
+        ''' Loads the paths of an existing job for preview, from a G-code file or
+        (for the extension ".tp") a toolpath file. layers is an optional (first, 
+        stop) range of layers to read from a G-code file.'''
+        if filepath.endswith('.tp'): self.extrusion = Extrusion.fromToolpath(filepath)
+        else: self.extrusion = Extrusion.fromGCode(filepath, layers)
+        self.extruded = True
+
     def plotExtrusion(self, wall_thickness=1.5, layer_height=.25, infill_density=.2):
         ''' Builds and plots and Extrusion object.'''
         if not self.extruded: self.buildExtrusion(wall_thickness, layer_height, infill_density)
@@ -432,20 +442,10 @@ class PlotSTL(object):
         self.fig.savefig(filepath)
         plt.close(self.fig)
 
-    def savePaths(self, filename='curr_paths.txt'):
-        cur_path = os.path.dirname(__file__)
-        filepath = os.path.join(cur_path, '..', filename)
+    def savePaths(self, filepath='paths.gcode', **kwargs):
+        ''' Writes the extruder paths as G-code to filepath, and returns the
+        GCodeWriter used. Keyword arguments are passed to Extrusion.writeGCode. The
+        paths are written as built, so call simplifyPaths on the extrusion first to
+        simplify them.'''
         if not self.extruded: self.buildExtrusion()
-        lines = ['Extrusion Paths for ' + self.stl.name]
-        lines.append('Mass of Print: ' + str(self.extrusion.printMass()) + 'g')
-        lines.append('Time of Print: ' + str(self.extrusion.time_to_print) + 's')
-        lines.append('\n')
-        t_i = 0
-        for i in range(self.extrusion.numSlices):
-            for path in self.extrusion.slices[i]:
-                path_lines = path.toString()
-                for path_line in path_lines:
-                    lines.append('t' + str(t_i) + '\t' + path_line)
-                    t_i += 1
-        with open(filepath, 'w') as f:
-            f.writelines('\n'.join(lines))
+        return self.extrusion.writeGCode(filepath, **kwargs)
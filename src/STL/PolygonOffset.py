@@ -0,0 +1,425 @@
+import numpy as np
+
+from src.STL.SliceSTL import Hull, Slice
+import src.STL.Methods as mthd
+
+'''Set of functions for offsetting the hulls of a slice in the plane of the slice.
+
+Each hull is oriented so the material is on its left (outer hulls counter-clockwise,
+holes clockwise), every edge is moved along its normal, and the corners are joined
+with a miter, bevel or round join. The raw profile is then split at its
+self-intersections. Loops that reverse the original orientation are dropped, and
+so are the points of the remaining loops that lie closer to the original hull than
+the offset distance (such as spurs left where opposite edges meet exactly).
+
+The loops of all the hulls of the slice are then resolved together, since the loop
+of one hull can cross the loop of another (such as the inward loop of an outer hull
+and the outward loop of its hole on a thin wall). The loops are split into arcs at
+the crossings between different loops, and an arc is kept only where it bounds the
+union of the loops (with the material on its left and none on its right), lies on
+the side of the original slice the offset moves towards, and is no closer than the
+offset distance to any original hull. The kept arcs are joined back into loops.
+'''
+def offsetSlice(slice: Slice, distance, join='miter', miter_limit=2., arc_step=np.pi/8):
+    ''' Returns a new slice with every hull offset by distance, or None if all of the
+    hulls vanish. Positive distances grow the material of the slice and negative
+    distances shrink it.
+
+    Inputs
+    ---
+    slice : Slice
+        The slice to offset
+    distance : float
+        The offset distance, in the units of the slice coordinates
+    join : str ("miter", "bevel", or "round"), default: "miter"
+        The type of join used at corners that open up when offset
+    miter_limit : float, default: 2.
+        The longest miter allowed, as a multiple of distance. Longer miters are
+        beveled.
+    arc_step : float, default: pi/8
+        The largest angle (in radians) between points on a round join
+    '''
+    originals = list()
+    loops = list()
+    for i in range(len(slice.hulls)):
+        pnts = slice.hulls[i].getArray()
+        if (mthd.signedArea(pnts) > 0) != slice.isOuter(i): pnts = pnts[::-1]
+        originals.append(cleanPolygon(pnts))
+        loops.extend(offsetPolygon(pnts, distance, join, miter_limit, arc_step))
+    if distance != 0: loops = resolveLoops(loops, slice, originals, distance)
+    if len(loops) == 0: return None
+    return Slice([makeHull(loop, slice.z_datum) for loop in loops], slice.index)
+
+def makeHull(loop, z):
+    ''' Returns a closed hull at height z from an [n x 2] array of points. The normal
+    of each segment points out of the material (to the right of the segment).'''
+    pnts = np.vstack([loop, loop[0:1]])
+    edges = np.diff(pnts, axis=0)
+    normals = np.column_stack([edges[:, 1], -edges[:, 0], np.zeros(len(edges))])
+    normals /= np.maximum(np.linalg.norm(normals, axis=1), 1e-300)[:, None]
+    points = [(x, y, z) for x, y in pnts.tolist()]
+    return Hull(points, normals.tolist())
+
+def offsetPolygon(points, distance, join='miter', miter_limit=2., arc_step=np.pi/8):
+    ''' Returns a list of [n x 2] arrays of the simple loops formed by offsetting the
+    closed polygon defined by points. The polygon must have the material on its left,
+    and positive distances move the profile to the right (out of the material).'''
+    pnts = cleanPolygon(points)
+    if len(pnts) < 3: return list()
+    if distance == 0: return [pnts]
+    raw = offsetVertices(pnts, distance, join, miter_limit, arc_step)
+    orientation = np.sign(mthd.signedArea(pnts))
+    tol = 1e-3 * abs(distance)
+    out = list()
+    for loop in splitSelfIntersections(raw):
+        if np.sign(mthd.signedArea(loop)) != orientation: continue
+        loop = loop[polygonDistance(loop, pnts) >= abs(distance) - tol]
+        if len(loop) < 3: continue
+        area = mthd.signedArea(loop)
+        if np.sign(area) != orientation or abs(area) < tol**2: continue
+        out.append(loop)
+    return out
+
+def resolveLoops(loops: list, slice: Slice, originals: list, distance):
+    ''' Returns the offset loops of all the hulls of the slice resolved together, as
+    a list of [n x 2] arrays. Each loop must have the material on its left, and
+    originals are the hulls of the slice as [m x 2] arrays oriented the same way.'''
+    if len(loops) == 0: return loops
+    eps = 1e-9 * max(1., max(np.abs(loop).max() for loop in loops))
+    tol = 1e-3 * abs(distance)
+    arcs = splitLoops(loops, findLoopBreaks(loops, eps), eps)
+    samples = np.array([arcSample(arc[0]) for arc in arcs])
+    middle, normal = samples[:, 0:2], samples[:, 2:4]
+
+    # Keep the boundary of the union of the loops: material on the left of the arc
+    # and none on the right (tested just to either side of the middle of the arc)
+    probe = np.stack([middle + 1e-2 * tol * normal, middle - 1e-2 * tol * normal])
+    winding = sum(mthd.windingNumbers(probe.reshape(-1, 2), loop) for loop in loops).reshape(2, -1)
+    keep = (winding[0] > 0) & (winding[1] <= 0)
+    keep &= slice.isInside(middle) == (distance < 0)
+    for i in np.flatnonzero(keep):
+        pnts = arcs[i][0][arcs[i][1]]
+        if len(pnts) > 0: keep[i] = nearestOriginal(pnts, originals, abs(distance)).min() >= abs(distance) - tol
+    # Where arcs of two loops overlap exactly, only one is kept
+    _, first = np.unique(np.column_stack([np.round(middle / eps), [arc[2:] for arc in arcs]]), axis=0, return_index=True)
+    keep &= np.isin(np.arange(len(arcs)), first)
+    out = list()
+    for loop in joinArcs([arc for arc, k in zip(arcs, keep) if k]):
+        if len(loop) >= 3 and abs(mthd.signedArea(loop)) >= tol**2: out.append(loop)
+    return out
+
+def findLoopBreaks(loops: list, eps=0., block_size=1000000):
+    ''' Returns the points where the closed loops cross or touch each other, as a
+    list of (loop index, edge index, position along the edge, point) tuples, with an
+    entry for each of the two loops at each point. Edges that cross inside both
+    edges, vertices within eps of an edge of another loop and vertices shared with
+    another loop are all found. Only pairs of loops whose bounding boxes overlap
+    are tested.'''
+    lo = np.array([loop.min(axis=0) for loop in loops]) - eps
+    hi = np.array([loop.max(axis=0) for loop in loops]) + eps
+    out = list()
+    for i in range(len(loops)):
+        for j in range(i + 1, len(loops)):
+            if (lo[i] > hi[j]).any() or (lo[j] > hi[i]).any(): continue
+            a1, a2 = loops[i], loops[j]
+            b1, b2 = np.roll(a1, -1, axis=0), np.roll(a2, -1, axis=0)
+            len1 = np.linalg.norm(b1 - a1, axis=1)
+            len2 = np.linalg.norm(b2 - a2, axis=1)
+            step = max(1, block_size // len(a2))
+            for start in range(0, len(a1), step):
+                e1 = np.arange(start, min(start + step, len(a1)))[:, None]
+                e2 = np.arange(len(a2))[None, :]
+                d1 = b1[e1] - a1[e1]
+                d2 = b2[e2] - a2[e2]
+                diff = a2[e2] - a1[e1]
+                denom = d1[..., 0] * d2[..., 1] - d1[..., 1] * d2[..., 0]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    t = (diff[..., 0] * d2[..., 1] - diff[..., 1] * d2[..., 0]) / denom
+                    u = (diff[..., 0] * d1[..., 1] - diff[..., 1] * d1[..., 0]) / denom
+                    margin_t = eps / len1[e1]
+                    margin_u = eps / len2[e2]
+                hit = (denom != 0) & (t > margin_t) & (t < 1 - margin_t) & (u > margin_u) & (u < 1 - margin_u)
+                for k, m in zip(*np.nonzero(hit)):
+                    point = a1[start + k] + t[k, m] * d1[k, 0]
+                    out.append((i, start + k, t[k, m], point))
+                    out.append((j, m, u[k, m], point))
+            for (a, b, other, k, m) in ((a1, b1, a2, i, j), (a2, b2, a1, j, i)):
+                edge, vertex, param = findTouches(other, eps, block_size, a, b)
+                for e, v, t in zip(edge, vertex, param):
+                    out.append((k, e, t, other[v]))
+                    out.append((m, v, 0., other[v]))
+            gap = np.abs(a1[:, None, :] - a2[None, :, :]).max(axis=2)
+            for v1, v2 in zip(*np.nonzero(gap <= eps)):
+                out.append((i, v1, 0., a1[v1]))
+                out.append((j, v2, 0., a1[v1]))
+    return out
+
+def splitLoops(loops: list, breaks: list, eps=0.):
+    ''' Returns the arcs of the loops between the break points, as a list of ([n x 2]
+    points, boolean mask of the points that are vertices of the loop rather than
+    break points, id of the point at the start, id at the end) tuples. The ids are
+    shared by break points at the same position. A loop without break points is a
+    single closed arc with ids of -1.'''
+    keys = np.array([point for k, edge, t, point in breaks]).reshape(-1, 2)
+    keys = np.unique(np.round(keys / max(eps, 1e-300)), axis=0, return_inverse=True)[1].reshape(-1)
+    on_loop = [list() for loop in loops]
+    for (k, edge, t, point), key in zip(breaks, keys.tolist()): on_loop[k].append((edge, t, point, key))
+    arcs = list()
+    for k, loop in enumerate(loops):
+        if len(on_loop[k]) == 0:
+            arcs.append((loop, np.ones(len(loop), dtype=bool), -1, -1))
+            continue
+        edge, param, points, key = zip(*on_loop[k])
+        order = np.lexsort((np.concatenate([np.zeros(len(loop)), param]),
+                            np.concatenate([np.arange(len(loop)), edge])))
+        ids = np.concatenate([np.full(len(loop), -1), key])[order]
+        pnts = np.vstack([loop, np.array(points)])[order]
+        # Merge the points at the same position, keeping the break id
+        new = np.r_[True, np.abs(np.diff(pnts, axis=0)).max(axis=1) > eps]
+        starts = np.flatnonzero(new)
+        ids = np.maximum.reduceat(ids, starts)
+        pnts = pnts[starts]
+        if len(pnts) > 1 and np.abs(pnts[-1] - pnts[0]).max() <= eps:
+            ids[0] = max(ids[0], ids[-1])
+            ids, pnts = ids[:-1], pnts[:-1]
+        breaks_at = np.flatnonzero(ids >= 0)
+        pnts = np.roll(pnts, -breaks_at[0], axis=0)
+        ids = np.roll(ids, -breaks_at[0])
+        breaks_at = np.append(breaks_at - breaks_at[0], len(ids))
+        for b0, b1 in zip(breaks_at[:-1], breaks_at[1:]):
+            index = np.arange(b0, b1 + 1) % len(ids)
+            arcs.append((pnts[index], ids[index] < 0, int(ids[b0]), int(ids[b1 % len(ids)])))
+    return arcs
+
+def arcSample(pnts):
+    ''' Returns the midpoint of the longest edge of the arc (an [n x 2] array), which
+    lies away from the break points at its ends, and the unit normal to the left of
+    that edge, as an array of [x, y, normal x, normal y].'''
+    edges = np.diff(pnts, axis=0)
+    length = np.linalg.norm(edges, axis=1)
+    i = int(np.argmax(length))
+    return np.r_[(pnts[i] + pnts[i+1]) / 2, -edges[i, 1] / length[i], edges[i, 0] / length[i]]
+
+def nearestOriginal(points, originals: list, distance):
+    ''' Returns the distance from each of the [n x 2] points to the nearest of the
+    original hulls, up to distance (points farther from every hull get distance).'''
+    out = np.full(len(points), float(distance))
+    for polygon in originals:
+        if len(polygon) < 2: continue
+        near = (points >= polygon.min(axis=0) - distance).all(axis=1) & \
+               (points <= polygon.max(axis=0) + distance).all(axis=1)
+        if near.any(): out[near] = np.minimum(out[near], polygonDistance(points[near], polygon))
+    return out
+
+def joinArcs(arcs: list):
+    ''' Returns the loops formed by joining the arcs end to end at their break
+    points, as a list of [n x 2] arrays. Chains that do not close are dropped.'''
+    out = list()
+    starts = dict()
+    for i, arc in enumerate(arcs):
+        if arc[2] < 0: out.append(arc[0])
+        else: starts.setdefault(arc[2], list()).append(i)
+    used = set()
+    for i in range(len(arcs)):
+        if arcs[i][2] < 0 or i in used: continue
+        chain = list()
+        j = i
+        while j != None:
+            used.add(j)
+            chain.append(arcs[j][0][:-1])
+            if arcs[j][3] == arcs[i][2]:
+                out.append(np.vstack(chain))
+                break
+            j = next((k for k in starts.get(arcs[j][3], list()) if k not in used), None)
+    return out
+
+def cleanPolygon(points, tol=1e-9):
+    ''' Returns the polygon as an [n x 2] array without a repeated closing point or
+    zero length edges.'''
+    pnts = np.asarray(points, dtype=float)[:, 0:2]
+    if len(pnts) == 0: return pnts
+    keep = np.linalg.norm(pnts - np.roll(pnts, 1, axis=0), axis=1) > tol
+    return pnts[keep]
+
+def offsetVertices(pnts, distance, join='miter', miter_limit=2., arc_step=np.pi/8):
+    ''' Returns the raw offset profile of the polygon as an [m x 2] array. Each vertex
+    is joined in one of four ways, and all vertices are processed at once:
+        1. A single miter point for closing corners and opening corners within the
+        miter limit (or all opening corners if join is "miter" and the corner is
+        shallow)
+        2. Two bevel points for opening corners beyond the miter limit
+        3. An arc of points for opening corners if join is "round"
+        4. The two offset edge ends around a pivot at the original vertex for closing
+        corners that nearly reverse direction, so the ends form a loop that is 
+        cut off when splitting
+    '''
+    edges = np.roll(pnts, -1, axis=0) - pnts
+    normals = np.column_stack([edges[:, 1], -edges[:, 0]])
+    normals /= np.linalg.norm(normals, axis=1)[:, None]
+    n_prev = np.roll(normals, 1, axis=0)
+    n_next = normals
+    e_prev = np.roll(edges, 1, axis=0)
+    cross = e_prev[:, 0] * edges[:, 1] - e_prev[:, 1] * edges[:, 0]
+    cos = np.clip(np.einsum('ij,ij->i', n_prev, n_next), -1, 1)
+    opening = cross * distance > 0 #Corner opens up a gap when the edges move apart
+    with np.errstate(divide='ignore', invalid='ignore'):
+        miter_len = np.sqrt(2 / (1 + cos)) #Length of the miter as a multiple of distance
+    if join == 'round':
+        angle = np.arccos(cos)
+        counts = np.where(opening & (cos < 1 - 1e-9), np.ceil(angle / arc_step).astype(int) + 1, 1)
+    else:
+        counts = np.where(opening & (miter_len > miter_limit), 2, 1)
+    counts = np.where(~opening & (cos < -0.99), 3, counts)
+
+    index = np.repeat(np.arange(len(pnts)), counts)
+    step = np.arange(len(index)) - np.repeat(np.cumsum(counts) - counts, counts)
+    frac = step / np.maximum(counts[index] - 1, 1)
+    out = np.empty((len(index), 2))
+
+    single = counts[index] == 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        miter = (n_prev + n_next) / (1 + cos)[:, None]
+    out[single] = pnts[index[single]] + distance * miter[index[single]]
+
+    multi = ~single
+    i = index[multi]
+    if join == 'round':
+        start = np.arctan2(n_prev[i, 1], n_prev[i, 0])
+        sweep = np.arctan2(n_next[i, 1], n_next[i, 0]) - start
+        sweep = (sweep + np.pi) % (2 * np.pi) - np.pi
+        theta = start + frac[multi] * sweep
+        direction = np.column_stack([np.cos(theta), np.sin(theta)])
+    else:
+        direction = np.where((frac[multi] < 0.5)[:, None], n_prev[i], n_next[i])
+    out[multi] = pnts[i] + distance * direction
+    pivot = (counts[index] == 3) & (step == 1)
+    out[pivot] = pnts[index[pivot]]
+    return out
+
+def splitSelfIntersections(loop):
+    ''' Splits the closed loop (an [n x 2] array) at each of its self-intersections
+    and returns a list of the simple loops as [m x 2] arrays. Crossing points are 
+    inserted into both crossing edges, and vertices that touch another edge (as
+    happens where opposite edges overlap exactly) are inserted into that edge. The
+    loop is then walked once and a loop is cut off every time the walk returns to a
+    point it has already visited.'''
+    n = len(loop)
+    eps = 1e-9 * max(1., np.abs(loop).max())
+    _, first, vertex_ids = np.unique(np.round(loop / eps), axis=0, return_index=True, 
+                                     return_inverse=True)
+    vertex_ids = vertex_ids.reshape(-1)
+    seg_a, seg_b, points, t_a, t_b = findIntersections(loop, eps)
+    touch_edge, touch_vertex, touch_param = findTouches(loop, eps)
+    if len(points) == 0 and len(touch_edge) == 0 and len(first) == n: return [loop]
+
+    #Insert every crossing and touching vertex into its edges, ordered along each edge
+    crossing_ids = len(first) + np.arange(len(points))
+    edge = np.concatenate([np.arange(n), seg_a, seg_b, touch_edge])
+    param = np.concatenate([np.zeros(n), t_a, t_b, touch_param])
+    ids = np.concatenate([vertex_ids, crossing_ids, crossing_ids, vertex_ids[touch_vertex]])
+    order = np.lexsort((param, edge))
+    sequence = ids[order].tolist()
+    all_points = np.vstack([loop[first], points])
+
+    out = list()
+    stack = list()
+    position = dict()
+    for vertex in sequence:
+        if len(stack) > 0 and stack[-1] == vertex: continue
+        if vertex in position:
+            start = position[vertex]
+            piece = stack[start:]
+            for v in piece[1:]: del position[v]
+            del stack[start+1:]
+            out.append(piece)
+        else:
+            position[vertex] = len(stack)
+            stack.append(vertex)
+    out.append(stack)
+    return [all_points[piece] for piece in out if len(piece) > 2]
+
+def findIntersections(loop, eps=0., block_size=1000000):
+    ''' Returns the crossings between non-adjacent edges of the closed loop as the
+    indices of the two edges, the intersection points, and the position of each
+    crossing along both edges (from 0 to 1). Edge i runs from point i to point i+1.
+    Crossings within eps of the end of an edge are left to findTouches. Pairs of 
+    edges are tested in blocks, after rejecting pairs whose bounding boxes do not 
+    overlap.'''
+    n = len(loop)
+    a = loop
+    b = np.roll(loop, -1, axis=0)
+    lo = np.minimum(a, b)
+    hi = np.maximum(a, b)
+    length = np.linalg.norm(b - a, axis=1)
+    out = [list() for i in range(5)]
+    step = max(1, block_size // max(n, 1))
+    for start in range(0, n, step):
+        i = np.arange(start, min(start + step, n))[:, None]
+        j = np.arange(n)[None, :]
+        candidates = (j > i + 1) & ~((i == 0) & (j == n - 1))
+        candidates &= (lo[i, 0] <= hi[j, 0]) & (lo[j, 0] <= hi[i, 0])
+        candidates &= (lo[i, 1] <= hi[j, 1]) & (lo[j, 1] <= hi[i, 1])
+        ii, jj = np.nonzero(candidates)
+        ii = ii + start
+        d1 = b[ii] - a[ii]
+        d2 = b[jj] - a[jj]
+        denom = d1[:, 0] * d2[:, 1] - d1[:, 1] * d2[:, 0]
+        diff = a[jj] - a[ii]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (diff[:, 0] * d2[:, 1] - diff[:, 1] * d2[:, 0]) / denom
+            u = (diff[:, 0] * d1[:, 1] - diff[:, 1] * d1[:, 0]) / denom
+            margin_t = eps / length[ii]
+            margin_u = eps / length[jj]
+        hit = (denom != 0) & (t > margin_t) & (t < 1 - margin_t) & (u > margin_u) & (u < 1 - margin_u)
+        out[0].append(ii[hit])
+        out[1].append(jj[hit])
+        out[2].append(a[ii[hit]] + t[hit, None] * d1[hit])
+        out[3].append(t[hit])
+        out[4].append(u[hit])
+    seg_a, seg_b, points, t_a, t_b = [np.concatenate(entry) for entry in out]
+    return seg_a, seg_b, points.reshape(-1, 2), t_a, t_b
+
+def findTouches(loop, eps, block_size=1000000, a=None, b=None):
+    ''' Returns the vertices of the closed loop that lie within eps of the inside of
+    an edge they do not belong to, as the index of the edge, the index of the vertex
+    and the position of the vertex along the edge (from 0 to 1). If the edges are
+    given (as arrays of their start and end points), the vertices are tested
+    against those edges instead of the edges of the loop.'''
+    own = a is None
+    if own: a, b = loop, np.roll(loop, -1, axis=0)
+    n = len(a)
+    seg = b - a
+    seg_len = np.einsum('ij,ij->i', seg, seg)
+    margin = eps / np.sqrt(np.maximum(seg_len, 1e-300))
+    out = [list() for i in range(3)]
+    step = max(1, block_size // max(n, 1))
+    for start in range(0, len(loop), step):
+        k = np.arange(start, min(start + step, len(loop)))
+        p = loop[k, None, :]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.einsum('ijk,jk->ij', p - a, seg) / seg_len
+        dist = np.linalg.norm(p - (a + t[:, :, None] * seg), axis=2)
+        j = np.arange(n)[None, :]
+        hit = (dist <= eps) & (t > margin) & (t < 1 - margin) 
+        if own: hit &= (j != k[:, None]) & (j != (k[:, None] - 1) % n)
+        kk, jj = np.nonzero(hit)
+        out[0].append(jj)
+        out[1].append(k[kk])
+        out[2].append(t[kk, jj])
+    return [np.concatenate(entry) for entry in out]
+
+def polygonDistance(points, polygon, block_size=1000000):
+    ''' Returns the distance from each of the [n x 2] points to the nearest edge of
+    the closed polygon (an [m x 2] array).'''
+    a = polygon
+    b = np.roll(polygon, -1, axis=0)
+    seg = b - a
+    seg_len = np.einsum('ij,ij->i', seg, seg)
+    out = np.empty(len(points))
+    step = max(1, block_size // max(len(a), 1))
+    for start in range(0, len(points), step):
+        p = points[start:start+step, None, :]
+        t = np.einsum('ijk,jk->ij', p - a, seg) / np.maximum(seg_len, 1e-300)
+        closest = a + np.clip(t, 0, 1)[:, :, None] * seg
+        out[start:start+step] = np.sqrt(((p - closest)**2).sum(axis=2)).min(axis=1)
+    return out
@@ -0,0 +1,111 @@
+import numpy as np
+
+from src.STL.Toolpath import Toolpath
+
+'''Set of functions for estimating print time with a motion planner, accounting for
+acceleration, the speed lost at corners, short segments and travel moves.
+
+The moves are planned as in printer firmware: each move accelerates and decelerates
+at a constant rate (a trapezoidal speed profile), and the speed through each corner
+is limited by the junction deviation model. The planner's lookahead is solved for a
+whole print at once. In squared speeds, the backward pass (each junction no faster
+than allows stopping in time for the next) is a suffix minimum and the forward pass
+(no faster than reachable from the last) is a prefix minimum, both found with
+np.minimum.accumulate over the cumulative 2 a L of the moves.
+'''
+class PrinterProfile:
+    def __init__(self, print_speed=25.4, travel_speed=150., acceleration=1000.,
+                 travel_acceleration=None, junction_deviation=0.05):
+        ''' The motion limits of a printer. Units are mm, mm/s and mm/s^2.
+
+        Inputs
+        ---
+        print_speed, travel_speed : float, default: 25.4, 150
+            The speed of extruding moves and of travel moves
+        acceleration : float, default: 1000
+            The acceleration of extruding moves
+        travel_acceleration : float, optional
+            The acceleration of travel moves. Defaults to acceleration.
+        junction_deviation : float, default: 0.05
+            The distance by which the path may cut a corner at speed, which sets
+            the speed through each corner (as in Grbl and Marlin)
+        '''
+        self.print_speed = print_speed
+        self.travel_speed = travel_speed
+        self.acceleration = acceleration
+        self.travel_acceleration = travel_acceleration if travel_acceleration != None else acceleration
+        self.junction_deviation = junction_deviation
+
+def planTime(points, travel, profile: PrinterProfile = None):
+    ''' Returns the time to move through the [n x 2] points, starting and ending at
+    rest, where travel is a boolean array that is True for each of the n - 1 moves
+    that is a travel move. Moves of zero length are skipped.'''
+    if profile == None: profile = PrinterProfile()
+    pnts = np.asarray(points, dtype=float)[:, 0:2]
+    if len(pnts) < 2: return 0.
+    step = np.diff(pnts, axis=0)
+    length = np.linalg.norm(step, axis=1)
+    moving = length > 0
+    step, length, travel = step[moving], length[moving], np.asarray(travel, dtype=bool)[moving]
+    if len(length) == 0: return 0.
+    speed = np.where(travel, profile.travel_speed, profile.print_speed)
+    accel = np.where(travel, profile.travel_acceleration, profile.acceleration)
+
+    # The squared speed limit at each junction, including the stops at either end
+    limit = np.zeros(len(length) + 1)
+    limit[1:-1] = np.minimum(np.minimum(speed[:-1], speed[1:])**2,
+                             junctionLimits(step, np.minimum(accel[:-1], accel[1:]), profile.junction_deviation))
+    reach = np.concatenate([[0], np.cumsum(2 * accel * length)])
+    # Backward pass: limit[k] <= limit[k+1] + 2 a L
+    limit = np.minimum.accumulate((limit + reach)[::-1])[::-1] - reach
+    # Forward pass: limit[k+1] <= limit[k] + 2 a L
+    limit = reach + np.minimum.accumulate(limit - reach)
+    entry = np.sqrt(np.maximum(limit[:-1], 0))
+    exit = np.sqrt(np.maximum(limit[1:], 0))
+    return float(trapezoidTimes(length, entry, exit, speed, accel).sum())
+
+def junctionLimits(step, accel, deviation):
+    ''' Returns the largest squared speed through the corner between each pair of
+    consecutive moves (the rows of step), from the junction deviation model: the
+    speed at which the centripetal acceleration on a circle that cuts the corner by
+    the deviation equals the acceleration.'''
+    unit = step / np.linalg.norm(step, axis=1)[:, None]
+    cos = np.clip(-(unit[:-1] * unit[1:]).sum(axis=1), -1, 1) #cos of the angle between the moves
+    sin_half = np.sqrt((1 - cos) / 2)
+    with np.errstate(divide='ignore'):
+        return np.where(sin_half < 1 - 1e-9, accel * deviation * sin_half / np.maximum(1 - sin_half, 1e-12), np.inf)
+
+def trapezoidTimes(length, entry, exit, speed, accel):
+    ''' Returns the time of each move, accelerating from the entry speed towards the
+    cruise speed and decelerating to the exit speed. Moves too short to reach the
+    cruise speed peak where the two ramps meet.'''
+    peak = np.sqrt((2 * accel * length + entry**2 + exit**2) / 2)
+    top = np.minimum(speed, peak)
+    up = (top**2 - entry**2) / (2 * accel)
+    down = (top**2 - exit**2) / (2 * accel)
+    cruise = np.maximum(length - up - down, 0)
+    return (top - entry) / accel + (top - exit) / accel + cruise / top
+
+def toolpathTime(toolpath: Toolpath, profile: PrinterProfile = None):
+    ''' Returns the estimated time to print a Toolpath (or a memory mapped toolpath
+    file), planning every move of the print at once. The travel to the start of
+    each path is included, but not the moves between layers in z.'''
+    pnts = np.asarray(toolpath.points, dtype=float)
+    travel = np.zeros(max(len(pnts) - 1, 0), dtype=bool)
+    starts = np.asarray(toolpath.path_offsets[1:-1], dtype=np.int64)
+    travel[starts[(starts > 0) & (starts < len(pnts))] - 1] = True
+    return planTime(pnts, travel, profile)
+
+def pathsTime(layers, profile: PrinterProfile = None):
+    ''' Returns the estimated time to print the layers (an iterable of lists of Path
+    objects), as toolpathTime.'''
+    pnts = list()
+    travel = list()
+    for paths in layers:
+        for path in paths:
+            xy = np.asarray(path.points, dtype=float).reshape(len(path.points), -1)[:, 0:2]
+            if len(xy) == 0: continue
+            pnts.append(xy)
+            travel.append(np.r_[True, np.zeros(len(xy) - 1, dtype=bool)])
+    if len(pnts) == 0: return 0.
+    return planTime(np.concatenate(pnts), np.concatenate(travel)[1:], profile)
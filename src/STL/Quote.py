@@ -0,0 +1,125 @@
+from math import pi
+import numpy as np
+
+from src.STL.ReadSTL import STL
+from src.STL.SliceSTL import Slicer, findExactCrossings
+
+'''Set of functions for quoting the length, time and mass of a print straight from
+the mesh, without building any paths.
+
+The segments where the faces cross every slice plane are found at once, and are
+chained end to end into loops by pointer jumping. The perimeter and area of each
+loop come from the lengths of its segments and the shoelace formula, with each
+segment turned by the normal of its face so holes have negative area. The walls
+and the infill region then follow from the offset formulas for a loop: offset into
+the material by d, an outer loop of perimeter P and area A has perimeter P - 2 pi d
+and area A - P d + pi d^2 (exact for rounded corners), and vanishes once that area
+is no longer positive, while a hole grows to P + 2 pi d. The infill length is the
+area enclosed by the offset loops divided by the scanline spacing, in each
+direction.
+'''
+class Quote:
+    def __init__(self, volume, wall_length, infill_length, printing_speed=25.4):
+        ''' The estimated totals of a print (see quotePrint).
+
+        Contents for Calling
+        ---
+        volume : float
+            The volume enclosed by the mesh
+        wall_length, infill_length, length_of_print : float
+            The estimated length of the walls, of the infill and in total
+        time_to_print : float
+            The estimated time to print, in seconds, without travel
+        '''
+        self.volume = volume
+        self.wall_length = wall_length
+        self.infill_length = infill_length
+        self.length_of_print = wall_length + infill_length
+        self.time_to_print = self.length_of_print / printing_speed
+
+    def printMass(self, density=0.00125, filament_circumference=1.75):
+        ''' Returns the estimated mass of the print in grams, as Extrusion.printMass.'''
+        return self.length_of_print * filament_circumference * 3.1415926 * density
+
+def quotePrint(stl: STL, wall_thickness=1.5, layer_height=0.25, infill_density=0.2,
+               printing_speed=25.4, resolution=None):
+    ''' Returns a Quote of the print the Extrusion class would make with the same
+    parameters (with the grid infill), without slicing into hulls or building paths.
+    The length, time and mass are within 2% of the full pipeline on the sample parts
+    whose walls leave room for infill. On thin walls, where the walls meet or nearly
+    fill a slice, the offset formulas are less exact.
+
+    Inputs
+    ---
+    stl : STL
+    wall_thickness, layer_height, infill_density, printing_speed : float
+        As for the Extrusion class
+    resolution : float, optional
+        The size of the integer grid for finding the crossings. Defaults to the
+        resolution of the STL, or a billionth of the size of the part.
+    '''
+    from src.STL.Extrusion import calcInfillData
+    vertices = stl.getVertexArray()
+    density = min(abs(infill_density), 1)
+    num_walls = max(1, int(round(wall_thickness / layer_height, 6)))
+    planes, perimeter, area = loopMeasures(stl, layer_height, resolution)
+    widths = layer_height * np.arange(num_walls)
+    wall_perimeter, wall_area = offsetLoops(perimeter[:, None], area[:, None], widths)
+    walls = np.where(wall_area != 0, wall_perimeter, 0).sum()
+    inset = (num_walls - 0.5) * layer_height
+    infill_area = np.abs(np.bincount(planes, offsetLoops(perimeter, area, inset)[1]))
+    infill = 2 * infill_area.sum() / calcInfillData(layer_height, density) if density > 0 else 0.
+    return Quote(meshVolume(vertices), float(walls), float(infill), printing_speed)
+
+def offsetLoops(perimeter, area, distance):
+    ''' Returns the perimeter and signed area of loops offset into the material by
+    distance, which are 0 for outer loops that vanish.'''
+    sign = np.sign(area)
+    new_area = area - perimeter * distance + sign * pi * distance**2
+    new_perimeter = perimeter - sign * 2 * pi * distance
+    alive = (sign < 0) | ((new_area > 0) & (new_perimeter > 0))
+    return np.where(alive, new_perimeter, 0), np.where(alive, new_area, 0)
+
+def meshVolume(vertices):
+    ''' Returns the volume enclosed by the [n x 3 x 3] faces of a closed mesh, as the
+    sum of the signed volumes of the tetrahedra from the origin to each face.'''
+    v = np.asarray(vertices, dtype=float)
+    if len(v) == 0: return 0.
+    v = v - v.reshape(-1, 3).mean(axis=0)
+    return float(np.einsum('ij,ij->i', v[:, 0], np.cross(v[:, 1], v[:, 2])).sum() / 6)
+
+def loopMeasures(stl: STL, layer_height, resolution=None):
+    ''' Returns the index of the slice plane, the perimeter and the signed area of
+    each loop in the slices of a Slicer with the layer height, as arrays.'''
+    slicer = Slicer(stl, layer_height, resolution=resolution)
+    vertices = stl.getVertexArray()
+    if slicer.resolution != None: res = slicer.resolution
+    else: res = max(float(np.ptp(vertices.reshape(-1, 3), axis=0).max()), 1e-9) * 1e-9
+    z_planes = np.rint(np.array(slicer.getZDatums()) / res).astype(np.int64)
+    planes, segments, face_ids = findExactCrossings(np.rint(vertices / res).astype(np.int64), z_planes)
+    segments = segments * res
+    # Turn each segment so the material is on its left (counter-clockwise outer loops)
+    v = vertices[face_ids]
+    normal = np.cross(v[:, 1] - v[:, 0], v[:, 2] - v[:, 0])
+    step = segments[:, 1] - segments[:, 0]
+    flip = step[:, 0] * -normal[:, 1] + step[:, 1] * normal[:, 0] < 0
+    segments[flip] = segments[flip][:, ::-1]
+    cross = segments[:, 0, 0] * segments[:, 1, 1] - segments[:, 1, 0] * segments[:, 0, 1]
+    length = np.linalg.norm(segments[:, 1] - segments[:, 0], axis=1)
+
+    # Label the loops by chaining each segment to the one starting at its end
+    keys = np.column_stack([np.repeat(planes, 2), np.rint(segments.reshape(-1, 2) / res)])
+    ids = np.unique(keys, axis=0, return_inverse=True)[1].reshape(-1, 2)
+    start_of = np.arange(len(ids))
+    starts = np.full(ids.max() + 1 if len(ids) > 0 else 0, -1)
+    starts[ids[:, 0]] = start_of
+    nxt = starts[ids[:, 1]]
+    nxt = np.where(nxt >= 0, nxt, start_of)
+    label = start_of.copy()
+    for i in range(int(np.ceil(np.log2(max(len(label), 2)))) + 1):
+        label = np.minimum(label, label[nxt])
+        nxt = nxt[nxt]
+    first = np.flatnonzero(label == start_of)
+    perimeter = np.bincount(label, length, len(label))[first]
+    area = np.bincount(label, cross, len(label))[first] / 2
+    return planes[first], perimeter, area
@@ -0,0 +1,360 @@
+import os
+import re
+import numpy as np
+
+from src.STL.Toolpath import Toolpath, PATH_KINDS
+
+'''Reads the moves of a G-code file (from this project or another slicer) into the
+arrays of a Toolpath, so an existing job can be previewed like an Extrusion.
+
+The file is read in large chunks, and each chunk is tokenized with array operations
+over its bytes rather than line by line: the line breaks, comments and the letters
+of each word are found with vectorized searches, and the numbers after them are
+decoded together from a matrix of their characters. Moves that add filament form
+the paths, and a new layer starts wherever the height of the extrusion changes.
+A path that rises while it extrudes (a spiral vase) is kept as one ramp with the z
+of each point, and is only split into layers at the layer comments (";LAYER:" or
+";LAYER_CHANGE") of the file.
+
+Supported: G0/G1 lines (with or without leading whitespace, "N" line numbers and
+in upper or lower case), G2/G3 arcs with I/J centers (split into short lines), G92,
+absolute (M82) and relative (M83) extrusion, ";TYPE:" comments for the kind of
+each path and layer comments for splitting ramps. Positions are assumed to be absolute (G90).
+'''
+MOVE_CODES = (0, 1, 2, 3, 92) #G codes read as rows, along with M82 and M83
+WORDS = b'XYZEIJ'
+NUMBER_CHARS = np.zeros(256, dtype=bool)
+NUMBER_CHARS[np.frombuffer(b'0123456789.-+', dtype=np.uint8)] = True
+PADDING = 16 #Zero bytes after each chunk, so numbers can be read in fixed widths
+BLANK_CHARS = np.zeros(256, dtype=bool)
+BLANK_CHARS[np.frombuffer(b' \t\r', dtype=np.uint8)] = True
+
+def readGCode(filepath, layers=None, chunk_size=1 << 23, arc_step=np.pi / 36):
+    ''' Returns the extruding paths of a G-code file as a Toolpath.
+
+    Inputs
+    ---
+    filepath : str
+    layers : (int, int), optional
+        The first and one past the last layer to keep. Layers before the range are
+        only scanned for changes in height, and reading stops after the range.
+    chunk_size : int, default: 8 MB
+        The number of bytes parsed at a time
+    arc_step : float, default: 5 degrees
+        The largest angle of the lines that arcs are split into
+    '''
+    reader = GCodeReader(layers, arc_step)
+    with open(filepath, 'rb') as f:
+        rest = b''
+        while not reader.done:
+            data = f.read(chunk_size)
+            if len(data) == 0: break
+            data = rest + data
+            cut = data.rfind(b'\n') + 1
+            reader.parseChunk(data[:cut])
+            rest = data[cut:]
+        if len(rest) > 0 and not reader.done: reader.parseChunk(rest + b'\n')
+    return reader.getToolpath(os.path.basename(filepath))
+
+class GCodeReader:
+    def __init__(self, layers=None, arc_step=np.pi / 36):
+        ''' Holds the state of the machine between chunks of a G-code file, and the
+        paths read so far. See readGCode.'''
+        self.first_layer, self.stop_layer = layers if layers != None else (0, None)
+        self.arc_step = arc_step
+        self.done = False
+        self.position = np.zeros(3)
+        self.e = 0.
+        self.relative_e = False
+        self.kind = 0
+        self.last_kind = -1
+        self.extruding = False
+        self.layer = -1
+        self.layer_z = None
+        self.marked = False
+        self.point_z = False
+        self.points = list()
+        self.path_starts = list()
+        self.path_kinds = list()
+        self.path_layers = list()
+        self.heights = dict()
+        self.num_points = 0
+
+    def parseChunk(self, data: bytes):
+        ''' Parses a chunk of whole lines and adds its extruding moves to the paths.'''
+        buf = np.frombuffer(data + bytes(PADDING), dtype=np.uint8)
+        ends = np.flatnonzero(buf == ord('\n'))
+        if len(ends) == 0: return
+        starts = np.concatenate([[0], ends[:-1] + 1])
+        semis = np.flatnonzero(buf == ord(';'))
+        k = np.searchsorted(semis, starts)
+        stops = ends.copy()
+        has_semi = k < len(semis)
+        stops[has_semi] = np.minimum(semis[k[has_semi]], ends[has_semi])
+
+        # Rows are the G0-G3 and G92 lines, and the M82/M83 lines that set the E mode
+        folded = buf | 0x20 #Lower case letters, for comparing letters only
+        codes_at = findCommands(buf, folded, starts)
+        letter = folded[codes_at]
+        number = parseCodes(buf, codes_at)
+        is_g = (letter == ord('g')) & np.isin(number, MOVE_CODES)
+        is_m = (letter == ord('m')) & np.isin(number, (82, 83))
+        rows = np.flatnonzero((is_g | is_m) & (stops > codes_at))
+        codes = np.where(is_m[rows], -number[rows], number[rows]).astype(int)
+        values = np.full((len(rows), len(WORDS)), np.nan)
+        line_row = np.full(len(starts), -1)
+        line_row[rows] = np.arange(len(rows))
+        for i, char in enumerate(WORDS):
+            pos = np.flatnonzero(folded == (char | 0x20))
+            line = np.searchsorted(ends, pos)
+            keep = (line_row[line] >= 0) & (pos < stops[line])
+            found, valid = parseNumbers(buf, pos[keep] + 1)
+            values[line_row[line[keep]][valid], i] = found[valid]
+        kinds = self.findKinds(data, starts[rows])
+        marks, trailing = self.findLayerMarks(data, starts[rows])
+        self.addRows(codes, values, kinds, marks)
+        self.marked |= trailing
+
+    def findKinds(self, data: bytes, row_starts):
+        ''' Returns the kind (an index into PATH_KINDS) of each row, from the last
+        ";TYPE:" comment before it.'''
+        found = [(m.start(), m.group(1).lower()) for m in re.finditer(rb';TYPE:([^\r\n]*)', data)]
+        if len(found) == 0: return np.full(len(row_starts), self.kind)
+        pos = np.array([p for p, name in found])
+        types = np.array([PATH_KINDS.index('infill') if b'fill' in name or b'skin' in name 
+                          else PATH_KINDS.index('wall') for p, name in found])
+        k = np.searchsorted(pos, row_starts) - 1
+        kinds = np.where(k >= 0, types[np.maximum(k, 0)], self.kind)
+        self.kind = int(types[-1])
+        return kinds
+
+    def findLayerMarks(self, data: bytes, row_starts):
+        ''' Returns whether a layer comment comes before each row (and after the row
+        before it), and whether one comes after the last row.'''
+        found = np.array([m.start() for m in re.finditer(rb';LAYER[:_]', data)], dtype=int)
+        count = np.searchsorted(found, row_starts)
+        marks = np.diff(np.concatenate([[0], count])) > 0
+        return marks, len(found) > (count[-1] if len(count) > 0 else 0)
+
+    def addRows(self, codes, values, kinds, marks):
+        ''' Updates the machine state with the rows of a chunk, and adds the points of
+        the extruding moves in the requested layers.'''
+        if len(codes) == 0: return
+        # Extrusion mode, set by M82 (absolute) and M83 (relative)
+        mode = np.where(codes == -83, 1., np.where(codes == -82, 0., np.nan))
+        relative = fillForward(mode, float(self.relative_e)) == 1
+        self.relative_e = bool(relative[-1])
+        e = values[:, 3]
+        filled_e = fillForward(np.where(relative, np.nan, e), self.e)
+        previous_e = np.concatenate([[self.e], filled_e[:-1]])
+        added = np.where(relative, np.nan_to_num(e), np.where(np.isnan(e), 0, e - previous_e))
+        added[codes == 92] = 0
+        self.e = float(filled_e[-1])
+        pnts = np.column_stack([fillForward(values[:, i], self.position[i]) for i in range(3)])
+
+        # Moves that stay in place (such as retractions) are skipped, so they do not
+        # break a run of extruding moves
+        previous = np.vstack([self.position, pnts[:-1]])
+        self.position = pnts[-1]
+        moves = np.flatnonzero((codes >= 0) & (codes <= 3) & ((pnts != previous).any(axis=1) | (codes >= 2)))
+        if len(moves) == 0:
+            self.marked |= bool(marks.any())
+            return
+        previous = previous[moves]
+        # A move is marked by the layer comments since the move before it
+        seen = np.cumsum(marks)
+        marked = np.diff(np.concatenate([[0], seen[moves]])) > 0
+        marked[0] |= self.marked
+        self.marked = bool(seen[-1] > seen[moves[-1]])
+        pnts, codes, kinds = pnts[moves], codes[moves], kinds[moves]
+        centers = previous[:, 0:2] + np.nan_to_num(values[moves][:, 4:6])
+        moved = (pnts[:, 0:2] != previous[:, 0:2]).any(axis=1) | (codes >= 2)
+        extruding = (codes > 0) & (added[moves] > 0) & moved
+        pnts, previous, extruding, kinds, marked = self.splitArcs(pnts, previous, centers, codes,
+                                                                  extruding, kinds, marked)
+        self.addPaths(pnts, previous, extruding, kinds, marked)
+
+    def splitArcs(self, pnts, previous, centers, codes, extruding, kinds, marked):
+        ''' Replaces each arc move with lines of at most arc_step, and returns the new
+        end and start points with the flags and kinds of the moves repeated. Only the
+        first line of a marked arc is marked.'''
+        arcs = np.flatnonzero(codes >= 2)
+        if len(arcs) == 0: return pnts, previous, extruding, kinds, marked
+        c = centers[arcs]
+        start = previous[arcs, 0:2] - c
+        end = pnts[arcs, 0:2] - c
+        a0 = np.arctan2(start[:, 1], start[:, 0])
+        a1 = np.arctan2(end[:, 1], end[:, 0])
+        ccw = codes[arcs] == 3
+        sweep = np.where(ccw, (a1 - a0) % (2 * np.pi), -((a0 - a1) % (2 * np.pi)))
+        sweep[sweep == 0] = np.where(ccw, 2 * np.pi, -2 * np.pi)[sweep == 0] #Full circles
+        counts = np.ones(len(pnts), dtype=int)
+        counts[arcs] = np.maximum(1, np.ceil(np.abs(sweep) / self.arc_step)).astype(int)
+        rep = np.repeat(np.arange(len(pnts)), counts)
+        step = np.arange(len(rep)) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+        out = pnts[rep]
+        split = np.flatnonzero(np.isin(rep, arcs) & (step < counts[rep]))
+        arc_index = np.searchsorted(arcs, rep[split])
+        frac = step[split] / counts[rep[split]]
+        angle = a0[arc_index] + sweep[arc_index] * frac
+        radius = np.linalg.norm(start[arc_index], axis=1)
+        out[split, 0] = c[arc_index, 0] + radius * np.cos(angle)
+        out[split, 1] = c[arc_index, 1] + radius * np.sin(angle)
+        out[split, 2] = previous[rep[split], 2] + frac * (pnts[rep[split], 2] - previous[rep[split], 2])
+        before = np.vstack([previous[0:1], out[:-1]])
+        return out, before, extruding[rep], kinds[rep], marked[rep] & (step == 1)
+
+    def addPaths(self, pnts, previous, extruding, kinds, marked):
+        ''' Adds the extruding moves to the paths. A path starts at the first of a run
+        of extruding moves of the same kind, and a layer starts at each path whose
+        starting height differs from the end of the path before it. A run that rises
+        as it extrudes stays one path, and is split into layers at the layer comments.
+        The height of a layer is the highest point of its paths.'''
+        ext = np.flatnonzero(extruding)
+        was_extruding = np.concatenate([[self.extruding], extruding[:-1]])
+        self.extruding = bool(extruding[-1])
+        if len(ext) == 0: return
+        z = pnts[ext, 2]
+        previous_kind = np.concatenate([[self.last_kind], kinds[:-1]])
+        is_start = ~was_extruding[ext] | marked[ext] | (kinds[ext] != previous_kind[ext])
+        self.last_kind = int(kinds[-1])
+        self.point_z |= bool((z != previous[ext, 2]).any())
+
+        # Layers change with the height of the paths, and at the layer comments. A
+        # path starting at the height the last one ended at continues its layer.
+        starts = np.flatnonzero(is_start)
+        path_z = previous[ext[starts], 2]
+        last_z = np.concatenate([[self.layer_z if self.layer_z != None else np.nan], z])[starts]
+        new_layer = (np.abs(path_z - last_z) > 1e-9) | marked[ext[starts]]
+        new_layer[np.isnan(last_z)] = True
+        path_layer = self.layer + np.cumsum(new_layer)
+        move_layer = np.full(len(ext), self.layer)
+        move_layer[starts] = path_layer
+        move_layer = np.maximum.accumulate(move_layer)
+        ids, inverse = np.unique(move_layer, return_inverse=True)
+        top = np.full(len(ids), -np.inf)
+        np.maximum.at(top, inverse, z)
+        for i, height in zip(ids.tolist(), top.tolist()):
+            self.heights[i] = max(height, self.heights.get(i, height))
+        self.layer = int(move_layer[-1])
+        self.layer_z = float(z[-1])
+
+        keep = move_layer >= self.first_layer
+        if self.stop_layer != None:
+            keep &= move_layer < self.stop_layer
+            if self.layer >= self.stop_layer: self.done = True
+        if not keep.any(): return
+        ext, is_start, move_layer = ext[keep], is_start[keep], move_layer[keep]
+        counts = 1 + is_start
+        rep = np.repeat(np.arange(len(ext)), counts)
+        first = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        use_previous = np.zeros(len(rep), dtype=bool)
+        use_previous[first[is_start]] = True
+        xyz = np.where(use_previous[:, None], previous[ext[rep]], pnts[ext[rep]])
+        self.points.append(xyz)
+        self.path_starts.append(self.num_points + first[is_start])
+        self.path_kinds.append(kinds[ext[is_start]])
+        self.path_layers.append(move_layer[is_start])
+        self.num_points += len(xyz)
+
+    def getToolpath(self, name=''):
+        ''' Returns the paths read as a Toolpath. The layers are numbered from the
+        first layer requested. The points have a z column (and the parameter
+        "point_z") only if some extruding move changes height.'''
+        if len(self.points) == 0:
+            return Toolpath(np.zeros((0, 2)), np.zeros(1, dtype=int), np.zeros(0, dtype=np.uint8),
+                            np.zeros(1, dtype=int), np.zeros(0), dict(name=name))
+        columns = 3 if self.point_z else 2
+        points = np.concatenate([pnts[:, 0:columns] for pnts in self.points])
+        path_offsets = np.append(np.concatenate(self.path_starts), len(points))
+        kinds = np.concatenate(self.path_kinds).astype(np.uint8)
+        path_layers = np.concatenate(self.path_layers)
+        layer_ids = np.unique(path_layers)
+        layer_offsets = np.append(np.searchsorted(path_layers, layer_ids), len(path_layers))
+        layer_z = np.array([self.heights[i] for i in layer_ids.tolist()])
+        params = dict(name=name, first_layer=int(layer_ids[0]))
+        if len(layer_z) > 1: params['layer_height'] = float(np.median(np.diff(layer_z)))
+        if self.point_z: params['point_z'] = True
+        return Toolpath(points, path_offsets, kinds, layer_offsets, layer_z, params)
+
+def parseNumbers(buf, pos, width=12):
+    ''' Decodes the numbers that start at each position of the byte array buf, such
+    as "-12.345". Returns the values and a mask that is False where there is no
+    number. The characters of each number are gathered into a row of a fixed width
+    byte string, and the rows are converted together. buf must end with at least 
+    width bytes that are not part of a number (see PADDING).'''
+    windows = np.lib.stride_tricks.as_strided(buf, shape=(len(buf) - width + 1, width), 
+                                              strides=(1, 1), writeable=False)
+    chars = windows[pos]
+    is_number = NUMBER_CHARS[chars]
+    complete = is_number.all(axis=1)
+    length = np.where(complete, width, np.argmin(is_number, axis=1))
+    chars[np.arange(width) >= length[:, None]] = 0
+    valid = length > 0
+    chars[~valid, 0] = ord('0')
+    strings = chars.view('S%d' % width).ravel()
+    try:
+        values = strings.astype(float)
+    except ValueError:
+        values = np.array([toFloat(string) for string in strings.tolist()])
+    valid &= ~np.isnan(values)
+    # Numbers longer than the width are read again from the buffer
+    for i in np.flatnonzero(complete).tolist():
+        end = pos[i]
+        while end < len(buf) and NUMBER_CHARS[buf[end]]: end += 1
+        values[i] = toFloat(bytes(buf[pos[i]:end]))
+    return values, valid
+
+def findCommands(buf, folded, starts):
+    ''' Returns the position of the command word of each line, after any leading
+    whitespace and "N" line number. folded is buf with the letters in lower case.
+    Only the lines that do not start with their command are stepped through.'''
+    at = starts.copy()
+    blank = BLANK_CHARS[buf[at]]
+    numbered = folded[at] == ord('n')
+    moving = np.flatnonzero(blank | numbered)
+    if len(moving) == 0: return at
+    pos = at[moving]
+    pos = skipChars(buf, pos, BLANK_CHARS)
+    numbered = np.flatnonzero(folded[pos] == ord('n'))
+    pos[numbered] = skipChars(buf, pos[numbered] + 1, NUMBER_CHARS | BLANK_CHARS)
+    at[moving] = pos
+    return at
+
+def skipChars(buf, pos, chars):
+    ''' Returns the position of the first byte at or after each position that is not
+    one of the chars (a boolean array over the byte values).'''
+    pos = pos.copy()
+    moving = np.flatnonzero(chars[buf[pos]])
+    while len(moving) > 0:
+        pos[moving] += 1
+        moving = moving[chars[buf[pos[moving]]]]
+    return pos
+
+def parseCodes(buf, starts):
+    ''' Returns the number of the command word at the start of each line (such as
+    1 for "G1" or 104 for "M104"), or -1 if there is none. Only the first three
+    digits are read, and codes with a decimal part (such as G92.1) return -1.'''
+    codes = np.zeros(len(starts), dtype=int)
+    reading = np.ones(len(starts), dtype=bool)
+    num_digits = np.zeros(len(starts), dtype=int)
+    for k in range(1, 5):
+        c = buf[starts + k].astype(int)
+        digit = reading & (c >= ord('0')) & (c <= ord('9'))
+        codes = np.where(digit, codes * 10 + c - ord('0'), codes)
+        num_digits += digit
+        reading &= digit
+    decimal = buf[starts + 1 + num_digits] == ord('.')
+    return np.where((num_digits > 0) & (num_digits < 4) & ~decimal, codes, -1)
+
+def toFloat(string: bytes):
+    ''' Returns the number in the string, or NaN if it is not a number.'''
+    try: return float(string)
+    except ValueError: return np.nan
+
+def fillForward(values, initial):
+    ''' Returns the values with each NaN replaced by the last value before it, or by
+    initial if there is none.'''
+    filled = np.concatenate([[initial], values])
+    index = np.where(np.isnan(filled), 0, np.arange(len(filled)))
+    return filled[np.maximum.accumulate(index)][1:]
@@ -1,4 +1,5 @@
 import copy
+import numpy as np
 import src.STL.Methods as mthd
 
 class STL_Facet:
@@ -79,8 +80,37 @@ class STL_Facet:
         return str(self.getMatrix())
 
 
+class MeshData:
+    def __init__(self, vertices, normals):
+        ''' An immutable set of triangles stored as arrays, which can be shared by 
+        any number of STL objects (and threads) without copying.
+
+        Inputs
+        ---
+        vertices : [n x 3 x 3] list or np.array
+            The vertices of each face
+        normals : [n x 3] list or np.array
+            The normal vector of each face
+        '''
+        self.vertices = self.freeze(vertices, (-1, 3, 3))
+        self.normals = self.freeze(normals, (-1, 3))
+
+    def num_faces(self):
+        ''' Returns the number of faces in the mesh'''
+        return len(self.vertices)
+
+    @staticmethod
+    def freeze(array, shape):
+        ''' Returns the array as a read-only float np.array. Arrays that are already
+        read-only are shared rather than copied.'''
+        out = np.asarray(array, dtype=float).reshape(shape)
+        if out.flags.writeable:
+            out = out.copy()
+            out.flags.writeable = False
+        return out
+
 class STL:
-    def __init__(self, file=None):
+    def __init__(self, file=None, resolution=None):
         ''' Contains an STL object, which can include the STL file, or a collection of 
         facets that define the object.
         
@@ -88,6 +118,21 @@ class STL:
         ---
         file: str
             The name of the file (with extension), example: "Cube 432.stl"
+        resolution: float, optional
+            If given, the vertices are snapped to integer multiples of the resolution 
+            when the file is loaded (for instance 1e-6 for nanometres on a part in
+            millimetres), and the Slicer uses the same grid for exact slicing.
+
+        Storage
+        ---
+        The faces are held either as a list of STL_Facet objects (the member "faces"),
+        or as a view over a shared, read-only MeshData: the indices of the faces of the
+        mesh that are kept, plus an array of new faces appended after them. Views are
+        cheap to derive (see derive). Reading "faces" from a view returns a new list
+        of STL_Facet objects made from the mesh, and leaves the STL a view, so reads
+        never copy the mesh for good. Editing those facets does not change the STL
+        until the list is assigned back to "faces", which turns the STL into a list
+        of facets.
 
         Examples
         ---
@@ -99,7 +144,11 @@ class STL:
             print(cube.facets[0].toString())
         ```
         '''
+        self._faces = list()
+        self.setMesh(None)
+        self.resolution = None
         if file != None: self.parseFile(file)
+        if resolution != None: self.quantize(resolution)
             
     # Handling
     def parseFile(self, file):
@@ -116,25 +165,118 @@ class STL:
         out = STL(None)
         out.name = self.name
         out.file = self.file
+        out.resolution = self.resolution
         out.faces = list()
         if facet != None:
             out.faces.append(facet)
         return out
 
+    def derive(self, face_index=None, vertices=None, normals=None):
+        ''' Returns a new STL that is a view over the mesh of this STL, without
+        copying it. The view keeps the faces at face_index (all faces if None) and
+        appends the new faces given by an [n x 3 x 3] array of vertices and an [n x 3]
+        array of normals.'''
+        mesh = self.getMesh()
+        out = self.emptyCopy()
+        if face_index is not None: face_index = np.asarray(face_index, dtype=int).reshape(-1)
+        added = None if vertices is None else MeshData(vertices, normals)
+        out.setMesh(mesh, face_index, added)
+        return out
+
+    def setMesh(self, mesh: MeshData, face_index=None, added: MeshData=None):
+        ''' Sets the STL to a view over the mesh, keeping the faces at face_index
+        (all faces if None) followed by the faces in added. A mesh of None means the
+        STL is held as a list of facets.'''
+        self.mesh = mesh
+        self.face_index = face_index
+        self.added = added
+        if mesh != None: self._faces = None
+
+    @property
+    def faces(self):
+        ''' The list of STL_Facet objects in the STL. If the STL is a view, a new list
+        is made from the mesh on each read, and the STL stays a view.'''
+        if self.isView():
+            vertices, normals = self.getVertexArray(), self.getNormalArray()
+            return [STL_Facet(n, v) for n, v in zip(normals.tolist(), vertices.tolist())]
+        return self._faces
+
+    @faces.setter
+    def faces(self, faces):
+        self.setMesh(None)
+        self._faces = faces
+
+    def isView(self):
+        ''' Returns True if the STL is a view over a shared mesh rather than a list
+        of facets.'''
+        return self.mesh != None
+
+    def getMesh(self):
+        ''' Returns the faces of the STL as a read-only MeshData. The mesh is shared
+        if the STL is a view over the whole of a mesh. Otherwise the faces are copied
+        once into a new mesh, which this STL then becomes a view over.'''
+        if self.isView() and self.face_index is None and self.added is None:
+            return self.mesh
+        mesh = MeshData(self.getVertexArray(), self.getNormalArray())
+        self.setMesh(mesh)
+        return mesh
+
+    def quantize(self, resolution):
+        ''' Snaps the vertices to integer multiples of the resolution, which becomes 
+        the resolution used for exact slicing.'''
+        self.loadFromArray(self.getIntegerVertexArray(resolution) * resolution, self.getNormalArray())
+        self.resolution = resolution
+
     # Access
     def num_faces(self):
         ''' Returns the number of faces in the object''' 
+        if self.isView(): return len(self.getNormalArray())
         return len(self.faces)
 
     def getAllVertices(self):
         ''' Returns a list containing all vertices in the object.
         This is not guaranteed to not contain duplicates'''
+        if self.isView(): return self.getVertexArray().reshape(-1, 3).tolist()
         out = list()
         for face in self.faces:
             for vertex in face.vertices:
                 out.append(vertex)
         return out
 
+    def getVertexArray(self):
+        ''' Returns the vertices of every face as an [n x 3 x 3] np.array, where n is
+        the number of faces. The array is read-only (and shared) if the STL is a view 
+        over the whole of a mesh.'''
+        if self.isView(): return self.viewArray(self.mesh.vertices, self.added, 'vertices')
+        if self.num_faces() == 0: return np.zeros((0, 3, 3))
+        return np.array([face.vertices for face in self.faces], dtype=float)
+
+    def getIntegerVertexArray(self, resolution=None):
+        ''' Returns the vertices of every face as an [n x 3 x 3] np.array of int64, in 
+        multiples of the resolution (by default the resolution of the STL).'''
+        if resolution == None: resolution = self.resolution
+        return np.rint(self.getVertexArray() / resolution).astype(np.int64)
+
+    def getNormalArray(self):
+        ''' Returns the normal of every face as an [n x 3] np.array. The array is
+        read-only (and shared) if the STL is a view over the whole of a mesh.'''
+        if self.isView(): return self.viewArray(self.mesh.normals, self.added, 'normals')
+        if self.num_faces() == 0: return np.zeros((0, 3))
+        return np.array([face.normal for face in self.faces], dtype=float)
+
+    def viewArray(self, base, added: MeshData, member):
+        ''' Returns the rows of base kept by the view, followed by the member 
+        (vertices or normals) of the added faces.'''
+        out = base if self.face_index is None else base[self.face_index]
+        if added == None or added.num_faces() == 0: return out
+        return np.concatenate([out, getattr(added, member)])
+
+    def loadFromArray(self, vertices, normals):
+        ''' Replaces the faces with an [n x 3 x 3] array of vertices and an [n x 3]
+        array of normals. The STL becomes a view over a new mesh made from the arrays
+        (read-only arrays are shared rather than copied).'''
+        self.setMesh(MeshData(vertices, normals))
+
     def toString(self):
         ''' Prints the name of and number of faces in the object '''
         return self.name + ", Number of Faces: " + str(self.num_faces())
@@ -0,0 +1,91 @@
+import numpy as np
+
+from src.STL.SliceSTL import Hull, Slice
+
+'''Set of functions for simplifying hulls and paths by removing vertices that do not
+change the shape by more than a tolerance (collinear or sub-resolution points).
+'''
+def simplifySlices(slices: list, tol=0.01):
+    ''' Returns a list of simplified slices and a list with the number of points
+    removed from each slice.'''
+    out = list()
+    removed = list()
+    for slice in slices:
+        hulls = [simplifyHull(hull, tol) for hull in slice.hulls]
+        removed.append(sum(len(a.pnts) - len(b.pnts) for a, b in zip(slice.hulls, hulls)))
+        out.append(Slice(hulls, slice.index))
+    return out, removed
+
+def simplifyHull(hull: Hull, tol=0.01):
+    ''' Returns a hull with the vertices removed that deviate less than tol from the
+    simplified profile. The normal of each retained segment is the normal of the
+    first original segment it replaces.'''
+    keep = simplifyPoints(hull.pnts, tol)
+    indices = np.flatnonzero(keep)
+    points = [hull.pnts[i] for i in indices]
+    normals = [hull.normals[i] for i in indices[:-1] if i < len(hull.normals)]
+    return Hull(points, normals)
+
+def simplifyPoints(points, tol=0.01):
+    ''' Returns a boolean mask over the points that is True for each point that is
+    kept after removing collinear points and running the Douglas-Peucker algorithm.
+    The first and last points are always kept.'''
+    pnts = np.asarray(points, dtype=float)
+    keep = np.ones(len(pnts), dtype=bool)
+    if len(pnts) < 3 or tol <= 0: return keep
+    keep = removeCollinear(pnts)
+    indices = np.flatnonzero(keep)
+    keep[indices] = douglasPeucker(pnts[indices], tol)
+    return keep
+
+def removeCollinear(points, tol=1e-9):
+    ''' Returns a boolean mask that is False for each interior point that lies
+    within tol of the segment between its two neighbors. The tolerance is kept 
+    small so that removing runs of points cannot accumulate into a visible 
+    deviation (Douglas-Peucker handles the user tolerance).'''
+    pnts = np.asarray(points, dtype=float)
+    keep = np.ones(len(pnts), dtype=bool)
+    if len(pnts) < 3: return keep
+    keep[1:-1] = segmentDistances(pnts[1:-1], pnts[:-2], pnts[2:]) > tol
+    return keep
+
+def douglasPeucker(points, tol=0.01):
+    ''' Returns a boolean mask over the points that is True for each point kept by
+    the Douglas-Peucker algorithm. Each pass splits every open span at once, so the
+    number of passes is the depth of the recursion rather than the number of
+    spans.'''
+    pnts = np.asarray(points, dtype=float)
+    keep = np.zeros(len(pnts), dtype=bool)
+    keep[[0, -1]] = True
+    starts = np.array([0])
+    ends = np.array([len(pnts) - 1])
+    while len(starts) > 0:
+        counts = ends - starts - 1
+        spans = counts > 0
+        starts, ends, counts = starts[spans], ends[spans], counts[spans]
+        if len(starts) == 0: break
+        span_ids = np.repeat(np.arange(len(starts)), counts)
+        offsets = np.arange(len(span_ids)) - np.repeat(np.cumsum(counts) - counts, counts)
+        interior = starts[span_ids] + 1 + offsets
+        dist = segmentDistances(pnts[interior], pnts[starts[span_ids]], pnts[ends[span_ids]])
+        bounds = np.cumsum(counts) - counts
+        max_dist = np.maximum.reduceat(dist, bounds)
+        split = max_dist > tol
+        farthest = interior[np.lexsort((-dist, span_ids))[bounds]]
+        mid = farthest[split]
+        keep[mid] = True
+        starts = np.concatenate([starts[split], mid])
+        ends = np.concatenate([mid, ends[split]])
+    return keep
+
+def segmentDistances(points, starts, ends):
+    ''' Returns the distance from each point to the segment running from the
+    matching entry in starts to the matching entry in ends. All inputs are [n x d]
+    arrays.'''
+    seg = ends - starts
+    seg_len = np.einsum('ij,ij->i', seg, seg)
+    t = np.einsum('ij,ij->i', points - starts, seg)
+    t = np.divide(t, seg_len, out=np.zeros_like(t), where=seg_len > 0)
+    t = np.clip(t, 0, 1)
+    closest = starts + t[:, None] * seg
+    return np.linalg.norm(points - closest, axis=1)
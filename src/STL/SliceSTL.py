@@ -1,6 +1,7 @@
-from copy import deepcopy
 from math import floor, ceil
+import numpy as np
 from src.STL.ReadSTL import STL, STL_Facet as Facet
+from src.STL.SpatialHash import SpatialHash
 import src.STL.Methods as mthd
 
 class Edge:
@@ -39,17 +40,107 @@ class Hull:
             centroid[1] = sum(y_pnts) / len(y_pnts)
             centroid[2] = sum(z_pnts) / len(z_pnts)
         return centroid
+
+    def getArray(self):
+        ''' Returns the points in the hull as an [n x 2] np.array of x, y 
+        coordinates.'''
+        return np.array([point[0:2] for point in self.pnts], dtype=float)
+
+    def getBoundingBox(self):
+        ''' Returns the bounding box of the hull as (xmin, ymin, xmax, ymax).'''
+        pnts = self.getArray()
+        return (*pnts.min(axis=0), *pnts.max(axis=0))
+
+    def getArea(self):
+        ''' Returns the signed area enclosed by the hull. The area is positive if 
+        the hull runs counter-clockwise.'''
+        return mthd.signedArea(self.getArray())
+
+    def containsPoints(self, points, bbox=None):
+        ''' Returns a boolean array that is True for each of the [n x 2] points 
+        that lies inside the hull. Points outside the bounding box of the hull 
+        are rejected before the winding number test.'''
+        pnts = np.asarray(points, dtype=float)
+        out = np.zeros(len(pnts), dtype=bool)
+        if len(pnts) == 0: return out
+        if bbox == None: bbox = self.getBoundingBox()
+        in_box = (pnts[:, 0] >= bbox[0]) & (pnts[:, 0] <= bbox[2]) & \
+                 (pnts[:, 1] >= bbox[1]) & (pnts[:, 1] <= bbox[3])
+        if in_box.any():
+            out[in_box] = mthd.windingNumbers(pnts[in_box], self.getArray()) != 0
+        return out
             
 class Slice:
-    def __init__(self, hulls):      
-        ''' A collection of hulls that define a slice.
+    def __init__(self, hulls, index=None):      
+        ''' A collection of hulls that define a slice. On creation the hulls are
+        arranged into a containment tree, where each hull is either an outer 
+        boundary (even depth) or a hole (odd depth) in its parent.
         
         Inputs
         ---
         hulls : list of Hull-type objects
+        index : int, optional
+            The index of the layer the slice was cut from, counting every slice 
+            plane of the Slicer (including those that produced no hulls).
         '''
         self.hulls = hulls
+        self.index = index
         self.z_datum = hulls[0].pnts[0][2]
+        self.findHierarchy()
+
+    def findHierarchy(self):
+        ''' Builds the containment tree of the hulls. Sets the members "parents", 
+        where each entry is the index of the smallest hull containing the hull 
+        at that index (or None), and "depths", the number of hulls containing the
+        hull at that index.'''
+        num_hulls = len(self.hulls)
+        self.bboxes = [hull.getBoundingBox() for hull in self.hulls]
+        self.areas = [abs(hull.getArea()) for hull in self.hulls]
+        self.parents = [None] * num_hulls
+        self.depths = [0] * num_hulls
+        if num_hulls < 2: return
+        boxes = np.array(self.bboxes)
+        first_pnts = np.array([hull.pnts[0][0:2] for hull in self.hulls], dtype=float)
+        for j in range(num_hulls):
+            candidates = (boxes[:, 0] >= boxes[j, 0]) & (boxes[:, 1] >= boxes[j, 1]) & \
+                         (boxes[:, 2] <= boxes[j, 2]) & (boxes[:, 3] <= boxes[j, 3])
+            candidates[j] = False
+            candidates &= np.array(self.areas) < self.areas[j]
+            if not candidates.any(): continue
+            indices = np.flatnonzero(candidates)
+            inside = self.hulls[j].containsPoints(first_pnts[indices], self.bboxes[j])
+            for i in indices[inside]:
+                self.depths[i] += 1
+                parent = self.parents[i]
+                if parent == None or self.areas[j] < self.areas[parent]:
+                    self.parents[i] = j
+
+    def isOuter(self, hull_index):
+        ''' Returns True if the hull at hull_index is an outer boundary, or False
+        if it is a hole.'''
+        return self.depths[hull_index] % 2 == 0
+
+    def getChildren(self, hull_index):
+        ''' Returns the indices of the hulls directly contained by the hull at
+        hull_index.'''
+        return [i for i in range(len(self.hulls)) if self.parents[i] == hull_index]
+
+    def getRegions(self):
+        ''' Returns a list of the filled regions in the slice. Each region is a tuple
+        of the index of an outer boundary and a list of the indices of its holes.'''
+        return [(i, self.getChildren(i)) for i in range(len(self.hulls)) if self.isOuter(i)]
+
+    def isInside(self, points):
+        ''' Returns a boolean array that is True for each of the [n x 2] (or [n x 3])
+        points that is inside the material of the slice, meaning that it is 
+        contained by an odd number of hulls (inside an outer boundary, but not
+        inside one of its holes).'''
+        pnts = np.asarray(points, dtype=float)
+        if pnts.ndim == 1: pnts = pnts.reshape(1, -1)
+        count = np.zeros(len(pnts), dtype=int)
+        for hull, bbox in zip(self.hulls, self.bboxes):
+            count += hull.containsPoints(pnts[:, 0:2], bbox)
+        return count % 2 == 1
 
     def getXYZCoordinates(self):
         xcoords = list()
@@ -65,7 +156,7 @@ class Slice:
     #FIXME: Add methods for accessing a certain edge
 
 class Slicer:
-    def __init__(self, stl: STL, layer_height, min_z=None, max_z=None):
+    def __init__(self, stl: STL, layer_height, min_z=None, max_z=None, resolution=None):
         ''' Takes an stl object and returns a list of Slice objects, where each
         slice represents a layer of the STL object, sliced in the z-direction.
 
@@ -76,6 +167,11 @@ class Slicer:
         layer_height : 
             A float or int representing the height of each layer in the units
             of the stl coordinates.
+        resolution : float, optional
+            The size of the integer grid (in the units of the stl coordinates) used
+            for exact slicing, such as 1e-6 for nanometres on a part in millimetres.
+            Defaults to the resolution of the stl, and if None the slices are found
+            with floating point tolerances.
         
         Slicing Process
         ---
@@ -97,13 +193,21 @@ class Slicer:
         as a slice plane. For instance, if an object with a minimum z-coordinate of z = 0, and
         a maximum z-coordinate of z = 1 has a layer height of 0.3, then there will be 4 slice
         planes at z = [0, .3, .6, .9, 1].
+        4. With a resolution, the vertices and slice planes are rounded to integer 
+        multiples of the resolution. A vertex on a slice plane is treated as above it
+        (below it for a plane at the bottom of the part), so every face crossing the 
+        plane gives a single segment, and the crossing point of each mesh edge is 
+        computed exactly from its lower to its upper vertex. Segments are then joined
+        by exact lookup of their integer endpoints. Coordinates (in multiples of the
+        resolution) must stay below about 1e9 to avoid overflow.
         '''
         self.stl = stl
         self.del_z = layer_height
+        self.resolution = resolution if resolution != None else stl.resolution
         self.setSlicingLimits(min_z, max_z)
         self.slices = list()
+        self.facet_groups = None
         self.numSlices = self.findNumOfSlices()
-        self.findFacetsAtEachSlice()
 
     # Setup Functions
     def setSlicingLimits(self, min_z=None, max_z=None):
@@ -171,28 +275,111 @@ class Slicer:
     def sliceSTL(self):
         ''' Calling function that forms the slices for each layer, which are accessible
         from the member "slices".'''
-        all_unsorted_edges = self.getEdgesForAllSlices()
-        for unsorted_edges in all_unsorted_edges:
-            hulls = self.makeHulls(unsorted_edges)
+        if self.resolution != None: all_hulls = self.getExactHullsForAllSlices()
+        else: 
+            self.findFacetsAtEachSlice()
+            all_hulls = [self.makeHulls(edges) for edges in self.getEdgesForAllSlices()]
+        for layer_index, hulls in enumerate(all_hulls):
             if len(hulls) == 0:
                 self.numSlices -= 1
             else:
-                self.slices.append(Slice(hulls))
+                self.slices.append(Slice(hulls, layer_index))
+
+    def getExactHullsForAllSlices(self):
+        ''' Returns a list of the hulls in each slice, found on the integer grid set by
+        the member "resolution". The crossings of all slice planes are found together,
+        then the segments of each slice are joined by their exact integer endpoints.'''
+        normals = self.stl.getNormalArray()
+        z_planes = np.rint(np.array(self.getZDatums()) / self.resolution).astype(np.int64)
+        layers, segments, face_ids = findExactCrossings(self.stl.getIntegerVertexArray(self.resolution), 
+                                                        z_planes)
+        bounds = np.searchsorted(layers, np.arange(len(z_planes) + 1))
+        out = list()
+        for layer_index, zq in enumerate(z_planes):
+            rows = slice(bounds[layer_index], bounds[layer_index + 1])
+            out.append(self.joinExactSegments(segments[rows], normals[face_ids[rows]], zq))
+        return out
+
+    def joinExactSegments(self, segments, normals, zq):
+        ''' Returns the hulls formed by the [n x 2 x 2] integer segments of a slice 
+        plane at the integer height zq, where normals are the normals of the face of
+        each segment. The segments are joined by their exact end points.'''
+        res = self.resolution
+        ends = segments.reshape(-1, 2)
+        if len(ends) == 0: return list()
+        ids = np.unique(ends, axis=0, return_inverse=True)[1].reshape(-1, 2)
+        pnts = [(x * res, y * res, zq * res) for x, y in ends.tolist()]
+        edges = [Edge(pnts[2*i], pnts[2*i+1], normal) for i, normal in enumerate(normals.tolist())]
+        return self.connectEdges(edges, ids[:, 0].tolist(), ids[:, 1].tolist())
+
+    def iterSlices(self):
+        ''' Yields the slices one at a time, from the bottom up, without storing 
+        them. The faces are sorted by the first slice plane they reach, and a sweep up
+        through the planes keeps only the faces that span the current plane, so the
+        memory used depends on the size of a layer rather than the height of the 
+        part. The slices are the same as those found by sliceSTL.'''
+        exact = self.resolution != None
+        if exact:
+            vertices = self.stl.getIntegerVertexArray(self.resolution)
+            z_planes = np.rint(np.array(self.getZDatums()) / self.resolution).astype(np.int64)
+            bottom = vertices[:, :, 2].min() if len(vertices) > 0 else 0
+            normals = self.stl.getNormalArray()
+            first = np.searchsorted(z_planes, vertices[:, :, 2].min(axis=1), 'left')
+            end = np.searchsorted(z_planes, vertices[:, :, 2].max(axis=1), 'right')
+        else:
+            z_planes = self.getZDatums()
+            facets = self.stl.faces
+            first, end = self.findSliceRanges(self.stl.getVertexArray())
+        order = np.argsort(first, kind='stable')
+        sorted_first = first[order]
+        active = np.zeros(0, dtype=int)
+        start = 0
+        for layer_index, z in enumerate(z_planes):
+            stop = int(np.searchsorted(sorted_first, layer_index, 'right'))
+            active = np.concatenate([active, order[start:stop]])
+            start = stop
+            active = np.sort(active[end[active] > layer_index])
+            if exact:
+                _, segments, face_ids = findExactCrossings(vertices[active], np.array([z]), bottom)
+                hulls = self.joinExactSegments(segments, normals[active[face_ids]], z)
+            else:
+                faces = self.findFacetsAtDatum([facets[i] for i in active.tolist()], z)
+                edges = list()
+                for face in faces:
+                    face_edges = self.getEdgesFromFace(face, z)
+                    if face_edges != None: edges.extend(face_edges)
+                hulls = self.makeHulls(edges)
+            if len(hulls) > 0: yield Slice(hulls, layer_index)
+
+    def findSliceRanges(self, vertices, tol=1e-5):
+        ''' Returns the first and one past the last index of the slices covering
+        each of the [n x 3 x 3] faces, as in findSlicesCoveredByFace.'''
+        z = vertices[:, :, 2]
+        first = np.floor((z.min(axis=1) - self.min_z) / self.del_z).astype(int)
+        end = np.ceil((z.max(axis=1) - self.min_z) / self.del_z).astype(int)
+        if self.additionalSliceOnTop: end += np.abs(z.max(axis=1) - self.max_z) < tol
+        return first, end
+
+    def getZDatums(self):
+        ''' Returns a list of the z coordinate of each slice plane, from the bottom
+        (z_min) to the top (z_max).'''
+        z_datums = [self.min_z + (i * self.del_z) for i in range(self.numSlices-1)]
+        z_datums.append(self.max_z)
+        return z_datums
 
     def getEdgesForAllSlices(self):
         ''' Returns a list of lists, where each entry corresponds to a list of all the edges 
         for each slice.'''
         slices_edges = list()
-        for layer_index in range(self.numSlices-1):
-            z_datum = self.min_z + (layer_index * self.del_z)
+        for layer_index, z_datum in enumerate(self.getZDatums()):
             slices_edges.append(self.getSliceEdges(layer_index, z_datum))
-        slices_edges.append(self.getSliceEdges(self.numSlices-1, self.max_z))
         return slices_edges
 
     def getSliceEdges(self, layer_index, z_datum):
         ''' Returns a list of edges contained in the slice referenced by the 
         layer_index, which corresponds to the plane located at the z_datum.'''
         out = list()
+        if self.facet_groups == None: self.findFacetsAtEachSlice()
         facets_in_slice = self.facet_groups[layer_index]
         facets_at_datum = self.findFacetsAtDatum(facets_in_slice, z_datum)
         for face in facets_at_datum:
@@ -229,36 +416,65 @@ class Slicer:
                     intersection_pnts = mthd.safeAppend(intersection_pnts, temp)
         return intersection_pnts
 
-    def makeHulls(self, in_edges):
+    def makeHulls(self, in_edges, tol=0.01):
         ''' Finds connected edges to form a list of closed profiles (hulls) comprised of
-        the edges passed to the function.'''
+        the edges passed to the function. Endpoints within tol (L1 distance) of each 
+        other are joined, and each profile follows the first unused edge at its current
+        point (checking pnt1 before pnt2) until no unused edge remains there.'''
+        num_edges = len(in_edges)
+        if num_edges == 0: return list()
+        ends = SpatialHash(tol).insert([edge.pnt1 for edge in in_edges] + 
+                                       [edge.pnt2 for edge in in_edges]).tolist()
+        return self.connectEdges(in_edges, ends[:num_edges], ends[num_edges:])
+
+    def connectEdges(self, in_edges, ids1, ids2):
+        ''' Forms the hulls from the edges, where ids1 and ids2 are the ids of the 
+        joined points at the first and second end of each edge.'''
         hulls = list()
-        edges = deepcopy(in_edges)
-        while len(edges) > 0:
-            search_pnt = edges[0].pnt1
-            points_in_hull = [search_pnt]
+        num_edges = len(in_edges)
+        incident = self.findIncidentEdges(ids1, ids2)
+        used = [False] * num_edges
+        for first in range(num_edges):
+            if used[first]: continue
+            search_id = ids1[first]
+            points_in_hull = [in_edges[first].pnt1]
             normals_in_hull = list()
-            search_pnt, curr_edge = self.findJoiningPoint(search_pnt, edges)
+            curr_edge = self.findJoiningEdge(search_id, incident, used)
             
-            while search_pnt != None:
+            while curr_edge != None:
+                used[curr_edge] = True
+                edge = in_edges[curr_edge]
+                if ids1[curr_edge] == search_id: search_id, search_pnt = ids2[curr_edge], edge.pnt2
+                else: search_id, search_pnt = ids1[curr_edge], edge.pnt1
                 points_in_hull.append(search_pnt)
-                normals_in_hull.append(curr_edge.normal)
-                edges.remove(curr_edge)
-                search_pnt, curr_edge = self.findJoiningPoint(search_pnt, edges)
+                normals_in_hull.append(edge.normal)
+                curr_edge = self.findJoiningEdge(search_id, incident, used)
             
             hulls.append(Hull(points_in_hull, normals_in_hull))
         return hulls
 
-    def findJoiningPoint(self, pnt, edges):
-        ''' Parses through edges looking for an edge that has a similar coordinate as
-        "pnt". Returns the associated point in the new edge as well as the edge. Returns
-        None if it cannot find an similar point.'''
-        for edge in edges:
-            if mthd.checkSimilarTuples(pnt, edge.pnt1):
-                return edge.pnt2, edge
-            elif mthd.checkSimilarTuples(pnt, edge.pnt2):
-                return edge.pnt1, edge
-        return None, None
+    @staticmethod
+    def findIncidentEdges(ids1, ids2):
+        ''' Returns a dictionary from each point id to the list of indices of the edges
+        that end at it, in edge order. ids1 and ids2 are the point ids of the first and
+        second end of each edge.'''
+        incident = dict()
+        for i, (a, b) in enumerate(zip(ids1, ids2)):
+            incident.setdefault(a, list()).append(i)
+            if b != a: incident.setdefault(b, list()).append(i)
+        for edges in incident.values(): edges.reverse()
+        return incident
+
+    @staticmethod
+    def findJoiningEdge(point_id, incident, used):
+        ''' Returns the index of the first unused edge that ends at the point id, or
+        None if there is none. Used edges are popped from the (reversed) incident 
+        list as they are passed.'''
+        edges = incident.get(point_id)
+        while edges:
+            if not used[edges[-1]]: return edges[-1]
+            edges.pop()
+        return None
 
     # Service Functions
     @staticmethod
@@ -282,4 +498,56 @@ class Slicer:
             for i in range(3):
                 if vertex[i] < limits[i*2]: limits[i*2] = vertex[i]
                 if vertex[i] > limits[i*2+1]: limits[i*2+1] = vertex[i]
-        return limits
\ No newline at end of file
+        return limits
+
+def findExactCrossings(vertices, z_planes, bottom=None):
+    ''' Returns the segments where the faces cross the slice planes, on an integer
+    grid. Returns the index of the plane of each segment (sorted), the segments as 
+    an [n x 2 x 2] int64 array of x, y end points, and the index of the face of each
+    segment.
+
+    Inputs
+    ---
+    vertices : [m x 3 x 3] int64 np.array
+        The vertices of each face, in multiples of the grid size
+    z_planes : [k] int64 np.array
+        The sorted heights of the slice planes, in multiples of the grid size
+    bottom : int, optional
+        The height of the bottom of the part. Defaults to the lowest vertex, and 
+        must be given when the faces are only a part of the mesh.
+    '''
+    z = vertices[:, :, 2]
+    z_min, z_max = z.min(axis=1), z.max(axis=1)
+    # A face crosses a plane if it has vertices below and above it, where vertices
+    # on the plane count as above (or below for planes at the bottom of the part)
+    if bottom == None: bottom = z.min()
+    strict = z_planes <= bottom
+    first = np.searchsorted(z_planes, z_min, 'right')
+    counts = np.searchsorted(z_planes, z_max, 'right') - first
+    face_ids = np.repeat(np.arange(len(z)), counts)
+    planes = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(len(face_ids))
+    keep = ~strict[planes]
+    face_ids, planes = face_ids[keep], planes[keep]
+    for p in np.flatnonzero(strict):
+        faces = np.flatnonzero((z_min <= z_planes[p]) & (z_max > z_planes[p]))
+        face_ids = np.concatenate([face_ids, faces])
+        planes = np.concatenate([planes, np.full(len(faces), p)])
+
+    zq = z_planes[planes]
+    v = vertices[face_ids]
+    above = (v[:, :, 2] > zq[:, None]) | (~strict[planes][:, None] & (v[:, :, 2] == zq[:, None]))
+    lone_above = above.sum(axis=1) == 1
+    lone = np.where(lone_above, np.argmax(above, axis=1), np.argmin(above, axis=1))
+    rows = np.arange(len(v))
+    ends = list()
+    for step in (1, 2):
+        a, b = v[rows, lone], v[rows, (lone + step) % 3]
+        low = np.where(lone_above[:, None], b, a)
+        high = np.where(lone_above[:, None], a, b)
+        offset = mthd.roundDivide((high[:, 0:2] - low[:, 0:2]) * (zq - low[:, 2])[:, None],
+                                  (high[:, 2] - low[:, 2])[:, None])
+        ends.append(low[:, 0:2] + offset)
+    segments = np.stack(ends, axis=1)
+    keep = (segments[:, 0] != segments[:, 1]).any(axis=1)
+    order = np.argsort(planes[keep], kind='stable')
+    return planes[keep][order], segments[keep][order], face_ids[keep][order]
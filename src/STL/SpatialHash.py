@@ -0,0 +1,177 @@
+from itertools import product
+import numpy as np
+
+'''A tolerance-aware spatial hash for finding similar points or vectors in bulk.
+
+Points are binned into a grid of cells twice as large as the tolerance, so any
+match of a point lies in the cell of the point or one of the 2^d - 1 neighbours on
+the nearer side of it. The cells are hashed to a single integer key and kept sorted,
+so a batch of queries is one binary search per candidate cell followed by an exact
+check of the candidates, rather than a scan over every stored point.
+'''
+class SpatialHash:
+    def __init__(self, tol=0.01, metric='l1', dim=3):
+        ''' An index of points that finds the stored points similar to a query.
+
+        Inputs
+        ---
+        tol : float, default: 0.01
+            The tolerance for two points to be similar
+        metric : str ("l1" or "angular"), default: "l1"
+            For "l1", points are similar if the sum of the absolute differences of
+            their coordinates is at most tol (as in Methods.checkSimilarTuples). For
+            "angular", points are treated as vectors, which are similar if they are
+            parallel or antiparallel within tol of 1 - |cos| (as in
+            Methods.checkSimilarVectors).
+        dim : int, default: 3
+            The number of coordinates of each point
+        '''
+        self.tol = tol
+        self.metric = metric
+        self.dim = dim
+        radius = np.sqrt(2 * tol) if metric == 'angular' else tol #Chord length of the angle
+        self.cell = 2 * max(radius, 1e-12)
+        self.points = np.zeros((0, dim))
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.order = np.zeros(0, dtype=int)
+
+    def __len__(self):
+        return len(self.points)
+
+    def insert(self, points, unique=True):
+        ''' Adds the [n x dim] points to the index and returns the index of the stored
+        point for each of them. If unique, a point similar to a stored point (or to an
+        earlier point of the batch) is not added, and the index of the earliest
+        similar point is returned instead, as with repeated calls to
+        Methods.safeAppend.'''
+        pnts = self.toArray(points)
+        if not unique: return self.add(pnts)
+        # Exact copies (such as a vertex shared by many faces) are collapsed first, so
+        # the number of similar pairs stays linear in the number of points
+        _, first, inverse = np.unique(pnts, axis=0, return_index=True, return_inverse=True)
+        order = np.argsort(first)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        return self.insertDistinct(pnts[first[order]])[rank[inverse.reshape(-1)]]
+
+    def insertDistinct(self, pnts):
+        ''' Inserts the points, which must not contain exact copies, as in insert.'''
+        ids = self.query(pnts)
+        new = np.flatnonzero(ids == -1)
+        if len(new) == 0: return ids
+        batch = SpatialHash(self.tol, self.metric, self.dim)
+        batch.add(pnts[new])
+        rep = findEarliestRepresentatives(*batch.queryPairs(pnts[new]), len(new))
+        kept = rep == np.arange(len(new))
+        stored = self.add(pnts[new[kept]])
+        slot = np.cumsum(kept) - 1
+        ids[new] = stored[slot[rep]]
+        return ids
+
+    def query(self, points):
+        ''' Returns the index of the earliest stored point similar to each of the
+        [n x dim] points, or -1 if there is none.'''
+        pnts = self.toArray(points)
+        q_ids, s_ids = self.queryPairs(pnts)
+        out = np.full(len(pnts), -1)
+        first = np.r_[True, q_ids[1:] != q_ids[:-1]] if len(q_ids) > 0 else np.zeros(0, dtype=bool)
+        out[q_ids[first]] = s_ids[first]
+        return out
+
+    def queryPairs(self, points):
+        ''' Returns every pair of a query point and a similar stored point, as two
+        arrays of the index of the query point and of the stored point, sorted by
+        query and then by stored point.'''
+        pnts = self.toArray(points)
+        empty = (np.zeros(0, dtype=int), np.zeros(0, dtype=int))
+        if len(pnts) == 0 or len(self.points) == 0: return empty
+        coords = self.normalize(pnts)
+        q_index = np.arange(len(pnts))
+        if self.metric == 'angular':
+            coords = np.concatenate([coords, -coords])
+            q_index = np.concatenate([q_index, q_index])
+        # A match lies within half a cell of the point along each axis, so only the 
+        # cell of the point and its neighbours on the nearer side need to be searched
+        scaled = coords / self.cell
+        cells = np.floor(scaled).astype(np.int64)
+        side = np.where(scaled - cells < 0.5, -1, 1)
+        shifts = np.array(list(product((0, 1), repeat=self.dim)), dtype=np.int64)
+        keys = hashCells((cells[None, :, :] + shifts[:, None, :] * side[None, :, :]).reshape(-1, self.dim))
+        q_index = np.tile(q_index, len(shifts))
+        sorted_keys = self.keys[self.order]
+        low = np.searchsorted(sorted_keys, keys, 'left')
+        counts = np.searchsorted(sorted_keys, keys, 'right') - low
+        rows = np.repeat(np.arange(len(keys)), counts)
+        local = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+        q_ids = q_index[rows]
+        s_ids = self.order[low[rows] + local]
+        similar = self.isSimilar(pnts[q_ids], self.points[s_ids])
+        # Hash collisions can return a stored point more than once
+        pairs = np.unique(q_ids[similar] * len(self.points) + s_ids[similar])
+        return pairs // len(self.points), pairs % len(self.points)
+
+    # Service Functions
+    def toArray(self, points):
+        ''' Returns the points as an [n x dim] float array.'''
+        return np.asarray(points, dtype=float).reshape(-1, self.dim)
+
+    def add(self, pnts):
+        ''' Stores the points without checking for similar points and returns their
+        indices.'''
+        ids = np.arange(len(self.points), len(self.points) + len(pnts))
+        cells = np.floor(self.normalize(pnts) / self.cell).astype(np.int64)
+        self.points = np.concatenate([self.points, pnts])
+        self.keys = np.concatenate([self.keys, hashCells(cells)])
+        self.order = np.argsort(self.keys, kind='stable')
+        return ids
+
+    def normalize(self, pnts):
+        ''' Returns the coordinates used to bin the points. Vectors are scaled to
+        unit length for the angular metric.'''
+        if self.metric != 'angular': return pnts
+        length = np.linalg.norm(pnts, axis=1)
+        return pnts / np.where(length == 0, 1, length)[:, None]
+
+    def isSimilar(self, a, b):
+        ''' Returns a boolean array that is True for each pair of rows of a and b
+        that are similar.'''
+        if self.metric != 'angular': return np.abs(a - b).sum(axis=1) <= self.tol
+        a, b = self.normalize(a), self.normalize(b)
+        return 1 - np.abs((a * b).sum(axis=1)) < self.tol
+
+def hashCells(cells):
+    ''' Returns a single integer key for each row of integer cell coordinates.'''
+    primes = np.array([73856093, 19349663, 83492791, 2654435761], dtype=np.int64)
+    keys = np.zeros(len(cells), dtype=np.int64)
+    for i in range(cells.shape[1]):
+        keys ^= cells[:, i] * primes[i % len(primes)]
+    return keys
+
+def findEarliestRepresentatives(q_ids, s_ids, num_points):
+    ''' Returns the index of the point each point is merged into when the points are
+    added in order and each point is dropped if it is similar to an earlier kept
+    point (the point itself if kept). The similar pairs (q, s) are given for all
+    points, and the points are decided in rounds, so a round only waits on points
+    whose earlier neighbours are still undecided.'''
+    earlier = s_ids < q_ids
+    q_ids, s_ids = q_ids[earlier], s_ids[earlier]
+    rep = np.full(num_points, -1)
+    while (rep == -1).any():
+        undecided = rep == -1
+        kept = rep[s_ids] == s_ids
+        waiting = np.zeros(num_points, dtype=bool)
+        waiting[q_ids[rep[s_ids] == -1]] = True
+        merge = np.full(num_points, num_points)
+        np.minimum.at(merge, q_ids[kept], s_ids[kept])
+        dropped = undecided & (merge < num_points)
+        rep[dropped] = merge[dropped]
+        new_kept = undecided & ~dropped & ~waiting
+        rep[new_kept] = np.flatnonzero(new_kept)
+    return rep
+
+def uniquePoints(points, tol=0.01, metric='l1'):
+    ''' Returns the points (an [n x d] array) with similar points removed, keeping
+    the first of each, and the index of the kept point for each of the points.'''
+    pnts = np.asarray(points, dtype=float)
+    index = SpatialHash(tol, metric, pnts.shape[1]).insert(pnts)
+    return pnts[np.unique(index, return_index=True)[1]], index
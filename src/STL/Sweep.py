@@ -0,0 +1,156 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+import itertools
+import numpy as np
+
+from src.STL.ReadSTL import STL
+from src.STL.SliceSTL import Slicer
+from src.STL.Simplify import simplifySlices
+from src.STL.Extrusion import LayerBuilder, PrintTotals, calcInfillData, calcInfillCoord, PRINTING_SPEED, TRAVEL_SPEED
+
+'''Set of functions for sweeping the slicing parameters of a part, to compare the
+time, mass and length of prints with different layer heights, wall thicknesses and
+infill densities.
+
+Each print is split into stages, and each stage only depends on the parameters it
+uses: the slices on the layer height, the walls (and the region left for infill)
+also on the number of walls, the infill also on the infill density, and the final
+ordering of each layer on all three. The stages of every configuration form one
+dependency graph in which each distinct stage appears once, so configurations that
+share a layer height share one slicing, and a stage runs as soon as the stages it
+depends on have finished. The totals are the same as those of an Extrusion with the
+same parameters.
+'''
+class Stage:
+    def __init__(self, function, args=(), deps=()):
+        ''' A node of a stage graph. The function is called with the results of the
+        stages named in deps, followed by args. The function must be defined at the
+        top level of a module to run in a process pool.'''
+        self.function = function
+        self.args = tuple(args)
+        self.deps = tuple(deps)
+
+def runGraph(stages: dict, keep=None, workers=1, executor='process'):
+    ''' Runs each stage of the graph once, as soon as the stages it depends on have
+    finished, and returns a dictionary of the results by key.
+
+    Inputs
+    ---
+    stages : dict
+        The Stage objects of the graph by key (any hashable name).
+    keep : list, optional
+        The keys of the results to return. The results of other stages are released
+        once every stage that depends on them has started. Defaults to every stage.
+    workers : int, default: 1
+        The number of stages run at once.
+    executor : str ("process" or "thread"), default: "process"
+        The type of pool used when workers is greater than 1.
+    '''
+    keep = set(stages) if keep == None else set(keep)
+    users = {key: 0 for key in stages}
+    for stage in stages.values():
+        for dep in stage.deps: users[dep] += 1
+    results = dict()
+    waiting = dict(stages)
+    running = dict()
+
+    def start(key, submit):
+        stage = waiting.pop(key)
+        args = [results[dep] for dep in stage.deps] + list(stage.args)
+        for dep in stage.deps:
+            users[dep] -= 1
+            if users[dep] == 0 and dep not in keep: del results[dep]
+        return submit(stage.function, *args)
+
+    def ready():
+        return [key for key, stage in waiting.items() if all(dep in results for dep in stage.deps)]
+
+    if workers <= 1:
+        while len(waiting) > 0:
+            keys = ready()
+            if len(keys) == 0: raise ValueError('The stage graph has a cycle or a missing stage')
+            for key in keys: results[key] = start(key, lambda f, *args: f(*args))
+        return results
+    pool = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+    with pool(max_workers=workers) as ex:
+        while len(waiting) > 0 or len(running) > 0:
+            for key in ready(): running[start(key, ex.submit)] = key
+            if len(running) == 0: raise ValueError('The stage graph has a cycle or a missing stage')
+            done = wait(running, return_when=FIRST_COMPLETED)[0]
+            for future in done: results[running.pop(future)] = future.result()
+    return results
+
+def sweepPrint(stl: STL, layer_heights, wall_thicknesses, infill_densities, workers=1,
+               executor='process', simplify_tol=0.01, resolution=None, order_paths=True,
+               two_opt_time=0., connect_infill=False):
+    ''' Returns a table of the totals of the print for every combination of the
+    parameters, as a list of dictionaries (one row per combination, in the order of
+    itertools.product) with the keys layer_height, wall_thickness, infill_density,
+    length_of_print, travel_length, time_to_print and mass. The mass is in grams of
+    PLA, as Extrusion.printMass.
+
+    Inputs
+    ---
+    stl : STL
+    layer_heights, wall_thicknesses, infill_densities : lists of floats
+        The values of each parameter, as for the Extrusion class.
+    workers : int, default: 1
+        The number of stages run at once (see runGraph).
+    executor : str ("process" or "thread"), default: "process"
+        The type of pool used when workers is greater than 1.
+    simplify_tol, resolution, order_paths, two_opt_time, connect_infill
+        As for the Extrusion class, and shared by every combination.
+    '''
+    if resolution == None: resolution = stl.resolution
+    limits = Slicer.findMaxAndMinLimits(stl)
+    stages = dict()
+    configs = list()
+    for layer_height, wall_thickness, infill_density in itertools.product(layer_heights, wall_thicknesses, infill_densities):
+        density = abs(infill_density) if abs(infill_density) <= 1 else 1
+        num_walls = max(1, int(round(wall_thickness / layer_height, 6)))
+        slice_key = ('slice', layer_height)
+        wall_key = ('walls', layer_height, num_walls)
+        infill_key = ('infill', layer_height, num_walls, density)
+        print_key = ('print', layer_height, num_walls, density)
+        configs.append((layer_height, wall_thickness, infill_density, print_key))
+        if print_key in stages: continue
+        horz_coord, vert_coord = calcInfillCoord(limits, calcInfillData(layer_height, density))
+        horz_lines = np.array([c[1] for c in horz_coord])
+        vert_lines = np.array([c[0] for c in vert_coord])
+        builder = LayerBuilder(horz_lines, vert_lines, PRINTING_SPEED, num_walls, layer_height,
+                               resolution, TRAVEL_SPEED, order_paths, two_opt_time, connect_infill)
+        stages.setdefault(slice_key, Stage(sliceStage, (stl, layer_height, simplify_tol, resolution)))
+        stages.setdefault(wall_key, Stage(wallStage, (builder,), (slice_key,)))
+        stages[infill_key] = Stage(infillStage, (builder,), (wall_key,))
+        stages[print_key] = Stage(printStage, (builder,), (wall_key, infill_key))
+    results = runGraph(stages, [config[3] for config in configs], workers, executor)
+    table = list()
+    for layer_height, wall_thickness, infill_density, key in configs:
+        totals = results[key]
+        table.append(dict(layer_height=layer_height, wall_thickness=wall_thickness,
+                          infill_density=infill_density, length_of_print=totals.length_of_print,
+                          travel_length=totals.travel_length, time_to_print=totals.time_to_print,
+                          mass=totals.printMass()))
+    return table
+
+def sliceStage(stl: STL, layer_height, simplify_tol, resolution):
+    ''' Returns the simplified slices of the STL, as Extrusion.sliceModel.'''
+    slicer = Slicer(stl, layer_height, resolution=resolution)
+    slicer.sliceSTL()
+    return simplifySlices(slicer.slices, simplify_tol)[0]
+
+def wallStage(slices: list, builder: LayerBuilder):
+    ''' Returns the z datum, the wall paths and the region left for infill of each
+    slice.'''
+    return [(slice.z_datum, builder.makeWalls(slice), builder.getInfillBoundary(slice)) for slice in slices]
+
+def infillStage(walls: list, builder: LayerBuilder):
+    ''' Returns the infill paths of each slice, from the output of wallStage.'''
+    return [list() if region == None else builder.fillRegion(region, z) for z, paths, region in walls]
+
+def printStage(walls: list, infill: list, builder: LayerBuilder):
+    ''' Orders the paths of each layer and returns the PrintTotals of the print, as
+    counted by an Extrusion.'''
+    totals = PrintTotals(builder.printing_speed, builder.travel_speed)
+    for (z, paths, region), infill_paths in zip(walls, infill):
+        totals.countLayer(*builder.finishLayer(paths + infill_paths))
+    return totals
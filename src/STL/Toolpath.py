@@ -0,0 +1,140 @@
+import json
+import numpy as np
+
+'''A compact binary container for the paths of an Extrusion, which can be memory
+mapped to read any layer without loading (or recomputing) the rest of the print.
+
+Layout (little-endian)
+---
+    magic "TOOLPATH" (8 bytes), version and parameter length (2 x uint32)
+    table of 8 int64: number of layers, paths and points, followed by the byte
+        offsets of the points, path offsets, path kinds, layer offsets and layer z
+    parameters as JSON, padded to 8 bytes
+    points : [num_points x 2] float64 x, y coordinates, or [num_points x 3] x, y, z
+        coordinates if the parameter "point_z" is true
+    path offsets : [num_paths + 1] int64 index of the first point of each path
+    path kinds : [num_paths] uint8 index into PATH_KINDS
+    layer offsets : [num_layers + 1] int64 index of the first path of each layer
+    layer z : [num_layers] float64 height of each layer
+
+The points are written first, so a file can be written while the layers are still
+being generated. The index arrays follow once their length is known. Points only
+carry their own z for paths that change height within a layer (a spiral vase);
+otherwise every point of a layer is at the layer z. Version 1 files never have it.
+'''
+MAGIC = b'TOOLPATH'
+VERSION = 2
+PATH_KINDS = ('wall', 'infill', 'travel')
+TABLE_SIZE = 16 + 8 * 8
+
+def writeToolpath(filepath, layers, z_values, params=None, point_z=False):
+    ''' Writes the layers (an iterable of lists of Path objects) to a toolpath file,
+    one layer at a time. z_values is an iterable with the height of each layer, which
+    is used for layers without paths. params is a dictionary of values that can be
+    written as JSON, such as the slicing parameters. If point_z is True the z of
+    each point is stored as well.'''
+    params = dict(params) if params != None else dict()
+    if point_z: params['point_z'] = True
+    columns = 3 if point_z else 2
+    header = json.dumps(params).encode()
+    header += b' ' * (-len(header) % 8)
+    path_offsets = [0]
+    kinds = list()
+    layer_offsets = [0]
+    layer_z = list()
+    with open(filepath, 'wb') as f:
+        f.write(b'\0' * TABLE_SIZE + header)
+        off_points = f.tell()
+        for paths, z in zip(layers, z_values):
+            for path in paths:
+                pnts = np.asarray(path.points, dtype='<f8').reshape(-1, 3)
+                f.write(np.ascontiguousarray(pnts[:, 0:columns]).tobytes())
+                path_offsets.append(path_offsets[-1] + len(pnts))
+                kinds.append(PATH_KINDS.index(getattr(path, 'kind', 'wall')))
+            layer_offsets.append(len(kinds))
+            layer_z.append(z)
+        offsets = list()
+        for array in (np.array(path_offsets, dtype='<i8'), np.array(kinds, dtype=np.uint8),
+                      np.array(layer_offsets, dtype='<i8'), np.array(layer_z, dtype='<f8')):
+            f.write(b'\0' * (-f.tell() % 8))
+            offsets.append(f.tell())
+            f.write(array.tobytes())
+        counts = [len(layer_z), len(kinds), path_offsets[-1]]
+        f.seek(0)
+        f.write(MAGIC + np.array([VERSION, len(header)], dtype='<u4').tobytes())
+        f.write(np.array(counts + [off_points] + offsets, dtype='<i8').tobytes())
+
+class Toolpath:
+    def __init__(self, points, path_offsets, kinds, layer_offsets, layer_z, params=None):
+        ''' The arrays of a set of extruder paths, grouped into layers. The arrays
+        are described in the module docstring.
+
+        Contents for Calling
+        ---
+        params : dict
+            The parameters of the print, such as the slicing parameters
+        num_layers, num_paths, num_points : int
+        points : [num_points x 2] or [num_points x 3] np.array
+            The x, y (and z) coordinates of every point
+        path_offsets, kinds, layer_offsets, layer_z : np.array
+            The index arrays described in the module docstring
+        '''
+        self.points = points
+        self.path_offsets = path_offsets
+        self.kinds = kinds
+        self.layer_offsets = layer_offsets
+        self.layer_z = layer_z
+        self.params = params if params != None else dict()
+        self.num_layers = len(layer_z)
+        self.num_paths = len(kinds)
+        self.num_points = len(points)
+
+    def __len__(self):
+        return self.num_layers
+
+    def getLayerArrays(self, index):
+        ''' Returns the points of the layer as an [n x 2] (or [n x 3]) array, the
+        offsets of its paths into those points (starting at 0), and the kind of each
+        path. The points are a view of the stored (or memory mapped) array.'''
+        first, last = self.layer_offsets[index], self.layer_offsets[index + 1]
+        offsets = np.array(self.path_offsets[first:last + 1])
+        pnts = self.points[offsets[0]:offsets[-1]]
+        return pnts, offsets - offsets[0], np.array(self.kinds[first:last])
+
+    def getLayerPaths(self, index, path_type=None):
+        ''' Returns the layer as a list of objects of path_type (by default
+        Extrusion.Path). Points without a stored z take the layer height.'''
+        if path_type == None: from src.STL.Extrusion import Path as path_type
+        pnts, offsets, kinds = self.getLayerArrays(index)
+        if pnts.shape[1] > 2:
+            xyz = [tuple(pnt) for pnt in pnts[:, 0:3].tolist()]
+        else:
+            z = float(self.layer_z[index])
+            xyz = [(x, y, z) for x, y in pnts.tolist()]
+        return [path_type(xyz[a:b], PATH_KINDS[k]) for a, b, k in
+                zip(offsets[:-1].tolist(), offsets[1:].tolist(), kinds.tolist())]
+
+class ToolpathFile(Toolpath):
+    def __init__(self, filepath):
+        ''' A read-only, memory mapped view of a toolpath file. Only the arrays of
+        the layers that are accessed are read from disk.'''
+        self.filepath = filepath
+        with open(filepath, 'rb') as f:
+            start = f.read(TABLE_SIZE)
+            if start[0:8] != MAGIC: raise ValueError(filepath + ' is not a toolpath file')
+            version, param_len = np.frombuffer(start[8:16], dtype='<u4')
+            if version > VERSION: raise ValueError('Unsupported toolpath version: ' + str(version))
+            table = np.frombuffer(start[16:], dtype='<i8').tolist()
+            params = json.loads(f.read(int(param_len)).decode())
+        num_layers, num_paths, num_points = table[0:3]
+        columns = 3 if params.get('point_z') else 2
+        super().__init__(self.mapArray('<f8', table[3], (num_points, columns)),
+                         self.mapArray('<i8', table[4], (num_paths + 1,)),
+                         self.mapArray(np.uint8, table[5], (num_paths,)),
+                         self.mapArray('<i8', table[6], (num_layers + 1,)),
+                         self.mapArray('<f8', table[7], (num_layers,)), params)
+
+    def mapArray(self, dtype, offset, shape):
+        ''' Returns a read-only memory map of an array in the file.'''
+        if np.prod(shape) == 0: return np.zeros(shape, dtype=dtype)
+        return np.memmap(self.filepath, dtype=dtype, mode='r', offset=offset, shape=shape)
@@ -0,0 +1,78 @@
+import numpy as np
+
+from src.STL.SliceSTL import Slice
+import src.STL.Methods as mthd
+
+'''Set of functions for spiral vase printing, in which the outer contour of every
+layer is joined into one continuous helical path that rises steadily in z, with no
+infill and no seam or stop between layers.
+
+Each contour is turned counter-clockwise and started at the point nearest the start
+of the contour below it. Both contours are then sampled at the arc length fractions
+of the vertices of either one, so the corners of both are kept, and each point of
+the loop is blended from the contour below to its own contour as the loop goes
+around, while z rises by one layer height. Each loop starts exactly where the last
+one ended.
+'''
+def outerContour(slice: Slice):
+    ''' Returns the points of the outer hull of the slice with the largest area, as
+    an [n x 2] array, or None if the slice has no outer hull.'''
+    outers = [i for i in range(len(slice.hulls)) if slice.isOuter(i)]
+    if len(outers) == 0: return None
+    i = max(outers, key=lambda i: slice.areas[i])
+    return slice.hulls[i].getArray()
+
+def alignContour(pnts, start=None):
+    ''' Returns the closed contour (first point repeated at the end) running
+    counter-clockwise, starting at the point nearest to start if given.'''
+    pnts = np.asarray(pnts, dtype=float)[:, 0:2]
+    if len(pnts) > 1 and (pnts[0] == pnts[-1]).all(): pnts = pnts[:-1]
+    if mthd.signedArea(pnts) < 0: pnts = pnts[::-1]
+    if start is not None:
+        pnts = np.roll(pnts, -int(np.argmin(np.linalg.norm(pnts - start, axis=1))), axis=0)
+    return np.vstack([pnts, pnts[0:1]])
+
+def contourFractions(closed):
+    ''' Returns the fraction of the length of the closed contour at each point.'''
+    length = np.concatenate([[0], np.cumsum(np.linalg.norm(np.diff(closed, axis=0), axis=1))])
+    return length / length[-1] if length[-1] > 0 else np.linspace(0, 1, len(closed))
+
+def sampleContour(closed, fractions, at):
+    ''' Returns the points of the closed contour at the fractions of its length.'''
+    return np.column_stack([np.interp(at, fractions, closed[:, 0]), np.interp(at, fractions, closed[:, 1])])
+
+def spiralLoop(below, contour, z_below, z):
+    ''' Returns one loop of the spiral as an [n x 3] array, blended from the closed
+    contour below (at z_below) to the closed contour (at z). Both contours must be
+    aligned (see alignContour). The loop starts at the start of the contour below
+    and ends at the start of the contour.'''
+    f_below, f = contourFractions(below), contourFractions(contour)
+    at = np.unique(np.concatenate([f_below, f]))
+    t = at[:, None]
+    xy = (1 - t) * sampleContour(below, f_below, at) + t * sampleContour(contour, f, at)
+    return np.column_stack([xy, z_below + at * (z - z_below)])
+
+class SpiralBuilder:
+    def __init__(self):
+        ''' Builds the spiral one slice at a time, from the bottom up. The first
+        slice is printed as a flat loop, and every later slice as a loop rising
+        from the slice below.'''
+        self.below = None
+        self.z_below = None
+
+    def __call__(self, slice: Slice):
+        ''' Returns the loop of the spiral for the slice as an [n x 3] array, or None
+        if the slice has no outer hull.'''
+        pnts = outerContour(slice)
+        if pnts is None:
+            self.below = None
+            return None
+        z = float(slice.z_datum)
+        if self.below is None:
+            contour = alignContour(pnts)
+            loop = np.column_stack([contour, np.full(len(contour), z)])
+        else:
+            contour = alignContour(pnts, self.below[0])
+            loop = spiralLoop(self.below, contour, self.z_below, z)
+        self.below, self.z_below = contour, z
+        return loop
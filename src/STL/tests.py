@@ -16,4 +16,40 @@ plotter.plotExtrudedUptoLayer(100)
 plotter.align(90, 270, 'z')
 # plotter.setLimits((-33, -15), (33, 15)) 
 
+# %%
+# Offsetting a thin ring inwards by more than half its width leaves nothing
+import numpy as np
+from src.STL.SliceSTL import Slice
+from src.STL.PolygonOffset import offsetSlice, makeHull
+angles = np.linspace(0, 2 * np.pi, 64, endpoint=False)
+circle = np.column_stack([np.cos(angles), np.sin(angles)])
+ring = Slice([makeHull(10 * circle, 0.), makeHull(9.6 * circle[::-1], 0.)])
+assert offsetSlice(ring, -0.5) == None
+assert len(offsetSlice(ring, -0.1).hulls) == 2
+
+# %%
+# Infill printed once for a group of layers uses as much material as infill on every layer
+from src.STL.ReadSTL import STL
+from src.STL.Extrusion import Extrusion
+stl = STL("../../Sample STL Files/Cube 432.stl")
+single = Extrusion(stl, infill_layers=1)
+grouped = Extrusion(stl, infill_layers=3)
+assert abs(grouped.printMass() / single.printMass() - 1) < 0.05
+assert grouped.time_to_print < single.time_to_print
+
+# %%
+# G-code commands with a decimal part (such as G92.1) are not read as G92 or moves
+import os
+import tempfile
+import numpy as np
+from src.STL.ReadGCode import readGCode, parseCodes
+line = b'G92.1 \nG1.5 X\nG1 X\ng92 \n' + bytes(16)
+buf = np.frombuffer(line, dtype=np.uint8)
+assert parseCodes(buf, np.array([0, 7, 14, 19])).tolist() == [-1, -1, 1, 92]
+with tempfile.NamedTemporaryFile('w', suffix='.gcode', delete=False) as f:
+    f.write('G1 X0 Y0 E0\nG1 X10 Y0 E1\nG92.1 X50\nG1.5 X80 Y80 E2\nG1 X10 Y10 E3\n')
+toolpath = readGCode(f.name)
+os.remove(f.name)
+assert np.asarray(toolpath.points).tolist() == [[0, 0], [10, 0], [10, 10]]
+
 # %%
\ No newline at end of file
@@ -256,8 +256,5 @@ class tkSTL_Plot:
         except Exception as e: print(e)
 
     def createOutput(self, *args):
-        self.plotter.savePaths()
-        cur_path = os.path.dirname(__file__)
-        og_filepath = os.path.join(cur_path, '..', 'curr_paths.txt')
-        new_filepath = filedialog.asksaveasfilename()
-        os.rename(og_filepath, new_filepath)
+        filepath = filedialog.asksaveasfilename(defaultextension='.gcode')
+        if filepath: self.plotter.savePaths(filepath)